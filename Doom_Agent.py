@@ -13,6 +13,8 @@ controlled by an entropy beta parameter."
 """
 from os.path import exists
 import os
+import time
+import warnings
 import numpy as np
 import torch as T
 import torch.optim as optim
@@ -24,21 +26,50 @@ import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 
+from Doom_Labels import NUM_LABEL_FEATURES, NO_ENEMY_FEATURES
+from Doom_Checkpoint import CheckpointWriter, atomic_save
+
+def compute_gae(reward_arr, values, dones_arr, gamma, gae_lambda):
+    """
+    GAE as a single reverse scan; O(n) instead of the old nested loop.
+    a_t = delta_t + gamma*lambda*a_t+1, with the last timestep left at zero.
+    """
+    rewards = np.asarray(reward_arr, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    not_dones = 1.0 - np.asarray(dones_arr, dtype=np.float64)
+    advantage = np.zeros(len(rewards), dtype=np.float32)
+    if len(rewards) < 2:
+        return advantage
+
+    #every td-error at once: r_k + gamma*V_k+1*(1-done_k) - V_k
+    deltas = rewards[:-1] + gamma*values[1:]*not_dones[:-1] - values[:-1]
+    decay = gamma*gae_lambda
+
+    a_t = 0.0
+    scan = deltas.tolist() #python floats are much faster to loop over than np scalars.
+    for t in range(len(scan)-1, -1, -1):
+        a_t = scan[t] + decay*a_t
+        scan[t] = a_t
+    advantage[:-1] = scan
+    return advantage
+
 #The PPO model structure
 class CNNActor(nn.Module):
 
-    def __init__(self, num_inputs, num_actions, alpha, file_name='pretrained_model/current_model_actor.pth'):
+    def __init__(self, num_inputs, num_actions, alpha, file_name='pretrained_model/current_model_actor.pth',
+                 num_extra=0):
         super(CNNActor, self).__init__()
         
         self.checkpoint_file = file_name
         self.number_of_actions = num_actions # How many output acitons?
         self.flat_size = 9216
+        self.num_extra = num_extra #non-image inputs joined to the flattened convs (label features).
 
         self.conv1 = nn.Conv2d(4, 32, 8, 4) #in_channels, out_channels, kernel_size, stride, padding
         self.conv2 = nn.Conv2d(32, 64, 4, 2)
         self.conv3 = nn.Conv2d(64, 64, 3, 1)
 
-        self.linear = nn.Linear(self.flat_size, 512)
+        self.linear = nn.Linear(self.flat_size + num_extra, 512)
         self.actor_linear = nn.Linear(512, num_actions)
         self.home_dir = os.getcwd()
 
@@ -61,35 +92,40 @@ class CNNActor(nn.Module):
                 # nn.init.kaiming_uniform_(module.weight)
                 nn.init.constant_(module.bias, 0)
 
-    def forward(self, x):
+    def forward(self, x, extra=None):
         out = F.relu(self.conv1(x))
         out = F.relu(self.conv2(out))
         out = F.relu(self.conv3(out))
-        out = self.linear(out.view(out.size(0), -1))
+        out = out.view(out.size(0), -1)
+        if extra is not None:
+            out = T.cat((out, extra), 1)
+        out = self.linear(out)
         #print(f'***Flattened Shape: {out.shape}***') #This needs to be calculater as this image shape needs to feed into next layer.
         return self.actor_linear(out)
 
-    def save_checkpoint(self, file_name='pretrained_model/current_model_actor.pth'):
+    def save_checkpoint(self, file_name=None):
         os.chdir(self.home_dir) #make sure we're in the main folder
-        T.save(self.state_dict(), file_name)
+        atomic_save(self.state_dict(), file_name or self.checkpoint_file)
 
-    def load_checkpoint(self, file_name='pretrained_model/current_model_actor.pth'):
+    def load_checkpoint(self, file_name=None):
         os.chdir(self.home_dir) #make sure we're in the main folder
-        self.load_state_dict(T.load(file_name)) #strict=False
+        self.load_state_dict(T.load(file_name or self.checkpoint_file)) #strict=False
 
 class CNNCritic(nn.Module):
 
-    def __init__(self, num_inputs, num_actions, alpha, file_name='pretrained_model/current_model_critic.pth'):
+    def __init__(self, num_inputs, num_actions, alpha, file_name='pretrained_model/current_model_critic.pth',
+                 num_extra=0):
         super(CNNCritic, self).__init__()
         
         self.checkpoint_file = file_name
         self.flat_size = 9216
+        self.num_extra = num_extra #non-image inputs joined to the flattened convs (label features).
 
         self.conv1 = nn.Conv2d(4, 32, 8, 4) #in_channels, out_channels, kernel_size, stride, padding
         self.conv2 = nn.Conv2d(32, 64, 4, 2)
         self.conv3 = nn.Conv2d(64, 64, 3, 1)
 
-        self.linear = nn.Linear(self.flat_size, 512)
+        self.linear = nn.Linear(self.flat_size + num_extra, 512)
         self.critic_linear = nn.Linear(512, 1)
 
         self.home_dir = os.getcwd()
@@ -113,64 +149,324 @@ class CNNCritic(nn.Module):
                 # nn.init.kaiming_uniform_(module.weight)
                 nn.init.constant_(module.bias, 0)
 
-    def forward(self, x):
+    def forward(self, x, extra=None):
         out = F.relu(self.conv1(x))
         out = F.relu(self.conv2(out))
         out = F.relu(self.conv3(out))
-        out = self.linear(out.view(out.size(0), -1))
+        out = out.view(out.size(0), -1)
+        if extra is not None:
+            out = T.cat((out, extra), 1)
+        out = self.linear(out)
         #print(f'***Flattened Shape: {out.shape}***') #This needs to be calculater as this image shape needs to feed into next layer.
         return self.critic_linear(out)
 
-    def save_checkpoint(self, file_name='pretrained_model/current_model_critic.pth'):
+    def save_checkpoint(self, file_name=None):
         os.chdir(self.home_dir) #make sure we're in the main folder
-        T.save(self.state_dict(), file_name)
+        atomic_save(self.state_dict(), file_name or self.checkpoint_file)
 
-    def load_checkpoint(self, file_name='pretrained_model/current_model_critic.pth'):
+    def load_checkpoint(self, file_name=None):
         os.chdir(self.home_dir) #make sure we're in the main folder
-        self.load_state_dict(T.load(file_name)) #strict=False
+        self.load_state_dict(T.load(file_name or self.checkpoint_file)) #strict=False
+
+class CNNActorCritic(nn.Module):
+    """
+    Shared trunk layout: CNNActor and CNNCritic have identical conv1-conv3 + 9216->512
+    layers, so here they are computed once and split into the two heads.
+    One forward pass per step instead of two.
+
+    With no shared checkpoint yet, it migrates from the split actor/critic checkpoints:
+    the trunk and actor head come from the actor, the critic head from the critic.
+    """
+    def __init__(self, num_inputs, num_actions, actor_alpha, critic_alpha,
+                 file_name='pretrained_model/current_model_shared.pth',
+                 actor_file='pretrained_model/current_model_actor.pth',
+                 critic_file='pretrained_model/current_model_critic.pth', num_extra=0):
+        super(CNNActorCritic, self).__init__()
+
+        self.checkpoint_file = file_name
+        self.number_of_actions = num_actions
+        self.flat_size = 9216
+        self.num_extra = num_extra #non-image inputs joined to the flattened convs (label features).
 
-class PPOMemory:
-    def __init__(self, batch_size):
-        self.states = []
-        self.probs = []
-        self.vals = []
-        self.actions = []
-        self.rewards = []
-        self.dones = []
+        self.conv1 = nn.Conv2d(4, 32, 8, 4) #in_channels, out_channels, kernel_size, stride, padding
+        self.conv2 = nn.Conv2d(32, 64, 4, 2)
+        self.conv3 = nn.Conv2d(64, 64, 3, 1)
 
+        self.linear = nn.Linear(self.flat_size + num_extra, 512)
+        self.actor_linear = nn.Linear(512, num_actions)
+        self.critic_linear = nn.Linear(512, 1)
+        self.home_dir = os.getcwd()
+
+        if exists(self.checkpoint_file):
+            self.load_checkpoint(self.checkpoint_file)
+        elif exists(actor_file) and exists(critic_file):
+            print('... migrating split checkpoints', end="")
+            self.load_split_checkpoints(actor_file, critic_file)
+            self.save_checkpoint(self.checkpoint_file)
+        else:
+            self._initialize_weights()
+            self.save_checkpoint(self.checkpoint_file)
+
+        #the trunk trains at the actor rate, the value head keeps its own rate.
+        critic_params = list(self.critic_linear.parameters())
+        critic_ids = {id(p) for p in critic_params}
+        actor_params = [p for p in self.parameters() if id(p) not in critic_ids]
+        self.optimizer = optim.Adam([{'params': actor_params, 'lr': actor_alpha},
+                                     {'params': critic_params, 'lr': critic_alpha}])
+        self.device = T.device('cuda:0' if T.cuda.is_available() else 'cpu')
+        self.to(self.device)
+
+    def _initialize_weights(self):
+        for module in self.modules():
+            if isinstance(module, nn.Conv2d) or isinstance(module, nn.Linear):
+                nn.init.orthogonal_(module.weight, nn.init.calculate_gain('relu'))
+                nn.init.constant_(module.bias, 0)
+
+    def forward(self, x, extra=None):
+        out = F.relu(self.conv1(x))
+        out = F.relu(self.conv2(out))
+        out = F.relu(self.conv3(out))
+        out = out.view(out.size(0), -1)
+        if extra is not None:
+            out = T.cat((out, extra), 1)
+        out = self.linear(out)
+        return self.actor_linear(out), self.critic_linear(out)
+
+    def save_checkpoint(self, file_name=None):
+        os.chdir(self.home_dir) #make sure we're in the main folder
+        atomic_save(self.state_dict(), file_name or self.checkpoint_file)
+
+    def load_checkpoint(self, file_name=None):
+        os.chdir(self.home_dir) #make sure we're in the main folder
+        self.load_state_dict(T.load(file_name or self.checkpoint_file))
+
+    def load_split_checkpoints(self, actor_file='pretrained_model/current_model_actor.pth',
+                               critic_file='pretrained_model/current_model_critic.pth'):
+        """Starts from CNNActor/CNNCritic checkpoints; the critic trunk is dropped."""
+        os.chdir(self.home_dir)
+        state = T.load(actor_file, map_location='cpu')
+        critic_state = T.load(critic_file, map_location='cpu')
+        state['critic_linear.weight'] = critic_state['critic_linear.weight']
+        state['critic_linear.bias'] = critic_state['critic_linear.bias']
+        self.load_state_dict(state)
+
+class ActingModel(nn.Module):
+    """
+    Either layout behind one forward() that returns (logits, value).
+    This is what gets traced for the compiled acting path.
+    """
+    def __init__(self, models):
+        super(ActingModel, self).__init__()
+        self.models = nn.ModuleList(models)
+
+    def forward(self, x, extra=None):
+        if len(self.models) == 1:
+            return self.models[0](x, extra)
+        return self.models[0](x, extra), self.models[1](x, extra)
+
+def frame_ring_capacity(params):
+    """
+    FrameStore size for a run: every frame pushed between two learns (all of them, not
+    just the ~1 in 4 steps that are remembered) plus each env's history and reset frame,
+    or frame_capacity per env if that is more. A single env learns at each game end, so at
+    most total_frames_limit steps apart; the vector loop every learn_cycles_goal steps.
+    """
+    num_envs = params["num_envs"]
+    if num_envs == 1:
+        pushes = params.get("total_frames_limit", params["rollout_capacity"])
+    else:
+        pushes = params.get("learn_cycles_goal", params["rollout_capacity"]) + num_envs #the last step can overshoot.
+    return max(params["frame_capacity"]*num_envs, pushes + 61*num_envs)
+
+class FrameStore:
+    """
+    Keeps every preprocessed frame once, as uint8, in a preallocated ring.
+    A state is just the 4 frame ids it is stacked from; the float stack is only
+    built when it is needed (acting, or at minibatch time in learn).
+    Ids keep counting up and slot = id % capacity, so capacity has to cover every
+    frame a stored state can still point at (one rollout + the 60 frame history);
+    stack() refuses ids that have already been overwritten.
+    With several environments each one keeps its own history; the ring is shared.
+    history and offsets are in game tics; with frame_skip > 1 only every skip'th tic
+    is pushed, so both are rescaled to keep covering the same 1 second of game time.
+    """
+    def __init__(self, capacity, frame_shape=(126, 126), history=60, offsets=(0, 30, 45, 59),
+                 num_envs=1, frame_skip=1):
+        self.capacity = capacity
+        self.frame_shape = frame_shape
+        if frame_skip > 1:
+            scale = (max(history//frame_skip, 1) - 1)/(history - 1) #newest stays on the end.
+            history = max(history//frame_skip, 1)
+            offsets = [int(round(i*scale)) for i in offsets]
+        self.offsets = list(offsets) #positions within the history window, newest last.
+        self.frames = np.zeros((capacity, *frame_shape), dtype=np.uint8)
+        #ids of the most recent frames, per environment.
+        self.histories = [deque(maxlen=history) for _ in range(num_envs)]
+        self.next_id = 0
+
+        #uint8 -> float lookup; exact, and cheaper than a divide per pixel.
+        self.decode = np.arange(256, dtype=np.float32)/255
+
+    def push(self, frame, env=0):
+        """Stores a frame (float in [0,1] or uint8) and returns the id stack of the new state."""
+        frame = np.reshape(frame, self.frame_shape)
+        if frame.dtype != np.uint8:
+            frame = np.rint(frame*255)
+        self.frames[self.next_id % self.capacity] = frame
+        self.histories[env].append(self.next_id)
+        self.next_id += 1
+        return self.stack_index(env)
+
+    def stack_index(self, env=0):
+        history = self.histories[env]
+        #until the history has filled, the newest frame is repeated 4x.
+        if len(history) < history.maxlen:
+            return np.full(len(self.offsets), history[-1], dtype=np.int64)
+        return np.array([history[i] for i in self.offsets], dtype=np.int64)
+
+    def stack(self, index):
+        """Float32 state(s) for an id stack of shape (4,) or (batch, 4)."""
+        if self.next_id - np.min(index) > self.capacity: #a real check; learning on the wrong frames is silent.
+            raise RuntimeError(f"frame {np.min(index)} was overwritten "
+                               f"(newest {self.next_id - 1}, capacity {self.capacity})")
+        return np.take(self.decode, self.frames[index % self.capacity])
+
+    def load_frames(self, frames):
+        """Replaces the store with a packed block of frames; ids become 0..len(frames)-1."""
+        self.frames[:len(frames)] = frames
+        self.next_id = len(frames)
+
+    def memory_footprint(self):
+        return self.frames.nbytes
+
+class MinibatchSampler:
+    """
+    Shuffled minibatches of buffer slots. Every transition lands in exactly one batch
+    per epoch; nothing is trimmed to make the rollout divide evenly.
+      fixed_batch_bool=True:  batches of batch_size, whatever the rollout length.
+      fixed_batch_bool=False: the rollout is split into num_minibatches near-equal batches.
+    A short final batch is kept; only a 1-transition leftover is folded into the batch
+    before it, since a single row breaks the squeeze in learn (see the Batch Mismatch note).
+    """
+    def __init__(self, batch_size, num_minibatches=5, fixed_batch_bool=False, min_batch=2):
         self.batch_size = batch_size
+        self.num_minibatches = num_minibatches
+        self.fixed_batch_bool = fixed_batch_bool
+        self.min_batch = min_batch
+
+    def split_points(self, n):
+        """Where a shuffled rollout of n transitions is cut into batches."""
+        if self.fixed_batch_bool:
+            points = list(range(self.batch_size, n, max(self.batch_size, 1)))
+            if points and n - points[-1] < self.min_batch:
+                points.pop() #fold the leftover into the previous batch.
+            return points
+        #near-equal batches; sizes differ by at most one.
+        n_batches = max(min(self.num_minibatches, n//self.min_batch), 1)
+        return [round(i*n/n_batches) for i in range(1, n_batches)]
+
+    def sample(self, indices):
+        indices = np.random.permutation(indices)
+        return np.split(indices, self.split_points(len(indices)))
+
+class RolloutBuffer:
+    """
+    Fixed capacity rollout storage; drop-in replacement for the old list based PPOMemory.
+    Every array is preallocated once and written in place by store_memory, so
+    generate_batches hands out views of the storage instead of rebuilding it each epoch.
+    Once full, the oldest transitions are overwritten (ring buffer).
+
+    States are stored as FrameStore id stacks; stack_states() turns a minibatch of
+    them back into float model input. Each transition also records which environment
+    it came from, so advantages can be computed per environment, and, with num_extra,
+    the non-image model inputs (label features) that went with the state.
+    """
+    def __init__(self, sampler, capacity, frames, num_extra=0):
+        self.sampler = sampler
+        self.capacity = capacity
+        self.frames = frames
+        self.head = 0 #next slot to write
+        self.count = 0 #number of valid slots
+
+        self.states = np.zeros((capacity, len(frames.offsets)), dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.probs = np.zeros(capacity, dtype=np.float32)
+        self.vals = np.zeros(capacity, dtype=np.float32)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.envs = np.zeros(capacity, dtype=np.int64)
+        self.extras = np.zeros((capacity, num_extra), dtype=np.float32)
+
+    def __len__(self):
+        return self.count
+
+    def chronological_index(self):
+        """Slot indices of the stored transitions, oldest first."""
+        return (self.head - self.count + np.arange(self.count)) % self.capacity
 
     def generate_batches(self):
-        n_states = len(self.states)
-        batch_start = np.arange(0, n_states, self.batch_size)
-        indices = np.arange(n_states, dtype=np.int64)
-        np.random.shuffle(indices)
-        batches = [indices[i:i+self.batch_size] for i in batch_start]
-
-        #only one element tensors can be converted to Python scalars; np.array(self.states)
-        return  np.array(self.states),\
-                np.array(self.actions),\
-                np.array(self.probs),\
-                np.array(self.vals),\
-                np.array(self.rewards),\
-                np.array(self.dones),\
+        batches = self.sampler.sample(self.chronological_index())
+
+        #views of the storage; batches hold slot indices into them.
+        return  self.states,\
+                self.actions,\
+                self.probs,\
+                self.vals,\
+                self.rewards,\
+                self.dones,\
                 batches
 
-    def store_memory(self, state, action, probs, vals, reward, done):
-        self.states.append(state)
-        self.actions.append(action)
-        self.probs.append(probs)
-        self.vals.append(vals)
-        self.rewards.append(reward)
-        self.dones.append(done)
+    def store_memory(self, state, action, probs, vals, reward, done, env=0, extra=None):
+        slot = self.head
+        self.states[slot] = state
+        self.actions[slot] = action
+        self.probs[slot] = probs
+        self.vals[slot] = vals
+        self.rewards[slot] = reward
+        self.dones[slot] = done
+        self.envs[slot] = env
+        if extra is not None:
+            self.extras[slot] = extra
+
+        self.head = (slot + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
 
     def clear_memory(self):
-        self.states = []
-        self.probs = []
-        self.actions = []
-        self.rewards = []
-        self.dones = []
-        self.vals = []
+        self.head = 0
+        self.count = 0
+
+    def stack_states(self, index):
+        return self.frames.stack(self.states[index])
+
+    def export_rollout(self):
+        """
+        Packs the stored transitions, oldest first, for another process.
+        Only the frames the states point at are copied, once each, and the
+        states are renumbered to index into that packed frame block.
+        """
+        order = self.chronological_index()
+        frame_ids, states = np.unique(self.states[order], return_inverse=True)
+        return {'frames': self.frames.frames[frame_ids % self.frames.capacity],
+                'states': states.reshape(len(order), -1),
+                'actions': self.actions[order], 'probs': self.probs[order],
+                'vals': self.vals[order], 'rewards': self.rewards[order],
+                'dones': self.dones[order], 'envs': self.envs[order],
+                'extras': self.extras[order]}
+
+    def import_rollout(self, rollout):
+        """Loads an export_rollout() pack; replaces whatever was stored."""
+        count = len(rollout['actions'])
+        self.frames.load_frames(rollout['frames'])
+        for key in ('states', 'actions', 'probs', 'vals', 'rewards', 'dones', 'envs', 'extras'):
+            getattr(self, key)[:count] = rollout[key]
+        self.count = count
+        self.head = count % self.capacity
+
+    def memory_footprint(self):
+        """Bytes reserved by the preallocated arrays, frame store included."""
+        arrays = (self.states, self.actions, self.probs,
+                  self.vals, self.rewards, self.dones, self.envs, self.extras)
+        return sum(arr.nbytes for arr in arrays) + self.frames.memory_footprint()
 
 class NNMerge:
 
@@ -288,38 +584,223 @@ class Agent:
         self.initial_state_bool = True
         self.state_tensor = [] #initialize empty.
         self.state_array = []
-        self.complex_buffer = deque(maxlen=60) #we average 60 cycles/second;yields 1 second reference window to sample.
-
-        self.actor_model= CNNActor(4, num_actions, parameters_dict["actor_learning_rate"])
-        self.critic_model= CNNCritic(4, num_actions, parameters_dict["critic_learning_rate"])
-        self.memory = PPOMemory(parameters_dict["mini_batch_size"])
+        self.state_index = [] #frame ids of the last state built by image_to_tensor.
+
+        #label features (Doom_Labels) as extra model inputs; a different linear layer,
+        #so those models keep their own checkpoints (*_labels.pth).
+        self.num_extra = NUM_LABEL_FEATURES if parameters_dict["label_inputs_bool"] else 0
+        suffix = '_labels' if self.num_extra else ''
+        checkpoint = lambda kind: f'pretrained_model/current_model_{kind}{suffix}.pth'
+
+        #'split': CNNActor + CNNCritic; 'shared': one CNNActorCritic trunk with both heads.
+        self.model_layout = parameters_dict["model_layout"]
+        if self.model_layout == 'shared':
+            self.model = CNNActorCritic(4, num_actions, parameters_dict["actor_learning_rate"],
+                                        parameters_dict["critic_learning_rate"], checkpoint('shared'),
+                                        checkpoint('actor'), checkpoint('critic'), self.num_extra)
+            self.device = self.model.device
+        else:
+            self.actor_model= CNNActor(4, num_actions, parameters_dict["actor_learning_rate"],
+                                       checkpoint('actor'), self.num_extra)
+            self.critic_model= CNNCritic(4, num_actions, parameters_dict["critic_learning_rate"],
+                                         checkpoint('critic'), self.num_extra)
+            self.device = self.actor_model.device
+        #we average 60 cycles/second; the frame history yields a 1 second reference window to sample.
+        #the ring holds a learn's worth of frames, so the oldest transition's are still there when we learn.
+        self.num_envs = parameters_dict["num_envs"]
+        self.frames = FrameStore(frame_ring_capacity(parameters_dict),
+                                 num_envs=self.num_envs,
+                                 frame_skip=parameters_dict["frame_skip"])
+        self.sampler = MinibatchSampler(parameters_dict["mini_batch_size"],
+                                        parameters_dict["num_minibatches"],
+                                        parameters_dict["fixed_batch_bool"])
+        self.memory = RolloutBuffer(self.sampler, parameters_dict["rollout_capacity"], self.frames,
+                                    self.num_extra)
         self.merge = NNMerge(parameters_dict, num_actions) #For merging NN
+        #checkpoints written on a background thread with retention (Doom_Checkpoint),
+        #or in place (still atomically) on this one.
+        self.checkpoint_writer = (CheckpointWriter(keep_last=parameters_dict["checkpoint_keep"])
+                                  if parameters_dict["checkpoint_async_bool"] else None)
+
+        #'eager': act with the training models; 'compiled': frozen TorchScript trace;
+        #'quantized': INT8 copy for acting (CPU only), training stays float32.
+        self.inference_mode = parameters_dict["inference_mode"]
+        self.channels_last = None #picked by timing, the first time the compiled path is built.
+        self.input_buffer = T.zeros(1, 4, 126, 126, device=self.device) #reused every step.
+        self.extra_buffer = T.zeros(1, self.num_extra, device=self.device)
+        self.refresh_inference()
        
-    def remember(self, state, action, probs, vals, reward, done):
-        self.memory.store_memory(state, action, probs, vals, reward, done)
+    def remember(self, state, action, probs, vals, reward, done, env=0, extra=None):
+        self.memory.store_memory(state, action, probs, vals, reward, done, env, extra)
 
-    def save_models(self):
+    def save_models(self, reward=None):
+        """reward (e.g. the running reward average) picks the best checkpoint kept by the writer."""
         print('... saving model ...')
-        self.actor_model.save_checkpoint()
-        self.critic_model.save_checkpoint()
+        models = [self.model] if self.model_layout == 'shared' else [self.actor_model, self.critic_model]
+        if self.checkpoint_writer:
+            self.checkpoint_writer.submit({os.path.join(model.home_dir, model.checkpoint_file): model.state_dict()
+                                           for model in models}, reward)
+        else:
+            for model in models:
+                model.save_checkpoint()
+        if self.inference_mode == 'quantized':
+            self.refresh_inference()
 
     def load_models(self):
         print('... loading model ...')
-        self.actor_model.load_checkpoint()
-        self.critic_model.load_checkpoint()
+        if self.model_layout == 'shared':
+            self.model.load_checkpoint()
+        else:
+            self.actor_model.load_checkpoint()
+            self.critic_model.load_checkpoint()
+        self.refresh_inference()
+
+    def evaluate(self, states, extras=None):
+        """Actor logits and critic values for a batch of states, for either layout."""
+        if self.model_layout == 'shared':
+            return self.model(states, extras)
+        return self.actor_model(states, extras), self.critic_model(states, extras)
+
+    def model_inputs(self, states, extras=None):
+        """Forward arguments for the acting path; extras only when the models take them."""
+        if not self.num_extra:
+            return (states,)
+        if extras is None: #no label features for this state; the "no enemy" vector.
+            extras = T.tensor([NO_ENEMY_FEATURES], device=self.device).expand(len(states), -1)
+        return states, extras
+
+    def policy_state(self):
+        """One flat state_dict covering every model, for either layout."""
+        if self.model_layout == 'shared':
+            models = {'model': self.model}
+        else:
+            models = {'actor': self.actor_model, 'critic': self.critic_model}
+        return {f'{name}.{key}': tensor for name, model in models.items()
+                for key, tensor in model.state_dict().items()}
+
+    def load_policy_state(self, state):
+        if self.model_layout == 'shared':
+            models = {'model': self.model}
+        else:
+            models = {'actor': self.actor_model, 'critic': self.critic_model}
+        for name, model in models.items():
+            prefix = name + '.'
+            model.load_state_dict({key[len(prefix):]: tensor for key, tensor in state.items()
+                                   if key.startswith(prefix)})
+        self.refresh_inference()
+
+    def acting_models(self):
+        if self.model_layout == 'shared':
+            return [self.model]
+        return [self.actor_model, self.critic_model]
+
+    def training_state(self):
+        """Weights and Adam states of every model, for Doom_Checkpoint.TrainingSnapshot."""
+        models = self.acting_models()
+        return {'model_layout': self.model_layout, 'num_extra': self.num_extra,
+                'models': [model.state_dict() for model in models],
+                'optimizers': [model.optimizer.state_dict() for model in models]}
+
+    def load_training_state(self, state):
+        """False (and nothing loaded) if the state is for another model layout or input size."""
+        if (state['model_layout'], state['num_extra']) != (self.model_layout, self.num_extra):
+            print(f"Snapshot is for {state['model_layout']}/{state['num_extra']} extra inputs; not loaded.")
+            return False
+        for model, weights, optimizer_state in zip(self.acting_models(), state['models'], state['optimizers']):
+            model.load_state_dict(weights)
+            learning_rates = [group['lr'] for group in model.optimizer.param_groups]
+            model.optimizer.load_state_dict(optimizer_state)
+            for group, lr in zip(model.optimizer.param_groups, learning_rates): #params set the rate, not the snapshot.
+                group['lr'] = lr
+        self.refresh_inference()
+        return True
+
+    def refresh_inference(self):
+        """
+        Rebuilds the forward pass used for acting. It has to be called whenever the
+        weights change (learn, load, learner sync), since the compiled graph holds
+        its own frozen copy of them.
+        """
+        if self.inference_mode == 'eager':
+            self.act_forward = self.evaluate
+            return
+        if self.inference_mode == 'quantized':
+            #quantized kernels are CPU only; on a GPU act with the float models.
+            if self.device.type == 'cpu':
+                self.act_forward = self.quantized_copy()
+            else:
+                self.act_forward = self.evaluate
+            return
+
+        example = self.model_inputs(T.zeros(1, 4, 126, 126, device=self.device), self.extra_buffer)
+        #newer torch flags TorchScript as deprecated; it is still the CPU path that works everywhere.
+        with T.no_grad(), warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            traced = T.jit.trace(ActingModel(self.acting_models()), example, check_trace=False)
+            self.act_forward = T.jit.optimize_for_inference(T.jit.freeze(traced.eval()))
+
+        if self.channels_last is None:
+            self.channels_last = self.channels_last_faster()
+        memory_format = T.channels_last if self.channels_last else T.contiguous_format
+        self.input_buffer = self.input_buffer.contiguous(memory_format=memory_format)
+
+    def quantized_copy(self):
+        """
+        Dynamically quantized (INT8 weights, activations quantized on the fly) copy of the
+        acting models. Only the linear layers are covered, dynamic quantization has no conv
+        kernels; the 9216x512 linear is most of the weights anyway.
+        """
+        return T.ao.quantization.quantize_dynamic(ActingModel(self.acting_models()),
+                                                  {nn.Linear}, dtype=T.qint8).eval()
+
+    def acting_divergence(self, states, extras=None):
+        """
+        How far the acting path drifts from the float32 training models on a batch of
+        states: mean/max KL(float||acting) of the action distributions, greedy-action
+        agreement and the largest value difference.
+        """
+        states = T.as_tensor(np.asarray(states, dtype=np.float32)).to(self.device)
+        if extras is not None:
+            extras = T.as_tensor(np.asarray(extras, dtype=np.float32)).to(self.device)
+        inputs = self.model_inputs(states, extras)
+        with T.no_grad():
+            logits, values = self.evaluate(*inputs)
+            act_logits, act_values = self.act_forward(*inputs)
+        log_p = F.log_softmax(logits, dim=1)
+        log_q = F.log_softmax(act_logits, dim=1)
+        kl = (log_p.exp()*(log_p - log_q)).sum(dim=1)
+        return {'kl_mean': kl.mean().item(), 'kl_max': kl.max().item(),
+                'agreement': (logits.argmax(1) == act_logits.argmax(1)).float().mean().item(),
+                'value_err': (values - act_values).abs().max().item()}
+
+    def channels_last_faster(self, runs=20):
+        """Times the compiled path with both input layouts; True if channels_last wins."""
+        timings = []
+        for memory_format in (T.contiguous_format, T.channels_last):
+            inputs = self.model_inputs(self.input_buffer.contiguous(memory_format=memory_format),
+                                       self.extra_buffer)
+            with T.no_grad():
+                self.act_forward(*inputs) #warm up
+                t0 = time.perf_counter()
+                for _ in range(runs):
+                    self.act_forward(*inputs)
+            timings.append(time.perf_counter() - t0)
+        return timings[1] < timings[0]
 
     def merge_models(self):
         self.merge.merge_models()
 
-    def choose_action(self, state):
-        #state = T.tensor([observation], dtype=T.float).to(self.model.device)
-        state = T.tensor(state, dtype=T.float).to(self.actor_model.device)
-        state = state.squeeze(0)
-        state = state.unsqueeze(0)
-        #if T.cuda.is_available():  # put on GPU if CUDA is available
-        #    state = state.cuda()
+    def choose_action(self, state, extra=None):
+        #no autograd while acting; learn() recomputes everything it needs.
+        #the input tensor is preallocated, each step only copies the new state into it.
+        with T.no_grad():
+            state = T.from_numpy(np.asarray(state, dtype=np.float32))
+            self.input_buffer.copy_(state.view(self.input_buffer.shape))
+            if extra is not None:
+                self.extra_buffer.copy_(T.from_numpy(np.asarray(extra, dtype=np.float32)).view(1, -1))
+            inputs = self.model_inputs(self.input_buffer, None if extra is None else self.extra_buffer)
+            action_space, value = self.act_forward(*inputs)
 
-        action_space, value = self.actor_model(state), self.critic_model(state)
         actions_distribution = F.softmax(action_space, dim=1)
         actions_distribution = Categorical(actions_distribution)
 
@@ -331,59 +812,51 @@ class Agent:
 
         return action, probs, value, action_space
 
+    def choose_actions(self, states, extras=None):
+        """Batched choose_action; one forward pass covers every environment."""
+        states = T.from_numpy(np.asarray(states, dtype=np.float32)).to(self.device)
+        if self.channels_last:
+            states = states.contiguous(memory_format=T.channels_last)
+        if extras is not None:
+            extras = T.from_numpy(np.asarray(extras, dtype=np.float32)).to(self.device)
+        with T.no_grad():
+            action_space, values = self.act_forward(*self.model_inputs(states, extras))
+        actions_distribution = Categorical(F.softmax(action_space, dim=1))
+        actions = actions_distribution.sample()
+
+        probs = actions_distribution.log_prob(actions).detach().cpu().numpy()
+        actions = actions.cpu().numpy()
+        values = values.squeeze(1).detach().cpu().numpy()
+        return actions, probs, values, action_space
+
     def learn(self):
 
-        #subfunction for so len(data)%batch size = 0; evenly trims for zero remainder.
-        #even though the mask is generated each time, its set to len&divisor. Same len&divisor = same mask every time.
-        def array_adjust(array, divisor):
-            input_len = len(array)
-            remainder = input_len%divisor
-            #if there is no remainder, we return the original array.
-            if remainder != 0:#create a mask of what indexies to remove.
-                mask_rate = np.floor(input_len/remainder)
-                advantage = np.zeros(remainder, dtype=np.int32) #initialize advantage array as all zeros.
-                for i, val in enumerate(advantage):
-                    advantage[i] = i*mask_rate
-                #now apply the mask
-                for val in advantage:
-                    array.pop(val)
-            return array
-        
-        self.memory.batch_size = int(len(self.memory.states) /5) #take the floor
-        #all arrays have same length
-        self.memory.states = array_adjust(self.memory.states, self.memory.batch_size)
-        self.memory.actions = array_adjust(self.memory.actions, self.memory.batch_size)
-        self.memory.probs = array_adjust(self.memory.probs, self.memory.batch_size)
-        self.memory.vals = array_adjust(self.memory.vals, self.memory.batch_size)
-        self.memory.rewards = array_adjust(self.memory.rewards, self.memory.batch_size)
-        self.memory.dones = array_adjust(self.memory.dones, self.memory.batch_size)
+        #rewards, values and dones dont change between epochs; advantages are computed once.
+        #advantage and values are laid out by buffer slot, same as the batches.
+        #each environment is its own trajectory, so GAE runs once per environment.
+        order = self.memory.chronological_index()
+        env_ids = self.memory.envs[order]
+        advantage = np.zeros(self.memory.capacity, dtype=np.float32)
+        for env in np.unique(env_ids):
+            env_order = order[env_ids == env]
+            advantage[env_order] = compute_gae(self.memory.rewards[env_order], self.memory.vals[env_order],
+                                               self.memory.dones[env_order], self.gamma, self.gae_lambda)
+        advantage = T.from_numpy(advantage).to(self.device)
+        values = T.from_numpy(self.memory.vals).to(self.device)
 
         for epoch in range(self.n_epochs):
-            state_arr, action_arr, old_prob_arr, vals_arr,\
-            reward_arr, dones_arr, batches = \
+            _, action_arr, old_prob_arr, _,\
+            _, _, batches = \
                     self.memory.generate_batches()
 
-            values = vals_arr #Array of critic values
-            advantage = np.zeros(len(reward_arr), dtype=np.float32) #initialize advantage array as all zeros.
-
-            for t in range(len(reward_arr)-1): #t = timestep; for every timestep in the reward array.
-                discount = 1
-                a_t = 0 # advantage at timestep initialized as zero.
-                for k in range(t, len(reward_arr)-1): #k= timesteps to the end; for every timestep in the future.
-                    a_t += discount*(reward_arr[k] + self.gamma*values[k+1]*\
-                            (1-int(dones_arr[k])) - values[k])
-                    discount *= self.gamma*self.gae_lambda
-                advantage[t] = a_t
-            advantage = T.tensor(advantage).to(self.actor_model.device)
-            values = T.tensor(values).to(self.critic_model.device)
-
             for batch in batches:
-                states = T.tensor(state_arr[batch], dtype=T.float).to(self.actor_model.device)
+                states = T.from_numpy(self.memory.stack_states(batch)).to(self.device)
 
-                old_probs = T.tensor(old_prob_arr[batch]).to(self.actor_model.device)
-                actions = T.tensor(action_arr[batch]).to(self.actor_model.device)
+                old_probs = T.from_numpy(old_prob_arr[batch]).to(self.device)
+                actions = T.from_numpy(action_arr[batch]).to(self.device)
+                extras = T.from_numpy(self.memory.extras[batch]).to(self.device) if self.num_extra else None
 
-                actions_distribution, critic_value = self.actor_model(states), self.critic_model(states)
+                actions_distribution, critic_value = self.evaluate(states, extras)
                 actions_distribution = F.softmax(actions_distribution, dim=1)
                 actions_distribution = Categorical(actions_distribution)
                 new_m = actions_distribution
@@ -410,16 +883,23 @@ class Agent:
                 #critic_loss = F.smooth_l1_loss(R[batch_indices], value.squeeze())
 
                 ## Update the network; gradient descent
-                self.actor_model.optimizer.zero_grad()
-                actor_loss.backward(retain_graph=True)
-                self.critic_model.optimizer.zero_grad()
-                critic_loss.backward()
-
-                nn.utils.clip_grad_norm_(self.actor_model.parameters(), 0.5) #performs gradient clipping. It is used to mitigate the problem of exploding gradients,
-                nn.utils.clip_grad_norm_(self.critic_model.parameters(), 0.5) #performs gradient clipping. It is used to mitigate the problem of exploding gradients,
-                
-                self.actor_model.optimizer.step()
-                self.critic_model.optimizer.step()
+                if self.model_layout == 'shared':
+                    #one trunk, so the losses are combined; critic_discount brings them to the same order.
+                    self.model.optimizer.zero_grad()
+                    (actor_loss + self.critic_discount*critic_loss).backward()
+                    nn.utils.clip_grad_norm_(self.model.parameters(), 0.5)
+                    self.model.optimizer.step()
+                else:
+                    self.actor_model.optimizer.zero_grad()
+                    actor_loss.backward(retain_graph=True)
+                    self.critic_model.optimizer.zero_grad()
+                    critic_loss.backward()
+
+                    nn.utils.clip_grad_norm_(self.actor_model.parameters(), 0.5) #performs gradient clipping. It is used to mitigate the problem of exploding gradients,
+                    nn.utils.clip_grad_norm_(self.critic_model.parameters(), 0.5) #performs gradient clipping. It is used to mitigate the problem of exploding gradients,
+                    
+                    self.actor_model.optimizer.step()
+                    self.critic_model.optimizer.step()
 
                 actor_loss = actor_loss+entropy_loss #take the entropy back out for better insight.
                 actor_loss = actor_loss.detach().cpu().numpy().astype('float32')
@@ -438,26 +918,16 @@ class Agent:
         print(f"Actor:{round(np.mean(self.actor_loss_que),4)}; ", end="")
         print(f"Critic:{round(np.mean(self.critic_loss_que),4)}; ", end="")
         print(f"Entropy:{round(np.mean(self.entropy_loss_que),4)}")
-        self.memory.clear_memory()               
-
-    def image_to_tensor(self, image):
-        #4 frames are staggered across time. 30cycles/second = 30 frame buffer of 1 second. We select frames 
-        # 0,15,22,29; with the newest frame being on the end(24).
-        image_tensor = image.transpose(2, 0, 1)
-        image_tensor = image_tensor.astype(np.float32)
-        self.complex_buffer.append(image_tensor)
-        
-        #"""
-        #the following protocol handles the 4frame "movement" array.
-        if len(self.complex_buffer) < 60: #Deque hasnt filled
-            self.state_array = np.concatenate((image_tensor, image_tensor, image_tensor, image_tensor), axis=0)
-            #self.state_array = np.expand_dims(self.state_array, axis=0)
-        else:
-            self.state_array = np.concatenate((self.complex_buffer[0], self.complex_buffer[30], 
-                                                self.complex_buffer[45], self.complex_buffer[59]), axis=0)
-            #self.state_array = np.concatenate((self.state_array[1:, :, :], image_tensor), axis=0)
-        #"""
-        return self.state_array 
+        self.memory.clear_memory()
+        self.refresh_inference()               
+
+    def image_to_tensor(self, image, env=0):
+        #4 frames are staggered across time. 60cycles/second = 60 frame history of 1 second. We select frames 
+        # 0,30,45,59; with the newest frame being on the end(59).
+        #Frames are stored once as uint8; self.state_index is what remember() stores for this state.
+        self.state_index = self.frames.push(image, env)
+        self.state_array = self.frames.stack(self.state_index)
+        return self.state_array
 
 if __name__ == "__main__":
     parameters = {
@@ -471,6 +941,17 @@ if __name__ == "__main__":
         'number_of_iterations': 20000000,
         'game_count_limit': 100, #how many games do we wish to run this for.
         'mini_batch_size': 200, #5 
+        'fixed_batch_bool': False, #True: minibatches of mini_batch_size; False: rollout split num_minibatches ways.
+        'num_minibatches': 5,
+        'frame_skip': 1, #tics each action is held for; 1 = decide every tic.
+        'rollout_capacity': 3000, #max transitions held between learns.
+        'frame_capacity': 3100, #per env; uint8 frames kept for rebuilding states; raised to a learn's worth if lower (frame_ring_capacity).
+        'model_layout': 'split', #'split' or 'shared'
+        'num_envs': 1,
+        'inference_mode': 'eager', #'eager', 'compiled' or 'quantized'
+        'label_inputs_bool': False, #label features as extra model inputs.
+        'checkpoint_async_bool': False, #write checkpoints on a background thread (Doom_Checkpoint).
+        'checkpoint_keep': 3, #versions kept in pretrained_model/checkpoints, plus the best.
         'num_local_steps': 800, #Used for dataset learning. total learning steps at learn time.
     }
 
@@ -0,0 +1,700 @@
+"""
+Micro-benchmarks for the training hot paths.
+
+Each benchmark is standalone and prints a small table; pick one from the
+switchboard at the bottom, e.g. main('gae').
+"""
+import os
+import time
+import tempfile
+import types
+import multiprocessing
+from collections import deque
+import cv2
+import numpy as np
+import torch as T
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.distributions.categorical import Categorical
+
+from Doom_Agent import compute_gae, CNNActor, CNNCritic, CNNActorCritic, Agent
+from Doom_Rewards import RewardEngine
+from Doom_Preprocess import FramePreprocessor
+from Doom_Labels import LabelFeatures
+from Doom_Profiler import StepProfiler, NULL_PROFILER
+from Doom_Telemetry import Telemetry, latest
+from Doom_Stats import RunningStats, WindowStats
+
+#Agent settings for benchmarks; overridden per benchmark where it matters.
+BENCH_PARAMS = {
+    'actor_learning_rate':5e-6, 'critic_learning_rate':9e-6,
+    'gamma': 0.98, 'tau': 0.98, 'beta':0.2, 'epsilon': 0.08, 'epochs': 3,
+    'mini_batch_size': 200, 'fixed_batch_bool': False, 'num_minibatches': 5,
+    'rollout_capacity': 3000, 'frame_capacity': 3100,
+    'model_layout': 'split', 'num_envs': 1, 'frame_skip': 1, 'inference_mode': 'eager',
+    'label_inputs_bool': False, 'checkpoint_async_bool': False, 'checkpoint_keep': 3,
+    }
+
+def legacy_gae(reward_arr, values, dones_arr, gamma, gae_lambda):
+    """The original nested-loop advantage calculation from Agent.learn; O(n^2)."""
+    advantage = np.zeros(len(reward_arr), dtype=np.float32)
+    for t in range(len(reward_arr)-1):
+        discount = 1
+        a_t = 0
+        for k in range(t, len(reward_arr)-1):
+            a_t += discount*(reward_arr[k] + gamma*values[k+1]*\
+                    (1-int(dones_arr[k])) - values[k])
+            discount *= gamma*gae_lambda
+        advantage[t] = a_t
+    return advantage
+
+def gae_benchmark(lengths=(500, 1000, 3000, 10000, 50000), gamma=0.98, gae_lambda=0.98,
+                  legacy_limit=3000):
+    """
+    Compares compute_gae against the legacy loop. Past legacy_limit the legacy time
+    is extrapolated quadratically from the largest measured length (marked with ~).
+    """
+    print(f"{'length':>8} {'legacy(s)':>12} {'scan(s)':>10} {'speedup':>10} {'max err':>10}")
+    legacy_ref = None #(length, seconds) of the largest measured legacy run.
+    for n in lengths:
+        rewards = np.random.uniform(-1, 1, n)
+        values = np.random.uniform(-5, 5, n).tolist() #the memory stores python floats
+        dones = np.random.rand(n) < 0.01
+
+        t0 = time.perf_counter()
+        fast = compute_gae(rewards, values, dones, gamma, gae_lambda)
+        scan_time = time.perf_counter() - t0
+
+        if n <= legacy_limit:
+            t0 = time.perf_counter()
+            slow = legacy_gae(rewards, values, dones, gamma, gae_lambda)
+            legacy_time = time.perf_counter() - t0
+            legacy_ref = (n, legacy_time)
+            err = f"{np.max(np.abs(fast - slow)):.2e}"
+            legacy_txt = f"{legacy_time:.3f}"
+        else:
+            legacy_time = legacy_ref[1] * (n/legacy_ref[0])**2
+            err = "-"
+            legacy_txt = f"~{legacy_time:.1f}"
+
+        speedup = legacy_time/max(scan_time, 1e-9)
+        print(f"{n:>8} {legacy_txt:>12} {scan_time:>10.4f} {speedup:>9.0f}x {err:>10}")
+
+def build_models(layout, num_actions=10):
+    """Fresh models created in a throwaway folder, so no real checkpoints are touched."""
+    home_dir = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    os.mkdir('pretrained_model')
+    if layout == 'shared':
+        models = [CNNActorCritic(4, num_actions, 5e-6, 9e-6)]
+    else:
+        models = [CNNActor(4, num_actions, 5e-6), CNNCritic(4, num_actions, 9e-6)]
+    os.chdir(home_dir)
+    return models
+
+def build_agent(num_actions=10, **overrides):
+    """An Agent with fresh weights, built in a throwaway folder like build_models."""
+    params = dict(BENCH_PARAMS, **overrides)
+    home_dir = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    os.mkdir('pretrained_model')
+    agent = Agent(params, num_actions)
+    os.chdir(home_dir)
+    return agent
+
+def model_layout_benchmark(steps=300, minibatch=200, train_batches=10, num_actions=10):
+    """Per-step inference and per-minibatch PPO update time for split vs shared models."""
+    print(f"{'layout':>8} {'step(ms)':>10} {'minibatch(ms)':>14}")
+    for layout in ('split', 'shared'):
+        models = build_models(layout, num_actions)
+        device = models[0].device
+        def evaluate(x):
+            if layout == 'shared':
+                return models[0](x)
+            return models[0](x), models[1](x)
+
+        state = T.rand(1, 4, 126, 126, device=device)
+        with T.no_grad():
+            for _ in range(10): #warm up
+                evaluate(state)
+            t0 = time.perf_counter()
+            for _ in range(steps):
+                evaluate(state)
+        step_ms = (time.perf_counter() - t0)/steps*1000
+
+        states = T.rand(minibatch, 4, 126, 126, device=device)
+        actions = T.randint(num_actions, (minibatch,), device=device)
+        returns = T.randn(minibatch, device=device)
+        t0 = time.perf_counter()
+        for _ in range(train_batches):
+            logits, value = evaluate(states)
+            dist = Categorical(F.softmax(logits, dim=1))
+            actor_loss = -(dist.log_prob(actions)*returns).mean()
+            critic_loss = ((returns - value.squeeze())**2).mean()
+            for model in models:
+                model.optimizer.zero_grad()
+            if layout == 'shared':
+                (actor_loss + critic_loss).backward()
+            else:
+                actor_loss.backward()
+                critic_loss.backward()
+            for model in models:
+                nn.utils.clip_grad_norm_(model.parameters(), 0.5)
+                model.optimizer.step()
+        batch_ms = (time.perf_counter() - t0)/train_batches*1000
+        print(f"{layout:>8} {step_ms:>10.2f} {batch_ms:>14.1f}")
+
+def inference_benchmark(threads=(1, 2, 4, 8), steps=300, layout='split'):
+    """
+    Per-step choose_action latency at several torch thread counts.
+    'autograd' replays the old path (fresh tensor each step, autograd on) for reference.
+    """
+    agents = {'eager': build_agent(model_layout=layout),
+              'compiled': build_agent(model_layout=layout, inference_mode='compiled')}
+    state = np.random.rand(4, 126, 126).astype(np.float32)
+    print(f"channels_last picked for compiled: {agents['compiled'].channels_last}")
+    print(f"{'threads':>8} {'autograd(ms)':>13} {'eager(ms)':>10} {'compiled(ms)':>13}")
+
+    def legacy_step(agent):
+        x = T.tensor(state, dtype=T.float).to(agent.device).unsqueeze(0)
+        logits, value = agent.evaluate(x)
+        dist = Categorical(F.softmax(logits, dim=1))
+        dist.sample()
+
+    original_threads = T.get_num_threads()
+    for n in threads:
+        T.set_num_threads(n)
+        row = []
+        for step in (lambda: legacy_step(agents['eager']),
+                     lambda: agents['eager'].choose_action(state),
+                     lambda: agents['compiled'].choose_action(state)):
+            for _ in range(10): #warm up
+                step()
+            t0 = time.perf_counter()
+            for _ in range(steps):
+                step()
+            row.append((time.perf_counter() - t0)/steps*1000)
+        print(f"{n:>8} {row[0]:>13.2f} {row[1]:>10.2f} {row[2]:>13.2f}")
+    T.set_num_threads(original_threads)
+
+def quantization_benchmark(samples=256, steps=300, batch=64, layout='split'):
+    """
+    INT8 acting copy vs the float32 models: action-distribution divergence on random
+    frame stacks, then single-step latency and batched throughput.
+    """
+    agents = {'float': build_agent(model_layout=layout),
+              'quantized': build_agent(model_layout=layout, inference_mode='quantized')}
+    agents['quantized'].load_policy_state(agents['float'].policy_state()) #same weights.
+
+    states = np.random.randint(0, 256, (samples, 4, 126, 126)).astype(np.float32)/255
+    check = agents['quantized'].acting_divergence(states)
+    print(f"KL mean {check['kl_mean']:.2e}, KL max {check['kl_max']:.2e}, "
+          f"greedy agreement {check['agreement']*100:.1f}%, max value err {check['value_err']:.2e}")
+
+    print(f"{'policy':>10} {'step(ms)':>10} {f'batch{batch}(states/s)':>20}")
+    for name, agent in agents.items():
+        state = states[0]
+        for _ in range(10): #warm up
+            agent.choose_action(state)
+        t0 = time.perf_counter()
+        for _ in range(steps):
+            agent.choose_action(state)
+        step_ms = (time.perf_counter() - t0)/steps*1000
+
+        t0 = time.perf_counter()
+        for start in range(0, samples, batch):
+            agent.choose_actions(states[start:start+batch])
+        per_second = samples/(time.perf_counter() - t0)
+        print(f"{name:>10} {step_ms:>10.2f} {per_second:>20.0f}")
+
+def render_benchmark(frames=2000, total_frame_limit=3000):
+    """Random-play frames per second for every render profile, engine only and with resize."""
+    import Doom_Wrapper #needs vizdoom; only imported for this benchmark.
+    print(f"{'profile':>14} {'engine fps':>11} {'w/ resize fps':>14}")
+    for profile in Doom_Wrapper.RENDER_PROFILES:
+        game_wrapper = Doom_Wrapper.DoomGame(total_frame_limit, profile)
+        engine_fps, total_fps = game_wrapper.fps_benchmark(frames)
+        game_wrapper.game.close()
+        print(f"{profile:>14} {engine_fps:>11.0f} {total_fps:>14.0f}")
+
+def reset_benchmark(resets=100, episode_steps=30, pool_sizes=(0, 1, 8), profile='train-minimal'):
+    """
+    episode_reset latency: new_episode + setup (pool 0) vs loading start snapshots.
+    Each reset is followed by a short random episode that ends either alive (like our
+    timeouts) or with the player killed (like the death resets most games end in);
+    the share column is the part of wall time spent resetting. The pool is filled
+    before timing starts.
+    """
+    import Doom_Wrapper #needs vizdoom; only imported for this benchmark.
+    print(f"{'pool':>5} {'ends':>6} {'reset(ms)':>10} {'share':>6}")
+    for pool_size in pool_sizes:
+        for end in ('alive', 'death'):
+            game_wrapper = Doom_Wrapper.DoomGame(3000, profile, start_pool_size=pool_size)
+            for _ in range(pool_size):
+                game_wrapper.episode_reset()
+            reset_time, play_time = 0, 0
+            for _ in range(resets):
+                t0 = time.perf_counter()
+                game_wrapper.episode_reset()
+                t1 = time.perf_counter()
+                for _ in range(episode_steps):
+                    game_wrapper.act(np.random.randint(len(game_wrapper.action_set_permutations)))
+                    if game_wrapper.game.is_episode_finished():
+                        break
+                if end == 'death' and not game_wrapper.game.is_episode_finished():
+                    game_wrapper.game.send_game_command('kill')
+                    game_wrapper.game.advance_action()
+                play_time += time.perf_counter() - t1
+                reset_time += t1 - t0
+            game_wrapper.close()
+            print(f"{pool_size:>5} {end:>6} {reset_time/resets*1000:>10.2f} "
+                  f"{reset_time/(reset_time + play_time):>6.1%}")
+
+#DoomGame.r_rules and enemy names, copied so the reward benchmark runs without vizdoom.
+BENCH_R_RULES = {
+    'passive': -0.25, 'spillover': 5, 'enemy_screen': 0.25, 'scored_kill': 30,
+    'died': -10, 'dmg_out_min': 4, 'dmg_out_max': 6, 'dmg_in_min': 4, 'dmg_in_max': 8,
+    'stuck': -2, 'stuck_timeout': -18, 'dry_fire':-1,
+    }
+BENCH_ENEMIES = ["Fatso", "Zombieman", "MarineChainsawVzd", "Demon"]
+
+class LegacyRewardRules():
+    """The original per-step DoomGame.reward_rules (frame_skip 1), minus the prints."""
+    def __init__(self, r_rules, total_frame_limit, hit_bonus=5):
+        self.r_rules = r_rules
+        self.total_frame_limit = total_frame_limit
+        self.hit_bonus = hit_bonus
+        self.w_varz = {'reward_que': deque(maxlen=10), 'dmg_out_que': deque([1], maxlen=25),
+                       'dmg_in_que': deque([1], maxlen=25), 'hit_spillover':0,
+                       'stuck_counter':0, 'enemy_names': BENCH_ENEMIES}
+        self.dict_labels = ['KILLCOUNT', 'DEATHCOUNT', 'HITCOUNT', 'HITS_TAKEN',
+                            'DAMAGECOUNT', 'DAMAGE_TAKEN', 'POSITION_X', 'POSITION_Y']
+        self.vars_dict = {name: 0 for name in self.dict_labels}
+        self.vars_dict_last = self.vars_dict.copy()
+
+    def wrapper_reset(self):
+        self.w_varz['stuck_counter'] = 0
+        self.w_varz['reward_que'] = deque(maxlen=10)
+
+    def reward_rules(self, action, vars_list, frame_count, death_bool, labels):
+        for i, var in enumerate(vars_list):
+            if i in (6, 7):
+                self.vars_dict[self.dict_labels[i]] = round(var)
+            else:
+                self.vars_dict[self.dict_labels[i]] = var
+        terminal = False
+        reward = self.r_rules['passive']
+        if self.w_varz['hit_spillover'] > 0:
+            reward = self.r_rules['spillover']
+            self.w_varz['hit_spillover'] -= 1
+        enemy_bool = False
+        screen_bonus = 0
+        for label in labels:
+            if str(label.object_name) in self.w_varz['enemy_names']:
+                screen_bonus += self.r_rules['enemy_screen']
+                enemy_bool = True
+        reward += screen_bonus
+        if action == 5 and not enemy_bool:
+            reward += self.r_rules['dry_fire']
+        if self.vars_dict['KILLCOUNT'] > self.vars_dict_last['KILLCOUNT']:
+            reward += self.r_rules['scored_kill']
+        if death_bool:
+            reward = self.r_rules['died']
+            terminal = True
+        v1, v2 = self.vars_dict['DAMAGECOUNT'], self.vars_dict_last['DAMAGECOUNT']
+        if v1 > v2:
+            self.w_varz['dmg_out_que'].append(v1 - v2)
+            reward += np.interp(v1 - v2, [min(self.w_varz['dmg_out_que']), max(self.w_varz['dmg_out_que'])],
+                                [self.r_rules['dmg_out_min'], self.r_rules['dmg_out_max']])
+            self.w_varz['hit_spillover'] = self.hit_bonus
+        v1, v2 = self.vars_dict['DAMAGE_TAKEN'], self.vars_dict_last['DAMAGE_TAKEN']
+        if v1 > v2:
+            self.w_varz['dmg_in_que'].append(v1 - v2)
+            reward -= np.interp(v1 - v2, [min(self.w_varz['dmg_in_que']), max(self.w_varz['dmg_in_que'])],
+                                [self.r_rules['dmg_in_min'], self.r_rules['dmg_in_max']])
+        if frame_count >= self.total_frame_limit-1:
+            terminal = True
+        b1 = (self.vars_dict['POSITION_X']==self.vars_dict_last['POSITION_X'])
+        b2 = (self.vars_dict['POSITION_Y']==self.vars_dict_last['POSITION_Y'])
+        if (b1 and b2):
+            self.w_varz['stuck_counter'] += 1
+            if self.w_varz['stuck_counter'] >= 40:
+                reward += self.r_rules['stuck']
+            if self.w_varz['stuck_counter'] >= 300:
+                reward = self.r_rules['stuck_timeout']
+                terminal = True
+        self.vars_dict_last = self.vars_dict.copy()
+        self.w_varz['reward_que'].append(reward)
+        return round(np.mean(self.w_varz['reward_que']),2), terminal
+
+def synthetic_game_steps(num_envs, steps, seed=0):
+    """Random but game-like inputs for the reward benchmark: counters only go up, players wander and stall."""
+    rng = np.random.RandomState(seed)
+    game_vars = np.zeros((num_envs, 8))
+    names = BENCH_ENEMIES + ['Clip', 'DoomPlayer', 'Medikit']
+    for frame in range(1, steps+1):
+        game_vars[:, 0] += rng.rand(num_envs) < 0.01
+        game_vars[:, 4] += rng.randint(1, 40, num_envs)*(rng.rand(num_envs) < 0.08)
+        game_vars[:, 5] += rng.randint(1, 25, num_envs)*(rng.rand(num_envs) < 0.06)
+        moving = rng.rand(num_envs) < 0.7
+        game_vars[:, 6:8] += rng.randn(num_envs, 2)*4*moving[:, None]
+        labels = [[types.SimpleNamespace(object_name=names[i])
+                   for i in rng.randint(len(names), size=rng.randint(0, 4))]
+                  for _ in range(num_envs)]
+        yield (rng.randint(10, size=num_envs), game_vars.copy(), labels,
+               rng.rand(num_envs) < 0.002, np.full(num_envs, frame), rng.rand(num_envs) < 0.003)
+
+def reward_benchmark(env_counts=(1, 64), steps=2000, total_frame_limit=3000):
+    """
+    RewardEngine vs N copies of the legacy per-step reward_rules on the same inputs.
+    Reports per-step cost (all N envs) and the largest disagreement. 'one' rows are
+    RewardEngine.step_one, the path DoomGame takes.
+    """
+    enemies = frozenset(BENCH_ENEMIES)
+    print(f"{'envs':>6} {'legacy(ms)':>11} {'engine(ms)':>11} {'speedup':>8} {'max err':>8} {'term diffs':>10}")
+    runs = [(n, False) for n in env_counts] + [(1, True)]
+    for n, one_bool in runs:
+        legacy = [LegacyRewardRules(BENCH_R_RULES, total_frame_limit) for _ in range(n)]
+        engine = RewardEngine(BENCH_R_RULES, n, total_frame_limit=total_frame_limit)
+        legacy_time, engine_time, max_err, term_diffs = 0, 0, 0, 0
+        for actions, game_vars, labels, death, frames, resets in synthetic_game_steps(n, steps):
+            t0 = time.perf_counter()
+            legacy_out = [game.reward_rules(actions[i], game_vars[i], frames[i], death[i], labels[i])
+                          for i, game in enumerate(legacy)]
+            t1 = time.perf_counter()
+            counts = [sum(str(label.object_name) in enemies for label in env_labels)
+                      for env_labels in labels]
+            if one_bool:
+                reward, terminal = engine.step_one(actions[0], game_vars[0], counts[0], death[0], frames[0])
+                rewards, terminal = np.array([reward]), np.array([terminal])
+            else:
+                rewards, terminal = engine.step(actions, game_vars, counts, death, frames)
+            engine_time += time.perf_counter() - t1
+            legacy_time += t1 - t0
+
+            max_err = max(max_err, np.max(np.abs(rewards - [r for r, _ in legacy_out])))
+            term_diffs += np.sum(terminal != [t for _, t in legacy_out])
+            for i in np.flatnonzero(resets):
+                legacy[i].wrapper_reset()
+            engine.reset(np.flatnonzero(resets))
+        legacy_ms, engine_ms = legacy_time/steps*1000, engine_time/steps*1000
+        print(f"{'one' if one_bool else n:>6} {legacy_ms:>11.3f} {engine_ms:>11.3f} {legacy_ms/engine_ms:>7.1f}x "
+              f"{max_err:>8.2g} {term_diffs:>10}")
+
+def legacy_resize(img, xy=126):
+    """DoomGame.resize as it was before the fused preprocessor (float64, several copies)."""
+    img = np.array(img)
+    img = cv2.resize(img, (xy, xy))
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    img = cv2.equalizeHist(img)
+    mean = np.array([np.mean([0.485, 0.456, 0.406])])
+    std = np.array([np.mean([0.229, 0.224, 0.225])])
+    img = std * img + mean
+    img = np.clip(img, 0, 1)
+    return np.reshape(img, (xy, xy, 1))
+
+def preprocess_benchmark(frames=2000, xy=126):
+    """
+    Frames per second of the old resize (+ the FrameStore quantize it was followed by)
+    vs FramePreprocessor, for BGR24 320x240 and GRAY8 160x120 screens.
+    """
+    rng = np.random.RandomState(0)
+    screens = {'BGR24 320x240': rng.randint(0, 256, (240, 320, 3)).astype(np.uint8),
+               'GRAY8 160x120': rng.randint(0, 256, (120, 160)).astype(np.uint8)}
+    fused_uint8, fused_float = FramePreprocessor(xy, 'uint8'), FramePreprocessor(xy, 'float32')
+    paths = {'resize': legacy_resize,
+             'resize+quantize': lambda img: np.rint(legacy_resize(img, xy)*255).astype(np.uint8),
+             'fused uint8': fused_uint8, 'fused float32': fused_float}
+
+    print(f"{'screen':>14} " + " ".join(f"{name:>16}" for name in paths) + f" {'exact':>6}")
+    for screen_name, screen in screens.items():
+        screen = cv2.GaussianBlur(screen, (9, 9), 0) #something closer to a rendered frame.
+        expected = np.rint(legacy_resize(screen, xy)*255).astype(np.uint8).reshape(xy, xy)
+        exact = (np.array_equal(fused_uint8(screen), expected)
+                 and np.array_equal(fused_float(screen), expected.astype(np.float32)/255))
+        row = []
+        for path in paths.values():
+            for _ in range(20): #warm up
+                path(screen)
+            t0 = time.perf_counter()
+            for _ in range(frames):
+                path(screen)
+            row.append(frames/(time.perf_counter() - t0))
+        print(f"{screen_name:>14} " + " ".join(f"{fps:>16.0f}" for fps in row) + f" {str(exact):>6}")
+
+def transport_worker(conn, shape, slab_info=None):
+    """Stand-in env worker for transport_benchmark: answers every step with the same frame."""
+    from Doom_Vector_Env import slab_layout, slab_views, VARIABLE_NAMES
+    frame = np.random.randint(0, 256, shape).astype(np.uint8)
+    info = {'vars': {name: 0.0 for name in VARIABLE_NAMES}}
+    if slab_info is not None:
+        from multiprocessing import shared_memory
+        shm_name, num_envs, env = slab_info
+        shm = shared_memory.SharedMemory(name=shm_name)
+        slab = slab_views(shm.buf, slab_layout(num_envs, shape[0])[0])
+    while conn.recv() is not None:
+        if slab_info is None:
+            conn.send((frame, 0.0, False, info))
+        else:
+            slab['frames'][env] = frame
+            slab['rewards'][env] = 0.0
+            slab['dones'][env] = False
+            slab['game_vars'][env] = 0.0
+            conn.send_bytes(b'')
+    if slab_info is not None:
+        del slab
+        shm.close()
+
+def transport_benchmark(env_counts=(1, 8), steps=2000, xy=126):
+    """
+    Per-frame cost of getting a step result from a worker process to the policy:
+    pickled raw 320x240x3 screens, pickled 126x126 frames (the pipe path VectorDoomGame
+    had), and the shared_memory slab + ack. The workers do no game work, so this is
+    transport only.
+    """
+    from multiprocessing import shared_memory
+    from Doom_Vector_Env import slab_layout, slab_views
+    modes = [('pipe 320x240x3', (240, 320, 3), False),
+             (f'pipe {xy}x{xy}', (xy, xy), False),
+             (f'shm {xy}x{xy}', (xy, xy), True)]
+    print(f"{'envs':>5} {'transport':>16} {'us/frame':>9} {'frames/s':>9}")
+    for n in env_counts:
+        for name, shape, shm_bool in modes:
+            shm, slab = None, None
+            if shm_bool:
+                layout, size = slab_layout(n, xy)
+                shm = shared_memory.SharedMemory(create=True, size=size)
+                slab = slab_views(shm.buf, layout)
+            remotes, processes = [], []
+            for env in range(n):
+                parent_conn, child_conn = multiprocessing.Pipe()
+                slab_info = (shm.name, n, env) if shm_bool else None
+                process = multiprocessing.Process(target=transport_worker,
+                                                  args=(child_conn, shape, slab_info),
+                                                  daemon=True)
+                process.start()
+                remotes.append(parent_conn)
+                processes.append(process)
+
+            t0 = time.perf_counter()
+            for step in range(steps):
+                for remote in remotes:
+                    remote.send(('step', 0))
+                if shm_bool:
+                    for remote in remotes:
+                        remote.recv_bytes()
+                    frames = slab['frames'][np.arange(n)]
+                else:
+                    results = [remote.recv() for remote in remotes]
+                    frames = np.stack([result[0] for result in results])
+            per_frame = (time.perf_counter() - t0)/(steps*n)
+            print(f"{n:>5} {name:>16} {per_frame*1e6:>9.1f} {1/per_frame:>9.0f}")
+
+            for remote in remotes:
+                remote.send(None)
+            for process in processes:
+                process.join()
+            if shm is not None:
+                slab = None
+                shm.close()
+                shm.unlink()
+
+def synthetic_labels(frames, shape=(240, 320), seed=0):
+    """Labels + labels buffer per frame: 0-8 rectangles of random objects, later ones drawn on top."""
+    rng = np.random.RandomState(seed)
+    names = BENCH_ENEMIES + ['Clip', 'DoomPlayer', 'Medikit', 'ShotgunGuy']
+    for _ in range(frames):
+        buffer = np.zeros(shape, dtype=np.uint8)
+        labels = []
+        for value in range(1, rng.randint(0, 9) + 1):
+            h, w = rng.randint(4, 80), rng.randint(4, 60)
+            y, x = rng.randint(0, shape[0] - h), rng.randint(0, shape[1] - w)
+            buffer[y:y+h, x:x+w] = value
+            labels.append(types.SimpleNamespace(object_name=names[rng.randint(len(names))], value=value))
+        yield labels, buffer
+
+def loop_label_features(labels, buffer, enemy_names):
+    """Reference: the reward_rules name loop, plus a mask per enemy label for coverage/distance."""
+    count, mask = 0, np.zeros(buffer.shape, dtype=bool)
+    for label in labels:
+        if str(label.object_name) in enemy_names:
+            count += 1
+            mask |= buffer == label.value
+    ys, xs = np.nonzero(mask)
+    if not len(ys):
+        return count, 0.0, 1.0
+    height, width = buffer.shape
+    distance = np.sqrt(np.min((ys - height/2)**2 + (xs - width/2)**2))/np.hypot(height/2, width/2)
+    return count, len(ys)/buffer.size, float(distance)
+
+def labels_benchmark(frames=2000):
+    """
+    Label features per frame: the reward_rules loop (count only, and with per-label
+    masks for coverage/distance) vs LabelFeatures, on 320x240 synthetic label buffers.
+    """
+    data = list(synthetic_labels(frames))
+    features = LabelFeatures(BENCH_ENEMIES)
+    enemy_list = list(BENCH_ENEMIES) #reward_rules checked the w_varz list.
+    paths = {'loop count': lambda labels, buffer: sum(str(l.object_name) in enemy_list for l in labels),
+             'loop features': lambda labels, buffer: loop_label_features(labels, buffer, enemy_list),
+             'count': lambda labels, buffer: features(labels),
+             'features': lambda labels, buffer: features(labels, buffer)}
+    print(f"{'path':>14} {'us/frame':>9} {'frames/s':>9}")
+    for name, path in paths.items():
+        t0 = time.perf_counter()
+        for labels, buffer in data:
+            path(labels, buffer)
+        per_frame = (time.perf_counter() - t0)/frames
+        print(f"{name:>14} {per_frame*1e6:>9.1f} {1/per_frame:>9.0f}")
+
+    max_err = 0
+    for labels, buffer in data:
+        count, coverage, distance = loop_label_features(labels, buffer, enemy_list)
+        result = features(labels, buffer)
+        assert result['enemy_count'] == count
+        max_err = max(max_err, abs(result['coverage'] - coverage), abs(result['crosshair_distance'] - distance))
+    print(f"counts match; max coverage/distance error {max_err:.2g}")
+
+def profiler_benchmark(laps=200000, steps=300, phases=10):
+    """
+    Cost of a profiler lap, enabled and disabled, against the agent side of a real
+    step (preprocess + image_to_tensor + choose_action, no game) with `phases` laps.
+    """
+    profilers = {'disabled': NULL_PROFILER,
+                 'enabled': StepProfiler(os.path.join(tempfile.gettempdir(), 'profile.json'))}
+    agent = build_agent()
+    preprocess = FramePreprocessor(126, 'uint8')
+    screen = np.random.randint(0, 256, (240, 320, 3)).astype(np.uint8)
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        agent.choose_action(agent.image_to_tensor(preprocess(screen)))
+    step_time = (time.perf_counter() - t0)/steps
+
+    print(f"agent step {step_time*1000:.2f}ms")
+    print(f"{'profiler':>9} {'ns/lap':>7} {'overhead/step':>14}")
+    for name, profiler in profilers.items():
+        t0 = time.perf_counter()
+        for _ in range(laps//phases):
+            for phase in range(phases):
+                profiler.lap(phase)
+            profiler.end_step()
+        per_lap = (time.perf_counter() - t0)/(laps//phases*(phases + 1))
+        print(f"{name:>9} {per_lap*1e9:>7.0f} {per_lap*(phases + 1)/step_time:>14.3%}")
+
+def telemetry_benchmark(steps=2000):
+    """
+    Trainer -> GUI pipe cost per step: the old per-metric sends (action_space array,
+    dmg_list, -9999 marker) against one Telemetry record, each read back by the GUI side.
+    """
+    send_conn, recv_conn = multiprocessing.Pipe()
+    action_space = np.random.randint(0, 10, 10).astype('int32')
+    metrics = [3, 0.5, [action_space], 12.5, 40, 0, 1000, 360, 9, [10, 4], 999999, -2, 30.5,
+               8.1, 1e-6, 720, -1.5, 12.0, 200, [5, 10, 0.4, 0.8, 0.5, 0.7], 3, 11.2, None, -9999]
+    telemetry = Telemetry(action_space=tuple(action_space.tolist()), reward_polarity=(10, 4))
+
+    print(f"{'message':>10} {'sends/step':>10} {'us/step':>8}")
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        for metric in metrics:
+            send_conn.send(metric)
+        while recv_conn.recv() != -9999:
+            pass
+    print(f"{'metrics':>10} {len(metrics):>10} {(time.perf_counter() - t0)/steps*1e6:>8.1f}")
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        send_conn.send(telemetry)
+        latest(recv_conn)
+    print(f"{'telemetry':>10} {1:>10} {(time.perf_counter() - t0)/steps*1e6:>8.1f}")
+
+def stats_benchmark(episode_lengths=(500, 3000, 10000)):
+    """
+    The per-step varz bookkeeping over one game: the qmax/critic running averages
+    and the three 25-game window averages the trainer reads every step, as
+    list/deque + np.mean against Doom_Stats.
+    """
+    print(f"{'steps':>6} {'legacy us/step':>15} {'stats us/step':>14}")
+    for steps in episode_lengths:
+        values = np.random.randint(0, 100, steps)
+        windows = [deque(np.random.rand(25)*50, maxlen=25) for _ in range(3)]
+        t0 = time.perf_counter()
+        qmax_list, critic_list = [], []
+        for value in values:
+            qmax_list.append(value)
+            round(np.mean(qmax_list), 1)
+            critic_list.append(value*0.5)
+            round(np.mean(critic_list), 1)
+            for window in windows:
+                np.mean(window)
+        legacy = (time.perf_counter() - t0)/steps
+
+        windows = [WindowStats(25, window) for window in windows]
+        t0 = time.perf_counter()
+        qmax_stats, critic_stats = RunningStats(), RunningStats()
+        for value in values:
+            qmax_stats.push(value)
+            round(qmax_stats.mean(), 1)
+            critic_stats.push(value*0.5)
+            round(critic_stats.mean(), 1)
+            for window in windows:
+                window.mean()
+        streaming = (time.perf_counter() - t0)/steps
+        print(f"{steps:>6} {legacy*1e6:>15.1f} {streaming*1e6:>14.1f}")
+
+def checkpoint_benchmark(saves=10, layouts=('split', 'shared')):
+    """
+    Time the game loop spends in Agent.save_models: the synchronous (atomic) T.save
+    against handing the weights to the CheckpointWriter thread, plus how long that
+    thread then takes to write them (versions and best copy included).
+    """
+    print(f"{'layout':>7} {'sync ms':>8} {'async ms':>9} {'writer ms':>10}")
+    for layout in layouts:
+        times = {'sync': 0.0, 'async': 0.0, 'writer': 0.0}
+        for mode in ('sync', 'async'):
+            agent = build_agent(model_layout=layout, checkpoint_async_bool=(mode == 'async'))
+            for save in range(saves):
+                t0 = time.perf_counter()
+                agent.save_models(reward=save)
+                times[mode] += time.perf_counter() - t0
+                if agent.checkpoint_writer: #one save per learn; the writer is idle by the next.
+                    t0 = time.perf_counter()
+                    agent.checkpoint_writer.flush()
+                    times['writer'] += time.perf_counter() - t0
+            if agent.checkpoint_writer:
+                agent.checkpoint_writer.close()
+        print(f"{layout:>7} {times['sync']/saves*1000:>8.1f} {times['async']/saves*1000:>9.1f} "
+              f"{times['writer']/saves*1000:>10.1f}")
+
+# Benchmark switchboard
+def main(mode):
+    if mode == 'gae':
+        gae_benchmark()
+    elif mode == 'model_layout':
+        model_layout_benchmark()
+    elif mode == 'inference':
+        inference_benchmark()
+    elif mode == 'quantization':
+        quantization_benchmark()
+    elif mode == 'render':
+        render_benchmark()
+    elif mode == 'reset':
+        reset_benchmark()
+    elif mode == 'reward':
+        reward_benchmark()
+    elif mode == 'preprocess':
+        preprocess_benchmark()
+    elif mode == 'transport':
+        transport_benchmark()
+    elif mode == 'labels':
+        labels_benchmark()
+    elif mode == 'profiler':
+        profiler_benchmark()
+    elif mode == 'telemetry':
+        telemetry_benchmark()
+    elif mode == 'stats':
+        stats_benchmark()
+    elif mode == 'checkpoint':
+        checkpoint_benchmark()
+
+if __name__ == "__main__":
+    main('gae')
@@ -0,0 +1,284 @@
+"""
+Model checkpoints off the game loop.
+
+save_models used to T.save straight over pretrained_model/current_model_*.pth after
+every learn: the loop waited on the disk, and a crash mid-write left a truncated
+file where the only copy of the model was. Now every save is atomic (written to
+<path>.tmp, flushed, then os.replace'd over <path>, so <path> is always a whole
+checkpoint, old or new), and with params 'checkpoint_async_bool' a CheckpointWriter
+does the writing:
+    submit()  copies the state_dicts in memory (the only work on the caller's
+              thread) and hands them to the writer thread.
+    thread    writes <path>, then keeps copies in pretrained_model/checkpoints:
+              <name>.<version>.pth for the last `keep_last` saves, and <name>.best.pth
+              for the save with the highest reward (best.json remembers that reward
+              across runs).
+If a save comes in while the previous one is still waiting, the waiting one is
+replaced instead of queued (and never written, not even as best); only the newest
+weights are worth the disk time.
+
+TrainingSnapshot (same thread machinery) keeps the whole training state for
+resuming: weights, optimizers, params, counters and random streams; see
+ModelTrain.resume.
+"""
+import os
+import re
+import copy
+import json
+import math
+import time
+import atexit
+import pickle
+import random
+import shutil
+import threading
+from collections import OrderedDict
+import numpy as np
+import torch as T
+
+CHECKPOINT_DIR = os.path.join('pretrained_model', 'checkpoints')
+
+def atomic_save(obj, path):
+    """T.save to a temp file next to path, then rename it over path."""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        T.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def atomic_copy(source, path):
+    temp_path = path + '.tmp'
+    shutil.copyfile(source, temp_path)
+    os.replace(temp_path, path)
+
+def atomic_json(obj, path):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(obj, f, indent=1)
+    os.replace(temp_path, path)
+
+def snapshot(state_dict):
+    """CPU copy of a state_dict that later optimizer steps cannot touch."""
+    copy = OrderedDict((key, value.detach().to('cpu', copy=True)) for key, value in state_dict.items())
+    if hasattr(state_dict, '_metadata'):
+        copy._metadata = state_dict._metadata
+    return copy
+
+class BackgroundWriter():
+    """
+    Worker thread that writes whatever job is pending. put() never waits: a job that
+    arrives while another is pending is merged into it (merge(); the newer one
+    replaces it by default). Subclasses define write(job).
+    """
+    def __init__(self):
+        self.pending = None #job waiting for the thread.
+        self.busy = False
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name=type(self).__name__, daemon=True)
+        self.thread.start()
+        atexit.register(self.close) #finish the last job before the interpreter goes.
+
+    def merge(self, pending, job):
+        return job
+
+    def put(self, job):
+        with self.condition:
+            self.pending = job if self.pending is None else self.merge(self.pending, job)
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None: #closed, nothing left to write.
+                    return
+                job = self.pending
+                self.pending = None
+                self.busy = True
+            try:
+                self.write(job)
+            except Exception as e:
+                print(f"{type(self).__name__} write failed:", e)
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    def write(self, job):
+        raise NotImplementedError
+
+    def flush(self):
+        """Blocks until everything put so far is on disk."""
+        with self.condition:
+            while self.pending is not None or self.busy:
+                self.condition.wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+class CheckpointWriter(BackgroundWriter):
+    """Writes submitted state_dicts on a background thread, with retention."""
+    def __init__(self, directory=CHECKPOINT_DIR, keep_last=3):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.keep_last = keep_last
+        self.best_file = os.path.join(self.directory, 'best.json')
+        self.best_reward = None
+        if os.path.exists(self.best_file):
+            with open(self.best_file) as f:
+                self.best_reward = json.load(f)['reward']
+        self.version = self.last_version() + 1
+        super().__init__()
+
+    def last_version(self):
+        versions = [int(match.group(1)) for match in
+                    (re.search(r'\.(\d+)\.pth$', name) for name in os.listdir(self.directory)) if match]
+        return max(versions, default=0)
+
+    def submit(self, state_dicts, reward=None):
+        """state_dicts: {path: state_dict}; reward decides the best copy (None = not a candidate)."""
+        files = {os.path.abspath(path): snapshot(state_dict) for path, state_dict in state_dicts.items()}
+        if reward is not None and math.isnan(reward): #e.g. the average of no games yet.
+            reward = None
+        self.put((files, None if reward is None else float(reward)))
+
+    def write(self, job):
+        files, reward = job
+        best_bool = reward is not None and (self.best_reward is None or reward > self.best_reward)
+        for path, state_dict in files.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_save(state_dict, path)
+            name = os.path.splitext(os.path.basename(path))[0]
+            atomic_copy(path, os.path.join(self.directory, f'{name}.{self.version:06d}.pth'))
+            if best_bool:
+                atomic_copy(path, os.path.join(self.directory, f'{name}.best.pth'))
+            self.prune(name)
+        if best_bool:
+            self.best_reward = reward
+            atomic_json({'reward': reward, 'version': self.version}, self.best_file)
+        self.version += 1
+
+    def prune(self, name):
+        """Deletes all but the newest keep_last versions of name."""
+        pattern = re.compile(re.escape(name) + r'\.(\d+)\.pth$')
+        versions = sorted((int(match.group(1)), match.group(0)) for match in
+                          (pattern.match(file_name) for file_name in os.listdir(self.directory)) if match)
+        for _, file_name in versions[:-self.keep_last or None]:
+            os.remove(os.path.join(self.directory, file_name))
+
+SNAPSHOT_DIR = os.path.join('pretrained_model', 'snapshot')
+MANIFEST_FILE = 'manifest.json'
+
+def rng_state():
+    """Every random stream training draws from."""
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': T.get_rng_state()}
+    if T.cuda.is_available():
+        state['cuda'] = T.cuda.get_rng_state_all()
+    return state
+
+def load_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    T.set_rng_state(state['torch'])
+    if 'cuda' in state and T.cuda.is_available():
+        T.cuda.set_rng_state_all(state['cuda'])
+
+class TrainingSnapshot(BackgroundWriter):
+    """
+    Everything needed to pick a killed run back up, kept as separate parts so a save
+    only rewrites what changed:
+        policy   model weights + Adam states (Agent.training_state, or the learner's), torch file
+        params, varz, wrapper (DoomGame.training_state; a list of them with num_envs > 1), rng   pickles
+    Each write puts the new part files next to the old ones (<part>.<n>.pt/.pkl) and
+    then replaces manifest.json, which names the current file of every part; files
+    the manifest no longer names are deleted after. A crash at any point leaves the
+    previous manifest and everything it names intact.
+    save() copies the parts on the caller's thread (a deep copy of the policy, a
+    pickle of the rest) and the thread does the disk work; parts saved while an
+    earlier save is still pending are merged into it.
+    """
+    def __init__(self, directory=SNAPSHOT_DIR):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.manifest = self.read_manifest()
+        self.counter = self.manifest.get('counter', 0)
+        super().__init__()
+
+    def read_manifest(self):
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def exists(self):
+        return bool(self.manifest.get('parts'))
+
+    def clear(self):
+        """Drops the saved run (a run that does not resume starts a fresh snapshot)."""
+        self.flush()
+        with self.condition:
+            manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+            if os.path.exists(manifest_path): #manifest first, so no manifest names a missing part.
+                os.remove(manifest_path)
+            for file_name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, file_name))
+            self.manifest = {}
+
+    def save(self, parts):
+        """parts: {name: object}; only these parts are rewritten."""
+        job = {}
+        for name, obj in parts.items():
+            if name == 'policy':
+                job[name] = copy.deepcopy(obj)
+            else:
+                job[name] = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        self.put(job)
+
+    def merge(self, pending, job):
+        return dict(pending, **job)
+
+    def write(self, job):
+        files = dict(self.manifest.get('parts', {}))
+        for name, obj in job.items():
+            self.counter += 1
+            if name == 'policy':
+                file_name = f'{name}.{self.counter:06d}.pt'
+                atomic_save(obj, os.path.join(self.directory, file_name))
+            else:
+                file_name = f'{name}.{self.counter:06d}.pkl'
+                temp_path = os.path.join(self.directory, file_name + '.tmp')
+                with open(temp_path, 'wb') as f:
+                    f.write(obj)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, os.path.join(self.directory, file_name))
+            files[name] = file_name
+        manifest = {'parts': files, 'counter': self.counter, 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+        atomic_json(manifest, os.path.join(self.directory, MANIFEST_FILE))
+        self.manifest = manifest
+        for file_name in os.listdir(self.directory): #superseded part files.
+            if file_name != MANIFEST_FILE and file_name not in files.values():
+                os.remove(os.path.join(self.directory, file_name))
+
+    def load(self, names=None):
+        """{part: object} for the named parts (all by default) of the last complete save."""
+        parts = {}
+        for name, file_name in self.manifest.get('parts', {}).items():
+            if names is not None and name not in names:
+                continue
+            path = os.path.join(self.directory, file_name)
+            if name == 'policy':
+                parts[name] = T.load(path, map_location='cpu')
+            else:
+                with open(path, 'rb') as f:
+                    parts[name] = pickle.load(f)
+        return parts
@@ -0,0 +1,163 @@
+"""
+Packed frame datasets.
+
+The old datasets are folders of "index,action.png" files, one PNG per frame, that get
+natural-sorted, parsed and decoded into RAM before anything can use them. A packed
+dataset is one folder with
+    frames.u8   every frame back to back, uint8 (N, H, W); opened as a np.memmap
+    index.npz   actions (N,), rewards (N,; NaN if unknown), episode_starts (E+1,)
+                boundaries, frame_shape
+Frames are kept in the FrameStore encoding (see Doom_Preprocess), so the loader only
+has to gather and decode them; no PNG is touched while training.
+
+    convert_png_folders('Dataset', 'Dataset_Packed')       #existing PNG folders
+    convert_replays('recordings', 'Dataset_Replays')       #Doom_Replay output
+    for batch in MinibatchStream(PackedDataset('Dataset_Packed'), 200):
+        batch['states'], batch['actions'], batch['rewards']
+"""
+import os
+import re
+import cv2
+import numpy as np
+
+from Doom_Preprocess import FramePreprocessor
+
+FRAMES_FILE = 'frames.u8'
+INDEX_FILE = 'index.npz'
+
+def natural_sorter(data):
+    """Sorts file names so "10,2.png" comes after "9,2.png"."""
+    convert = lambda text: int(text) if text.isdigit() else text.lower()
+    alphanum_key = lambda key: [convert(c) for c in re.split('([0-9]+)', key)]
+    return sorted(data, key=alphanum_key)
+
+def filename_action(file_name):
+    """Action from the "index,action.png" naming convention."""
+    return int(os.path.splitext(file_name)[0].split(',')[1])
+
+class DatasetWriter():
+    """Appends whole episodes to a packed dataset; close() writes the index."""
+    def __init__(self, path, frame_shape=(126, 126)):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.frame_shape = tuple(frame_shape)
+        self.frames_file = open(os.path.join(path, FRAMES_FILE), 'wb')
+        self.actions, self.rewards = [], []
+        self.episode_starts = [0]
+
+    def add_episode(self, frames, actions, rewards=None):
+        frames = np.ascontiguousarray(frames, dtype=np.uint8).reshape(-1, *self.frame_shape)
+        if rewards is None:
+            rewards = np.full(len(frames), np.nan)
+        frames.tofile(self.frames_file)
+        self.actions.append(np.asarray(actions, dtype=np.int16))
+        self.rewards.append(np.asarray(rewards, dtype=np.float32))
+        self.episode_starts.append(self.episode_starts[-1] + len(frames))
+
+    def close(self):
+        self.frames_file.close()
+        np.savez(os.path.join(self.path, INDEX_FILE),
+                 actions=np.concatenate(self.actions) if self.actions else np.zeros(0, np.int16),
+                 rewards=np.concatenate(self.rewards) if self.rewards else np.zeros(0, np.float32),
+                 episode_starts=np.array(self.episode_starts, dtype=np.int64),
+                 frame_shape=np.array(self.frame_shape))
+
+class PackedDataset():
+    """Read-only view of a packed dataset; frames stay on disk until indexed."""
+    def __init__(self, path):
+        with np.load(os.path.join(path, INDEX_FILE)) as index:
+            self.actions = index['actions']
+            self.rewards = index['rewards']
+            self.episode_starts = index['episode_starts']
+            self.frame_shape = tuple(index['frame_shape'])
+        self.frames = np.memmap(os.path.join(path, FRAMES_FILE), dtype=np.uint8, mode='r',
+                                shape=(len(self.actions), *self.frame_shape))
+
+    def __len__(self):
+        return len(self.actions)
+
+    def num_episodes(self):
+        return len(self.episode_starts) - 1
+
+    def episode(self, i):
+        """Frames, actions and rewards of one episode (the frames are still a memmap view)."""
+        span = slice(self.episode_starts[i], self.episode_starts[i+1])
+        return self.frames[span], self.actions[span], self.rewards[span]
+
+    def stack_ids(self, indices, history=60, offsets=(0, 30, 45, 59)):
+        """
+        (batch, 4) frame ids of the states at indices, built the way FrameStore builds
+        them during play: the newest frame repeated until the episode has a full history.
+        """
+        indices = np.asarray(indices)
+        starts = self.episode_starts[np.searchsorted(self.episode_starts, indices, side='right') - 1]
+        ids = indices[:, None] - (history - 1) + np.array(offsets)[None, :]
+        early = indices - starts < history - 1
+        ids[early] = indices[early, None]
+        return ids
+
+class MinibatchStream():
+    """
+    Shuffled minibatches over a PackedDataset, read straight from the memmap.
+    stack_bool=True yields 4 frame states like the agent's; output 'float32' decodes
+    them to model input, 'uint8' leaves them encoded. The final short batch is kept.
+    """
+    def __init__(self, dataset, batch_size=200, shuffle_bool=True, stack_bool=True,
+                 output='float32', history=60, offsets=(0, 30, 45, 59)):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle_bool = shuffle_bool
+        self.stack_bool = stack_bool
+        self.output = output
+        self.history = history
+        self.offsets = offsets
+        self.decode = np.arange(256, dtype=np.float32)/255 #same lookup as FrameStore
+
+    def __len__(self):
+        return -(-len(self.dataset)//self.batch_size)
+
+    def __iter__(self):
+        order = np.arange(len(self.dataset))
+        if self.shuffle_bool:
+            np.random.shuffle(order)
+        for start in range(0, len(order), self.batch_size):
+            #sorted within the batch so the memmap is read front to back.
+            indices = np.sort(order[start:start+self.batch_size])
+            ids = self.dataset.stack_ids(indices, self.history, self.offsets) if self.stack_bool else indices
+            states = self.dataset.frames[ids.ravel()].reshape(*ids.shape, *self.dataset.frame_shape)
+            if self.output == 'float32':
+                states = np.take(self.decode, states)
+            yield {'indices': indices, 'states': states,
+                   'actions': self.dataset.actions[indices], 'rewards': self.dataset.rewards[indices]}
+
+def convert_png_folders(dataset_dir, out_path, xy=126, preprocess_bool=True):
+    """
+    Packs every episode folder of "index,action.png" frames in dataset_dir.
+    preprocess_bool runs the frames through the same preprocessing as live play,
+    otherwise they are only resized to xy.
+    """
+    preprocess = FramePreprocessor(xy, 'uint8')
+    writer = DatasetWriter(out_path, (xy, xy))
+    folders = natural_sorter(name for name in os.listdir(dataset_dir)
+                             if os.path.isdir(os.path.join(dataset_dir, name)))
+    for folder in folders:
+        folder_path = os.path.join(dataset_dir, folder)
+        file_list = natural_sorter(name for name in os.listdir(folder_path) if name.endswith('.png'))
+        frames = np.empty((len(file_list), xy, xy), dtype=np.uint8)
+        for i, file_name in enumerate(file_list):
+            image = cv2.imread(os.path.join(folder_path, file_name), cv2.IMREAD_GRAYSCALE)
+            frames[i] = preprocess(image) if preprocess_bool else cv2.resize(image, (xy, xy))
+        writer.add_episode(frames, [filename_action(name) for name in file_list])
+        print(f"{folder}: {len(file_list)} frames")
+    writer.close()
+
+def convert_replays(demo_dir, out_path, xy=126):
+    """Packs the <name>_replay.npz files Doom_Replay.main writes, one episode each."""
+    writer = DatasetWriter(out_path, (xy, xy))
+    for name in natural_sorter(name for name in os.listdir(demo_dir) if name.endswith('_replay.npz')):
+        with np.load(os.path.join(demo_dir, name)) as replay:
+            writer.add_episode(replay['frames'], replay['actions'], replay['rewards'])
+    writer.close()
+
+if __name__ == "__main__":
+    convert_png_folders('Dataset', 'Dataset_Packed')
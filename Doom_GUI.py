@@ -27,6 +27,7 @@ from PyQt5 import QtWidgets as qtw
 from PyQt5 import QtGui as qtg
 from PyQt5 import QtCore as qtc
 import Graphing_Widgets as gw
+import Doom_Telemetry
 
 class MainWindow(qtw.QMainWindow):
 
@@ -89,7 +90,8 @@ class CentralWidget(qtw.QWidget):
                         'JUMP'
                         ]
 
-        self.metrics_last = [0 for n in range(30)] #initialize empty.
+        self.telemetry = self.telemetry_last = Doom_Telemetry.Telemetry() #empty until the trainer sends.
+        self.profile_text = ' Available "lap_metrics"' #step latency, once the trainer dumps a profile.
 
         ## Plot of Total Reward
         self.g_treward_que1 = deque(maxlen=self.master_data_width)
@@ -326,48 +328,41 @@ class CentralWidget(qtw.QWidget):
         return evo_groupbox
 
     def update_gui(self):
-        self.metrics = []
-        #begin_time =time.time()
         try:
-            if self.connection.poll(timeout=0.1):
-                #print('********************Recieved Connection********************')
-                while 1:
-                    metric = self.connection.recv()
-                    self.metrics.append(metric)
-                    if metric == -9999:# dummy figure thrown in to singal the end.
-                        break
+            telemetry = Doom_Telemetry.latest(self.connection) #newest complete step; stale ones are skipped.
+            if telemetry is None:
+                return
+            self.telemetry = telemetry
 
             #Update Metrics:
-            action = self.metrics[0]
-            reward = self.metrics[1]
-            action_space = self.metrics[2]
-            total_reward = self.metrics[3]
-            subcycle = self.metrics[4]
-
-            iteration = self.metrics[6]
-            total_time = self.metrics[7]
-            qmax = self.metrics[8]
-            reward_polarity = self.metrics[9]
-
-            crit_val = self.metrics[11]
-            cycles_per_second = self.metrics[12]
-            agent_qmax_avg = self.metrics[13]
-            actor_learning_rate = self.metrics[14]
-            game_time = self.metrics[15]
-            critic_qmax_avg = self.metrics[16]
-            race_time_delta = max(round(self.metrics[17], 1), 1)
-            mini_batch_size = self.metrics[18]
-            
-            dmg_list = self.metrics[19] #metrics_last
-            dmg_in = dmg_list[0]
-            dmg_out = dmg_list[1]
-            dps_in = dmg_list[2]
-            dps_out = dmg_list[3]
-            dps_in_avg = dmg_list[4]
-            dps_out_avg = dmg_list[5]
-
-            game_count = self.metrics[20]
-            reward_avg = self.metrics[21]
+            action = telemetry.action
+            reward = telemetry.reward
+            action_space = telemetry.action_space
+            total_reward = telemetry.total_reward
+            subcycle = telemetry.subcycle
+
+            iteration = telemetry.iteration
+            total_time = telemetry.total_time
+            qmax = telemetry.qmax
+            reward_polarity = telemetry.reward_polarity
+
+            crit_val = telemetry.crit_val
+            cycles_per_second = telemetry.cycles_per_second
+            agent_qmax_avg = telemetry.agent_qmax_avg
+            actor_learning_rate = telemetry.actor_learning_rate
+            game_time = telemetry.game_time
+            critic_qmax_avg = telemetry.critic_qmax_avg
+            race_time_delta = max(round(telemetry.race_time, 1), 1)
+            mini_batch_size = telemetry.mini_batch_size
+
+            dps_in = telemetry.dps_in
+            dps_out = telemetry.dps_out
+            dps_in_avg = telemetry.dps_in_avg
+            dps_out_avg = telemetry.dps_out_avg
+
+            game_count = telemetry.game_count
+            reward_avg = telemetry.reward_avg
+            profile = telemetry.profile
 
             fail_rate = round(reward_polarity[1]/sum(reward_polarity)*100,2) #[positive count, negative count]
             #fail_rate = 1
@@ -381,16 +376,21 @@ class CentralWidget(qtw.QWidget):
             self.fail_rate.setText(f' Fail Rate: {fail_rate}%')
             self.current_cycle.setText(f' Current Cycle: {iteration}/{game_count}')
             self.ai_time.setText(f' Time: {str(timedelta(seconds=total_time))}/{str(timedelta(seconds=game_time))}')
-            self.lap_metrics.setText(f' Available "lap_metrics"')
+            if profile and 'step' in profile:
+                step = profile['step']
+                self.profile_text = f' Step p50/p95/p99: {step["p50"]}/{step["p95"]}/{step["p99"]}ms'
+                self.lap_metrics.setToolTip("\n".join(f"{phase}: {stats['p50']}/{stats['p95']}/{stats['p99']}ms"
+                                                      for phase, stats in profile.items()))
+            self.lap_metrics.setText(self.profile_text)
             self.dps.setText(f' DPS In/Out: {dps_in}/{dps_out}')
             self.cycles_per_second.setText(f' Cycles/Second: {cycles_per_second}')
-            self.avg_qmax.setText(f' Actor/Critic Avg Qmax: {agent_qmax_avg}/{self.metrics_last[16]}')
+            self.avg_qmax.setText(f' Actor/Critic Avg Qmax: {agent_qmax_avg}/{self.telemetry_last.critic_qmax_avg}')
 
             if not self.fast_mode:
-                self.reward_scan.setStyleSheet(self.color_coder(1, zero=True)) #Color Code reward_scans
+                self.reward_scan.setStyleSheet(self.color_coder('reward', zero=True)) #Color Code reward_scans
 
                 #update per-frame graphs
-                action_arr = action_space[0]
+                action_arr = action_space
                 self.g_action_que1.append(action_arr[0])
                 self.g_action_que2.append(action_arr[1])
                 self.g_action_que3.append(action_arr[2])
@@ -428,43 +428,41 @@ class CentralWidget(qtw.QWidget):
                 circle_pixmap = (int(color_set[1]) + 11)
                 self.circle.setPixmap(self.pixmap_dict[circle_pixmap])
 
-            #Update per-game Graphs
-            if ((game_count > self.metrics_last[20])
-                and (self.metrics_last[20] > 0)):
+            #Update per-game Graphs; every game that ended since the last update, with its closing values.
+            for game in telemetry.games:
+                self.g_treward_que1.append(game.total_reward) #Final Reward
+                self.g_treward_que2.append(game.reward_avg) #avg
+                self.g_avg_qmax_que1.append(game.agent_qmax_avg) #qmax avg
+                self.g_avg_qmax_que2.append(game.qmax) #qmax closing
+                self.g_avg_qmax_que3.append(game.critic_qmax_avg) #critic avg
+                self.g_avg_qmax_que4.append(game.crit_val) #critic closing
+                self.g_damage_que1.append(game.dps_in)
+                self.g_damage_que2.append(game.dps_out)
+                self.g_damage_que3.append(game.dps_in_avg)
+                self.g_damage_que4.append(game.dps_out_avg)
+            if telemetry.games:
+                game = telemetry.games[-1]
                 ## Total Reward Update
-                self.g_treward_que1.append(self.metrics_last[3]) #Final Reward
-                self.g_treward_que2.append(reward_avg) #avg
-                graph_treward_label = f'Total Reward Avg: ({reward_avg})'
+                graph_treward_label = f'Total Reward Avg: ({game.reward_avg})'
                 self.g_treward.add_value(self.g_treward_que1, input_2=self.g_treward_que2,
                                          title=graph_treward_label)
 
                 ## Qmax/Critic Avg Update
-                self.g_avg_qmax_que1.append(self.metrics_last[13]) #qmax avg
-                self.g_avg_qmax_que2.append(self.metrics_last[8]) #qmax closing
-                self.g_avg_qmax_que3.append(self.metrics_last[16]) #critic avg
-                self.g_avg_qmax_que4.append(self.metrics_last[11]) #critic closing
-                graph_avg_qmax_label = f'Actor({self.metrics_last[13]}) vs Critic({self.metrics_last[16]}) Avg'
+                graph_avg_qmax_label = f'Actor({game.agent_qmax_avg}) vs Critic({game.critic_qmax_avg}) Avg'
                 self.g_avg_qmax.add_value(self.g_avg_qmax_que1, self.g_avg_qmax_que2,
                                                 self.g_avg_qmax_que3, self.g_avg_qmax_que4, 
                                                 title=graph_avg_qmax_label)
                 ## Plot DPS
-                dmg_list = self.metrics_last[19]
-                dps_in = round(dmg_list[0]/self.metrics_last[17], 1)
-                dps_out = round(dmg_list[1]/self.metrics_last[17], 1)
-                self.g_damage_que1.append(dps_in)
-                self.g_damage_que2.append(dps_out)
-                self.g_damage_que3.append(dps_in_avg)
-                self.g_damage_que4.append(dps_out_avg)
                 self.g_damage.add_value(self.g_damage_que1,
                                         input_2=self.g_damage_que2,
                                         input_3=self.g_damage_que3,
                                         input_4=self.g_damage_que4)
 
-            self.metrics_last = self.metrics
+            self.telemetry_last = telemetry
             #print('********************COMPLETED UPDATE GUI********************')
         
         except Exception as e:
-            if str(e) != "'int' object has no attribute 'poll'" and str(e) != "list index out of range":
+            if str(e) != "'int' object has no attribute 'poll'":
                 print("Receive Failure:", e)
 
     def title_module(self):
@@ -554,10 +552,10 @@ class CentralWidget(qtw.QWidget):
                 self.fast_button.setText("Fast Mode: On")
                 self.fast_button.setStyleSheet(click_style_off)
 
-    def color_coder(self, metrics_index, distribution=0, percent_max=0, zero=False): # distribution[yellow, orange, red, purple]
-        # percent_max will represent 100%, and will trigger percentage mode if provided (0 is off)
-        value = self.metrics[metrics_index]
-        last_value = self.metrics_last[metrics_index]
+    def color_coder(self, field, distribution=0, percent_max=0, zero=False): # distribution[yellow, orange, red, purple]
+        # field is a Doom_Telemetry field name; percent_max will represent 100%, and will trigger percentage mode if provided (0 is off)
+        value = getattr(self.telemetry, field)
+        last_value = getattr(self.telemetry_last, field)
 
         if distribution:
             if percent_max:
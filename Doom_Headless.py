@@ -0,0 +1,146 @@
+"""
+Training without the GUI.
+
+Doom_Launcher runs Doom_Train_A2C next to the Qt GUI and never returns; this runs one
+trainer from a config file, with no Qt or matplotlib imported, writes its metrics to
+disk and exits once its frame or time budget is spent:
+    python Doom_Headless.py run.json [--frames N] [--seconds S] [--out DIR]
+run.json (every key optional):
+    {
+     "out_dir": "runs/map07_a",       #everything the run writes goes here (default headless_run).
+     "doom_map": "MAP07",
+     "render_profile": "train-minimal",
+     "num_envs": 4,                   #worker count; >1 trains through train_vector.
+     "frame_budget": 2000000,         #frames (tics), a resumed run's earlier frames included; 0 = no limit.
+     "time_budget": 3600,             #seconds of this process; 0 = no limit.
+     "torch_threads": 2,              #T.set_num_threads; 0 leaves torch's default.
+     "metrics_interval": 30,          #seconds between progress rows.
+     "check_frames": 0,               #frames between run(config, check) calls; see run.
+     "params": {"actor_learning_rate": 5e-6, "gamma": 0.98}
+    }
+The shorthand keys are ModelTrain params and go in with "params" (an unknown param is
+a KeyError, not a silent no-op). The trainer runs inside out_dir, so models, snapshot
+and profile land in out_dir/pretrained_model; rerunning a config resumes from its
+snapshot, and models copied into out_dir/pretrained_model beforehand are trained on.
+Writes:
+    out_dir/metrics.jsonl   a row per finished game and per metrics_interval (TelemetryLog)
+    out_dir/summary.json    final counters once the run has closed.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+from datetime import datetime
+
+import torch as T
+
+from Doom_Train_A2C import ModelTrain
+from Doom_Telemetry import TelemetryLog
+
+PARAM_KEYS = ('doom_map', 'render_profile', 'num_envs', 'frame_budget', 'time_budget')
+
+def load_config(path):
+    with open(path) as f:
+        return json.load(f)
+
+def config_params(config):
+    """The ModelTrain overrides a config asks for; headless runs default to 'train-minimal' rendering."""
+    params = {'render_profile': 'train-minimal'}
+    params.update(config.get('params', {}))
+    params.update((key, config[key]) for key in PARAM_KEYS if key in config)
+    return params
+
+def stop_on_sigterm(signum, frame):
+    raise KeyboardInterrupt #same clean exit as ctrl+c.
+
+def train_to_budget(trainer, start, sink):
+    if trainer.params['num_envs'] > 1:
+        trainer.train_vector(start, sink)
+    else:
+        while not trainer.budget_reached():
+            trainer.train(start, sink)
+
+def run(config, check=None):
+    """
+    Trains to the config's budget inside config['out_dir']; returns the summary dict.
+    With check (and config['check_frames']), check(trainer) runs at the first game end
+    after every check_frames frames and True from it stops the run (ModelTrain.check_stage);
+    Doom_Sweep uses that to stop losing trials early. A resumed run goes on from check.stage,
+    the last stage check has seen, or else from the stages its earlier frames passed.
+    """
+    out_dir = os.path.abspath(config.get('out_dir', 'headless_run'))
+    os.makedirs(os.path.join(out_dir, 'pretrained_model'), exist_ok=True)
+    home_dir = os.getcwd()
+    os.chdir(out_dir)
+    if config.get('torch_threads'):
+        T.set_num_threads(config['torch_threads'])
+    previous_handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)}
+    signal.signal(signal.SIGTERM, stop_on_sigterm)
+
+    sink = TelemetryLog(os.path.join(out_dir, 'metrics.jsonl'), config.get('metrics_interval', 30))
+    trainer = None
+    exit_reason = 'budget'
+    try:
+        start = datetime.now()
+        trainer = ModelTrain(config_params(config))
+        if check and config.get('check_frames'):
+            trainer.stage_check, trainer.check_frames = check, config['check_frames']
+            trainer.stage = getattr(check, 'stage', trainer.run_frames()//trainer.check_frames)
+        train_to_budget(trainer, start, sink)
+        if trainer.stop_bool:
+            exit_reason = 'stopped'
+    except KeyboardInterrupt:
+        exit_reason = 'interrupted'
+    finally:
+        for signum in previous_handlers: #a second ctrl+c or SIGTERM must not cut the close short.
+            signal.signal(signum, signal.SIG_IGN)
+        if trainer:
+            trainer.close()
+        sink.close()
+        os.chdir(home_dir)
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+    if trainer is None: #interrupted while starting up.
+        return {'exit_reason': exit_reason}
+
+    varz = trainer.varz
+    summary = {'exit_reason': exit_reason,
+               'frames': trainer.run_frames(),
+               'seconds': round(time.time() - trainer.run_start_time, 1),
+               'iteration': varz['iteration'],
+               'game_count': varz['game_count'],
+               'reward_avg_performance': float(varz['reward_avg_performance']),
+               'reward_standard_deviation': float(varz['reward_standard_deviation']),
+               'time_avg_performance': float(varz['time_avg_performance']),
+               'params': trainer.params}
+    with open(os.path.join(out_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=1, default=str)
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train without the GUI from a JSON config.')
+    parser.add_argument('config', help='JSON config file (see Doom_Headless docstring)')
+    parser.add_argument('--frames', type=int, help='frame budget; overrides the config')
+    parser.add_argument('--seconds', type=float, help='time budget; overrides the config')
+    parser.add_argument('--out', help='output directory; overrides the config')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if args.frames is not None:
+        config['frame_budget'] = args.frames
+    if args.seconds is not None:
+        config['time_budget'] = args.seconds
+    if args.out:
+        config['out_dir'] = args.out
+    params = config_params(config)
+    if not params.get('frame_budget') and not params.get('time_budget'):
+        print('Headless run with no frame or time budget; stop it with ctrl+c or SIGTERM.')
+    summary = run(config)
+    print(f"Headless run finished ({summary['exit_reason']}):",
+          {key: value for key, value in summary.items() if key != 'params'})
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Enemy features from the labels buffer.
+
+vizdoom draws every visible object into the labels buffer as its label value, and
+state.labels says which object each value is. LabelFeatures maps object names to
+integer ids once (per map; the table is only extended when a new name shows up),
+so a frame needs no string work, only a value -> enemy lookup table and three
+whole-buffer passes:
+    enemy_count         enemy labels on screen (what reward_rules counted by name)
+    coverage            fraction of the screen covered by enemy pixels
+    crosshair_distance  nearest enemy pixel to the screen center, 0 (on target) to
+                        1 (screen corner, or no enemy at all)
+The passes are cv2.LUT (buffer -> enemy mask), countNonZero, and minMaxLoc of a
+precomputed squared-distance grid under the mask; same values as the NumPy
+nonzero/min, without materializing pixel coordinates.
+vector() packs them into the small float32 input the models can take alongside
+the frames (params 'label_inputs_bool').
+"""
+import cv2
+import numpy as np
+
+NUM_LABEL_FEATURES = 3
+NO_ENEMY_FEATURES = (0.0, 0.0, 1.0) #vector() of a frame without enemies.
+
+class LabelFeatures():
+    """Per frame enemy features; one instance per game."""
+    def __init__(self, enemy_names):
+        self.enemy_names = frozenset(enemy_names)
+        self.mask = None #enemy pixels; allocated with the grid for the buffer shape.
+        self.distance_grid = None #squared distance of every pixel to the screen center.
+        self.reset()
+
+    def reset(self):
+        """Forgets the name ids; call when the map changes."""
+        self.name_ids = {}
+        self.is_enemy = [] #by name id
+        self.enemy_lut = np.zeros(256, dtype=np.uint8) #label value -> 255 if enemy
+        self.features = {'enemy_count': 0, 'coverage': 0.0, 'crosshair_distance': 1.0}
+
+    def name_id(self, name):
+        if name not in self.name_ids:
+            self.name_ids[name] = len(self.name_ids)
+            self.is_enemy.append(str(name) in self.enemy_names)
+        return self.name_ids[name]
+
+    def enemy_values(self, labels):
+        """Label values of the enemies among labels."""
+        name_ids, is_enemy = self.name_ids, self.is_enemy
+        values = []
+        for label in labels:
+            name = label.object_name
+            if is_enemy[name_ids[name] if name in name_ids else self.name_id(name)]:
+                values.append(label.value)
+        return values
+
+    def shape_buffers(self, shape):
+        height, width = shape
+        ys, xs = np.mgrid[:height, :width]
+        self.distance_grid = ((ys - height/2)**2 + (xs - width/2)**2).astype(np.float32)
+        self.half_diagonal = np.hypot(height/2, width/2)
+        self.mask = np.empty(shape, dtype=np.uint8)
+
+    def __call__(self, labels, labels_buffer=None):
+        """Features of one frame; without a buffer only enemy_count is computed."""
+        enemy_values = self.enemy_values(labels) if labels else []
+        features = {'enemy_count': len(enemy_values), 'coverage': 0.0, 'crosshair_distance': 1.0}
+
+        if labels_buffer is not None and enemy_values:
+            if self.mask is None or self.mask.shape != labels_buffer.shape:
+                self.shape_buffers(labels_buffer.shape)
+            self.enemy_lut[:] = 0
+            self.enemy_lut[enemy_values] = 255
+            cv2.LUT(labels_buffer, self.enemy_lut, dst=self.mask)
+            pixels = cv2.countNonZero(self.mask)
+            if pixels:
+                features['coverage'] = pixels/self.mask.size
+                nearest = cv2.minMaxLoc(self.distance_grid, self.mask)[0]
+                features['crosshair_distance'] = float(np.sqrt(nearest)/self.half_diagonal)
+        self.features = features
+        return features
+
+    def vector(self, features=None):
+        """Model input: [enemy_count/10 (capped at 1), coverage, crosshair_distance]."""
+        features = self.features if features is None else features
+        return np.array([min(features['enemy_count'], 10)/10, features['coverage'],
+                         features['crosshair_distance']], dtype=np.float32)
@@ -0,0 +1,169 @@
+"""
+Actor/learner split.
+
+The training loop (the actor) keeps playing while a separate learner process runs
+the PPO update. Rollouts go to the learner through a torch.multiprocessing queue,
+which moves the arrays into shared memory instead of pickling them. After every
+update the learner copies its weights into a shared-memory state_dict and bumps
+a version counter; the actor pulls them at its next reset.
+
+Policy lag = how many learner updates behind the policy that collected a rollout
+was, at the time it is learned from. 0 means fully on-policy.
+
+The learner starts from the acting agent's training_state (weights and Adam states),
+not from the checkpoints on disk, so a resumed run keeps learning where it stopped.
+After every update it also sends its training_state back (packed, on state_queue);
+LearnerProcess.training_state() is what goes into the training snapshot.
+Like the env workers, the learner ignores SIGINT/SIGTERM and stops when the actor
+closes it, or on its own once the actor process is gone.
+"""
+import io
+import os
+import time
+import queue
+import atexit
+import signal
+import torch as T
+import torch.multiprocessing as mp
+
+from Doom_Agent import Agent
+
+def pack_state(state):
+    """training_state as bytes; goes through a queue by value, unlike shared tensors."""
+    buffer = io.BytesIO()
+    T.save(state, buffer)
+    return buffer.getvalue()
+
+def unpack_state(data):
+    return T.load(io.BytesIO(data), map_location='cpu')
+
+def learner_worker(params, num_actions, home_dir, rollout_queue, shared_state,
+                   lock, version, policy_lag, initial_state, state_queue):
+    """Learner process body; owns its own Agent and optimizers, seeded from initial_state."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN) #the actor closes us; see the module docstring.
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    os.chdir(home_dir)
+    agent = Agent(params, num_actions)
+    agent.load_training_state(unpack_state(initial_state))
+    actor = mp.parent_process()
+
+    while True:
+        try:
+            rollout = rollout_queue.get(timeout=1)
+        except queue.Empty:
+            if actor.is_alive():
+                continue
+            break #the actor died without closing us.
+        if rollout is None: #shutdown signal
+            break
+        policy_lag.value = version.value - rollout.pop('version')
+        reward = rollout.pop('reward')
+        agent.memory.import_rollout({key: val.numpy() for key, val in rollout.items()})
+
+        print(f"Learning(lag {policy_lag.value})...", end="")
+        agent.learn()
+        agent.save_models(reward)
+        state = pack_state(agent.training_state())
+
+        ## Broadcast the new weights.
+        with lock:
+            for key, tensor in agent.policy_state().items():
+                shared_state[key].copy_(tensor)
+            version.value += 1
+            state_queue.put((version.value, state)) #weights + Adam states of this version.
+
+class LearnerProcess():
+    """Actor-side handle on the learner process."""
+    def __init__(self, params, num_actions, agent, queue_size=2):
+        ctx = mp.get_context('spawn')
+        self.rollout_queue = ctx.Queue(maxsize=queue_size)
+        self.lock = ctx.Lock()
+        self.version = ctx.Value('i', 0)
+        self.policy_lag = ctx.Value('i', 0)
+        self.local_version = 0 #version the acting agent currently holds.
+        self.state_queue = ctx.Queue()
+        self.state, self.state_version = None, 0 #newest packed training_state from the learner.
+        self.closed = False
+
+        #shared copy of the weights, seeded from the acting agent.
+        self.shared_state = {key: tensor.detach().cpu().clone().share_memory_()
+                             for key, tensor in agent.policy_state().items()}
+
+        self.process = ctx.Process(target=learner_worker,
+                                   args=(params, num_actions, os.getcwd(),
+                                         self.rollout_queue, self.shared_state,
+                                         self.lock, self.version, self.policy_lag,
+                                         pack_state(agent.training_state()), self.state_queue),
+                                   daemon=True)
+        self.process.start()
+        atexit.register(self.close) #before multiprocessing's own exit handler, which would wait on it.
+
+    def submit(self, agent, reward=None):
+        """
+        Hands the agent's rollout to the learner and clears it. Never blocks the game:
+        if the learner is still busy with earlier rollouts this one is dropped.
+        reward goes along for the learner's checkpoint (see Agent.save_models).
+        """
+        rollout = {key: T.from_numpy(val) for key, val in agent.memory.export_rollout().items()}
+        rollout['version'] = self.local_version
+        rollout['reward'] = reward
+        agent.memory.clear_memory()
+        try:
+            self.rollout_queue.put_nowait(rollout)
+            return True
+        except queue.Full:
+            print("Learner busy; rollout dropped.")
+            return False
+
+    def sync(self, agent):
+        """Pulls the latest published weights into the acting agent, if there are new ones."""
+        if self.version.value == self.local_version:
+            return False
+        with self.lock:
+            agent.load_policy_state(self.shared_state)
+            self.local_version = self.version.value
+        self.poll_states(self.local_version)
+        return True
+
+    def poll_states(self, version=0, timeout=10):
+        """Keeps the newest training_state the learner sent; waits up to timeout for `version`'s."""
+        try:
+            while True:
+                if self.state_version >= version:
+                    self.state_version, self.state = self.state_queue.get_nowait()
+                else:
+                    self.state_version, self.state = self.state_queue.get(timeout=timeout)
+        except queue.Empty:
+            pass
+
+    def training_state(self):
+        """The learner's weights and Adam states as of its last update; None before the first."""
+        self.poll_states()
+        return None if self.state is None else unpack_state(self.state)
+
+    def staleness(self):
+        """Learner updates the acting policy is currently behind."""
+        return self.version.value - self.local_version
+
+    def close(self, timeout=600):
+        """Lets the learner finish the rollout in hand, keeps its last state, and stops it."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            while True: #rollouts still queued are dropped, like a busy learner drops them.
+                self.rollout_queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.rollout_queue.put(None, timeout=timeout)
+        except queue.Full: #learner dead or stuck; it is killed below.
+            pass
+        deadline = time.time() + timeout
+        while self.process.is_alive() and time.time() < deadline: #it cannot exit while its states sit in the pipe.
+            self.poll_states()
+            self.process.join(0.1)
+        self.poll_states()
+        if self.process.is_alive():
+            self.process.kill() #it ignores SIGTERM.
+            self.process.join()
@@ -0,0 +1,54 @@
+"""
+Fused frame preprocessing.
+
+DoomGame.resize does resize -> BGR2GRAY -> equalizeHist -> float64 std*img+mean ->
+clip -> reshape, allocating a new array at every stage, and the agent then
+quantizes the result back to uint8 for its FrameStore. After equalizeHist every
+remaining step only depends on the pixel value, so they collapse into one 256
+entry lookup table. FramePreprocessor runs
+    resize -> (gray) -> equalizeHist -> LUT
+into buffers allocated once, and the LUT lands the frame directly in the dtype
+the consumer wants:
+    'uint8':   the FrameStore encoding, rint(clip(std*p + mean, 0, 1)*255)
+    'float32': model input, the same values decoded (/255), as FrameStore.stack gives them
+Both are bit identical to taking the old path through the FrameStore.
+GRAY8 screens (see Doom_Wrapper.RENDER_PROFILES) skip the color conversion.
+"""
+import cv2
+import numpy as np
+
+#the single-channel version of the ImageNet normalization DoomGame.resize applies.
+GRAY_MEAN = np.mean([0.485, 0.456, 0.406])
+GRAY_STD = np.mean([0.229, 0.224, 0.225])
+
+def frame_lut(output='uint8'):
+    """Equalized pixel value -> preprocessed value, same float64 arithmetic as DoomGame.resize."""
+    values = np.clip(np.array([GRAY_STD]) * np.arange(256) + np.array([GRAY_MEAN]), 0, 1)
+    encoded = np.rint(values*255).astype(np.uint8)
+    if output == 'uint8':
+        return encoded
+    return encoded.astype(np.float32)/255
+
+class FramePreprocessor():
+    """
+    Screen buffer -> (xy, xy) frame, with no per-frame allocations.
+    The returned array is reused by the next call; copy it if it has to outlive that.
+    """
+    def __init__(self, xy=126, output='uint8'):
+        self.xy = xy
+        self.output = output
+        self.lut = frame_lut(output)
+        self.small_color = np.empty((xy, xy, 3), dtype=np.uint8)
+        self.small = np.empty((xy, xy), dtype=np.uint8)
+        self.equalized = np.empty((xy, xy), dtype=np.uint8)
+        self.out = np.empty((xy, xy), dtype=self.lut.dtype)
+
+    def __call__(self, screen):
+        if screen.ndim == 3: #BGR24; resized before the conversion, like DoomGame.resize.
+            cv2.resize(screen, (self.xy, self.xy), dst=self.small_color)
+            cv2.cvtColor(self.small_color, cv2.COLOR_BGR2GRAY, dst=self.small)
+        else: #GRAY8
+            cv2.resize(screen, (self.xy, self.xy), dst=self.small)
+        cv2.equalizeHist(self.small, dst=self.equalized)
+        cv2.LUT(self.equalized, self.lut, dst=self.out)
+        return self.out
@@ -0,0 +1,102 @@
+"""
+Per-phase latency of the training step.
+
+The loop marks the end of each phase with lap(); the time since the previous mark
+goes to that phase, and end_step() books the whole step:
+    profiler.start()
+    ...choose_action...   profiler.lap('choose_action')
+    ...make_action...     profiler.lap('make_action')
+    profiler.end_step()
+Each phase keeps a ring of its last `window` samples, so a lap is a perf_counter
+call and a list store (well under a microsecond; a step is milliseconds, see
+Doom_Benchmark 'profiler'). Percentiles are only computed when summary() is asked
+for, which is once per dump. ModelTrain params:
+    'profile_bool'      False leaves NULL_PROFILER in place; its methods do nothing.
+    'profile_interval'  seconds between dumps to profile_path and the GUI.
+"""
+import os
+import json
+import time
+from time import perf_counter
+import numpy as np
+
+class StepProfiler():
+    """Rolling per-phase timings with p50/p95/p99 summaries."""
+    def __init__(self, path=os.path.join('pretrained_model', 'profile.json'), interval=60, window=2048):
+        self.path = path
+        self.interval = interval #seconds between dumps
+        self.window = window #samples kept per phase
+        self.samples = {} #phase -> ring of seconds
+        self.counts = {} #phase -> samples recorded in total
+        self.step_start = self.mark = perf_counter()
+        self.last_dump = time.time()
+        self.last_summary = None
+
+    def start(self):
+        self.step_start = self.mark = perf_counter()
+
+    def record(self, phase, seconds):
+        if phase not in self.samples:
+            self.samples[phase] = [0.0]*self.window
+            self.counts[phase] = 0
+        count = self.counts[phase]
+        self.samples[phase][count % self.window] = seconds
+        self.counts[phase] = count + 1
+
+    def lap(self, phase):
+        """Books the time since the last mark to phase."""
+        now = perf_counter()
+        self.record(phase, now - self.mark)
+        self.mark = now
+
+    def end_step(self):
+        """Books the whole step (since start) and starts the next one."""
+        now = perf_counter()
+        self.record('step', now - self.step_start)
+        self.step_start = self.mark = now
+
+    def summary(self):
+        """
+        {phase: {count, mean, p50, p95, p99, max (ms), share}}; share estimates the
+        phase's part of all step time so far (mean*count over the same for 'step').
+        """
+        summary = {}
+        step_total = None
+        for phase, ring in self.samples.items():
+            samples = np.array(ring[:min(self.counts[phase], self.window)])*1000
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            summary[phase] = {'count': self.counts[phase], 'mean': round(float(samples.mean()), 4),
+                              'p50': round(p50, 4), 'p95': round(p95, 4), 'p99': round(p99, 4),
+                              'max': round(float(samples.max()), 4)}
+            if phase == 'step':
+                step_total = samples.mean()*self.counts[phase]
+        if step_total:
+            for phase, stats in summary.items():
+                stats['share'] = round(stats['mean']*stats['count']/step_total, 4)
+        return summary
+
+    def due(self):
+        return time.time() - self.last_dump >= self.interval
+
+    def dump(self):
+        """Writes the summary to path (replaced atomically) and keeps it for the GUI."""
+        self.last_dump = time.time()
+        self.last_summary = self.summary()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'phases': self.last_summary}, f, indent=1)
+        os.replace(temp_path, self.path)
+        return self.last_summary
+
+class NullProfiler():
+    """Stand-in when profiling is off; same methods, no work."""
+    last_summary = None
+    def start(self): pass
+    def record(self, phase, seconds): pass
+    def lap(self, phase): pass
+    def end_step(self): pass
+    def due(self): return False
+    def dump(self): return None
+
+NULL_PROFILER = NullProfiler()
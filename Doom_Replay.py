@@ -0,0 +1,113 @@
+"""
+Offline replay of recorded episodes.
+
+With DoomGame(record_dir=...) (ModelTrain param 'record_dir') every episode leaves two files:
+    <name>.lmp  the vizdoom demo; the engine's own compact input recording
+    <name>.npz  our sidecar; action index and reward per decision, seed, map, frame_skip,
+                render_profile
+Replaying a demo re-runs the engine on the recorded inputs, so labels and game variables
+come back exactly as they were played, without the policy and as fast as the engine goes.
+Rendering does not change the game, but it does change the frames (HUD, weapon sprite,
+resolution), so replays use the sidecar's render_profile unless told otherwise; sidecars
+from before it was recorded are taken to be 'watch', the training default.
+
+    for step in replay_episode('recordings/xxx.lmp'):
+        step['frame'], step['labels'], step['game_vars'], step['action'], step['reward']
+
+main(demo_dir) turns a folder of demos into <name>_replay.npz arrays.
+"""
+import os
+import time
+import numpy as np
+
+import Doom_Wrapper
+from Doom_Labels import NUM_LABEL_FEATURES
+
+def load_sidecar(demo_path):
+    with np.load(demo_path[:-len('.lmp')] + '.npz') as sidecar:
+        return {key: sidecar[key] for key in sidecar.files}
+
+def game_config(sidecar, render_profile=None):
+    """(total_frame_limit, render_profile, frame_skip, map) of the DoomGame that recorded the sidecar."""
+    if render_profile is None:
+        render_profile = str(sidecar.get('render_profile', 'watch'))
+    return (int(sidecar['total_frame_limit']), render_profile,
+            int(sidecar['frame_skip']), str(sidecar['map']))
+
+def replay_game(sidecar, render_profile=None):
+    """A DoomGame set up like the one that recorded the sidecar's episode."""
+    total_frame_limit, render_profile, frame_skip, doom_map = game_config(sidecar, render_profile)
+    return Doom_Wrapper.DoomGame(total_frame_limit, render_profile, frame_skip, doom_map=doom_map)
+
+def replay_episode(demo_path, render_profile=None, game_wrapper=None):
+    """
+    Yields one dict per recorded decision: the preprocessed frame the policy saw
+    (uint8, reused buffer; copy to keep), the raw state, labels, game variables,
+    and the action/reward the sidecar logged for it.
+    """
+    sidecar = load_sidecar(demo_path)
+    if game_wrapper is None:
+        game_wrapper = replay_game(sidecar, render_profile)
+    game = game_wrapper.game
+    frame_skip = int(sidecar['frame_skip'])
+
+    game.set_seed(int(sidecar['seed']))
+    game.replay_episode(demo_path)
+    if str(sidecar['map']) == "MAP07": #the door action episode_reset played.
+        game.advance_action()
+
+    for action, reward in zip(sidecar['actions'], sidecar['rewards']):
+        if game.is_episode_finished():
+            break
+        state = game.get_state()
+        yield {'frame': game_wrapper.preprocess(state.screen_buffer), 'state': state,
+               'labels': state.labels, 'game_vars': state.game_variables,
+               'action': int(action), 'reward': float(reward)}
+        game.advance_action(frame_skip)
+
+def replay_to_arrays(demo_path, render_profile=None, game_wrapper=None):
+    """
+    Whole episode as arrays: frames (T, 126, 126) uint8, game_vars, enemy_counts,
+    label_features (T, NUM_LABEL_FEATURES; Doom_Labels vector), actions, rewards.
+    """
+    if game_wrapper is None:
+        game_wrapper = replay_game(load_sidecar(demo_path), render_profile)
+    frames, game_vars, enemy_counts, label_features, actions, rewards = [], [], [], [], [], []
+    for step in replay_episode(demo_path, render_profile, game_wrapper):
+        frames.append(step['frame'].copy())
+        game_vars.append(step['game_vars'])
+        label_features.append(game_wrapper.observe(step['state']))
+        enemy_counts.append(game_wrapper.label_features.features['enemy_count'])
+        actions.append(step['action'])
+        rewards.append(step['reward'])
+    return {'frames': np.array(frames, dtype=np.uint8),
+            'game_vars': np.array(game_vars, dtype=np.float32),
+            'enemy_counts': np.array(enemy_counts, dtype=np.int16),
+            'label_features': np.array(label_features, dtype=np.float32).reshape(-1, NUM_LABEL_FEATURES),
+            'actions': np.array(actions, dtype=np.int16),
+            'rewards': np.array(rewards, dtype=np.float32)}
+
+def main(demo_dir='recordings', render_profile=None):
+    """
+    Replays every demo in demo_dir into <name>_replay.npz next to it. Demos are grouped
+    by the game they were recorded with (map, render profile, frame_skip, frame limit);
+    each group shares one engine.
+    """
+    groups = {}
+    for name in sorted(name for name in os.listdir(demo_dir) if name.endswith('.lmp')):
+        demo_path = os.path.join(demo_dir, name)
+        sidecar = load_sidecar(demo_path)
+        groups.setdefault(game_config(sidecar, render_profile), []).append((name, sidecar))
+    for config, demos in groups.items():
+        game_wrapper = replay_game(demos[0][1], render_profile)
+        for name, _ in demos:
+            demo_path = os.path.join(demo_dir, name)
+            t0 = time.time()
+            arrays = replay_to_arrays(demo_path, render_profile, game_wrapper)
+            np.savez_compressed(demo_path[:-len('.lmp')] + '_replay.npz', **arrays)
+            fps = len(arrays['frames'])/max(time.time() - t0, 1e-9)
+            print(f"{name}: {len(arrays['frames'])} steps, {round(fps)} steps/second")
+        game_wrapper.close()
+
+if __name__ == "__main__":
+    main()
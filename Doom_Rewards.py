@@ -0,0 +1,274 @@
+"""
+Batched reward engine.
+
+The r_rules table from Doom_Wrapper.DoomGame is compiled once into plain floats, and
+every step scores N environments at a time from arrays:
+    actions       (N,)   action index taken
+    game_vars     (N, 8) in VARIABLE_NAMES order (DoomGame.variables_set)
+    enemy_counts  (N,)   enemy labels on screen
+    death         (N,)   the game state ran out under us
+    frame_counts  (N,)   decisions since the episode started
+    crosshair_distance (N,) optional; nearest enemy pixel to the crosshair (Doom_Labels)
+
+The per-step semantics are the ones DoomGame.reward_rules always had: spillover,
+enemy bonus, dry fire, kills, death, damage scaled into the last 25 hits, timeout,
+stuck, and the reward averaged over the last 10 steps. Only the bookkeeping changed;
+the damage windows keep a running min/max that is only rescanned when the evicted
+hit was the extreme, and the reward window is a fixed array instead of a deque.
+Array calls only pay off for many envs; DoomGame (one game per process, training loop
+and env workers alike) uses step_one(), which is cheaper than the legacy per-step code.
+Both run the one rule set in RewardEngine.score, step() on arrays (ArrayOps) and
+step_one() on python floats (ScalarOps).
+"""
+import numpy as np
+
+VARIABLE_NAMES = ['KILLCOUNT', 'DEATHCOUNT', 'HITCOUNT',
+                  'HITS_TAKEN', 'DAMAGECOUNT', 'DAMAGE_TAKEN',
+                  'POSITION_X', 'POSITION_Y']
+KILLCOUNT, DAMAGECOUNT, DAMAGE_TAKEN, POSITION_X, POSITION_Y = 0, 4, 5, 6, 7
+
+class HitWindow():
+    """
+    Last `size` damage deltas per environment, with a running min/max.
+    Stands in for deque([1], maxlen=size): the ring starts full of the seed value,
+    which cannot change min/max while the real seed is still in the window, and the
+    first write lands after it so the seed is the first thing evicted.
+    """
+    def __init__(self, num_envs, size=25, seed=1):
+        self.ring = np.full((num_envs, size), seed, dtype=np.float64)
+        self.head = np.full(num_envs, 1 % size, dtype=np.int64) #next slot to write.
+        self.minimum = np.full(num_envs, seed, dtype=np.float64)
+        self.maximum = np.full(num_envs, seed, dtype=np.float64)
+
+    def push(self, rows, values):
+        """Appends one value for each of rows (unique env ids)."""
+        slots = self.head[rows]
+        evicted = self.ring[rows, slots]
+        self.ring[rows, slots] = values
+        self.head[rows] = (slots + 1) % self.ring.shape[1]
+
+        self.minimum[rows] = np.minimum(self.minimum[rows], values)
+        self.maximum[rows] = np.maximum(self.maximum[rows], values)
+        #only rows that evicted their min or max need a rescan.
+        stale = rows[(evicted <= self.minimum[rows]) | (evicted >= self.maximum[rows])]
+        if len(stale):
+            self.minimum[stale] = self.ring[stale].min(axis=1)
+            self.maximum[stale] = self.ring[stale].max(axis=1)
+
+    def push_one(self, row, value):
+        """push() for a single row and value."""
+        slot = self.head[row]
+        evicted = self.ring[row, slot]
+        self.ring[row, slot] = value
+        self.head[row] = (slot + 1) % self.ring.shape[1]
+        low = self.minimum[row] = min(self.minimum[row], value)
+        high = self.maximum[row] = max(self.maximum[row], value)
+        if evicted <= low or evicted >= high:
+            self.minimum[row] = self.ring[row].min()
+            self.maximum[row] = self.ring[row].max()
+
+    def interp_one(self, row, value, out_min, out_max):
+        """interp() for a single row and value."""
+        low, high = float(self.minimum[row]), float(self.maximum[row])
+        if value >= high:
+            return out_max
+        span = high - low if high > low else 1
+        return (out_max - out_min)/span*(value - low) + out_min
+
+    def interp(self, rows, values, out_min, out_max):
+        """np.interp(value, [min, max], [out_min, out_max]) per row, same arithmetic."""
+        low, high = self.minimum[rows], self.maximum[rows]
+        span = np.where(high > low, high - low, 1)
+        scaled = (out_max - out_min)/span*(values - low) + out_min
+        return np.where(values >= high, out_max, scaled)
+
+class ArrayOps():
+    """RewardEngine.score over arrays, one entry per env."""
+    minimum = staticmethod(np.minimum)
+    where = staticmethod(np.where)
+
+    def row(self, array):
+        return array
+
+    def hits(self, window, delta, out_min, out_max):
+        """Pushes the hits (delta > 0) into window; their scaled reward, 0 for the rest."""
+        bonus = np.zeros(len(delta))
+        rows = np.flatnonzero(delta > 0)
+        if len(rows):
+            window.push(rows, delta[rows])
+            bonus[rows] = window.interp(rows, delta[rows], out_min, out_max)
+        return bonus
+
+    def store(self, engine, hit_spillover, stuck_counter, kills, timed_out, stuck_out):
+        engine.hit_spillover, engine.stuck_counter = hit_spillover, stuck_counter
+        engine.kills, engine.timed_out, engine.stuck_out = kills, timed_out, stuck_out
+
+class ScalarOps():
+    """RewardEngine.score over python scalars, for env 0; no numpy calls per rule."""
+    minimum = staticmethod(min)
+
+    @staticmethod
+    def where(condition, value, other):
+        return value if condition else other
+
+    def row(self, array):
+        return array.item(0)
+
+    def hits(self, window, delta, out_min, out_max):
+        if delta > 0:
+            window.push_one(0, delta)
+            return window.interp_one(0, delta, out_min, out_max)
+        return 0
+
+    def store(self, engine, hit_spillover, stuck_counter, kills, timed_out, stuck_out):
+        engine.hit_spillover[0], engine.stuck_counter[0] = hit_spillover, stuck_counter
+        engine.kills[0], engine.timed_out[0], engine.stuck_out[0] = kills, timed_out, stuck_out
+
+ARRAY_OPS, SCALAR_OPS = ArrayOps(), ScalarOps()
+
+class RewardEngine():
+    """r_rules scoring for num_envs environments per call."""
+    def __init__(self, r_rules, num_envs=1, hit_bonus=5, total_frame_limit=3000,
+                 frame_skip=1, hit_window=25, reward_window=10):
+        self.num_envs = num_envs
+        self.hit_bonus = hit_bonus #spillover tics after landing a hit.
+        self.total_frame_limit = total_frame_limit
+        self.frame_skip = frame_skip
+        self.compile(r_rules)
+
+        self.vars_last = np.zeros((num_envs, len(VARIABLE_NAMES)))
+        self.hit_spillover = np.zeros(num_envs, dtype=np.int64)
+        self.stuck_counter = np.zeros(num_envs, dtype=np.int64) #tics with no x/y delta
+        self.dmg_out = HitWindow(num_envs, hit_window)
+        self.dmg_in = HitWindow(num_envs, hit_window)
+        #reward window, oldest first; only the last reward_count entries are live.
+        self.reward_ring = np.zeros((num_envs, reward_window))
+        self.reward_count = np.zeros(num_envs, dtype=np.int64)
+
+        #what happened to each env on the last step; for logging.
+        self.kills = np.zeros(num_envs)
+        self.timed_out = np.zeros(num_envs, dtype=bool)
+        self.stuck_out = np.zeros(num_envs, dtype=bool)
+
+    def compile(self, r_rules):
+        """Copies the rule table into attributes; call again after changing r_rules."""
+        self.rules = {key: float(value) for key, value in r_rules.items()}
+        self.rules.setdefault('enemy_centered', 0.0) #older rule tables predate it.
+
+    def reset(self, env_ids=None):
+        """Episode reset (DoomGame.wrapper_reset); damage windows and spillover carry over."""
+        env_ids = slice(None) if env_ids is None else env_ids
+        self.stuck_counter[env_ids] = 0
+        self.reward_ring[env_ids] = 0
+        self.reward_count[env_ids] = 0
+
+    def state_dict(self):
+        """The counters (damage windows, spillover, last vars...), for training snapshots."""
+        state = {key: getattr(self, key) for key in ('vars_last', 'hit_spillover', 'stuck_counter',
+                                                      'reward_ring', 'reward_count')}
+        state['dmg_out'], state['dmg_in'] = vars(self.dmg_out), vars(self.dmg_in)
+        return state
+
+    def load_state_dict(self, state):
+        for key, value in state.items():
+            if key in ('dmg_out', 'dmg_in'):
+                vars(getattr(self, key)).update(value)
+            else:
+                setattr(self, key, value)
+
+    def step(self, actions, game_vars, enemy_counts, death, frame_counts, crosshair_distance=None):
+        """Returns (averaged reward, terminal) arrays of shape (N,)."""
+        game_vars = np.array(game_vars, dtype=np.float64)
+        game_vars[:, POSITION_X:POSITION_Y+1] = np.round(game_vars[:, POSITION_X:POSITION_Y+1])
+        if crosshair_distance is not None:
+            crosshair_distance = np.asarray(crosshair_distance)
+        #transposed, so game_vars[KILLCOUNT] is every env's kill count, as in the scalar path.
+        reward, terminal = self.score(ARRAY_OPS, np.asarray(actions), game_vars.T, self.vars_last.T,
+                                      np.asarray(enemy_counts), np.asarray(death, dtype=bool),
+                                      np.asarray(frame_counts), crosshair_distance)
+        self.vars_last = game_vars
+        return np.round(self.push_reward(reward), 2), terminal
+
+    def step_one(self, action, game_vars, enemy_count, death, frame_count, crosshair_distance=None):
+        """step() for a one env engine, on python scalars; returns (averaged reward, terminal)."""
+        game_vars = [float(value) for value in game_vars]
+        game_vars[POSITION_X] = float(round(game_vars[POSITION_X]))
+        game_vars[POSITION_Y] = float(round(game_vars[POSITION_Y]))
+        if crosshair_distance is not None:
+            crosshair_distance = float(crosshair_distance)
+        #python types throughout; numpy scalars would make every rule below several times slower.
+        reward, terminal = self.score(SCALAR_OPS, int(action), game_vars, self.vars_last[0].tolist(),
+                                      int(enemy_count), bool(death), int(frame_count), crosshair_distance)
+        self.vars_last[0] = game_vars
+
+        ## Reward window
+        ring = self.reward_ring[0]
+        ring[:-1] = ring[1:]
+        ring[-1] = reward
+        count = min(int(self.reward_count[0]) + 1, len(ring))
+        self.reward_count[0] = count
+        return round(ring[len(ring)-count:].sum()/count, 2), bool(terminal) #np.float64: rounds like np.round.
+
+    def score(self, x, actions, game_vars, last, enemy_counts, death, frame_counts, crosshair_distance):
+        """
+        The rule set, for both step() (x = ARRAY_OPS, arrays over the envs) and step_one()
+        (x = SCALAR_OPS, python scalars for env 0). game_vars[i]/last[i] are variable i.
+        Masks multiply instead of indexing, so a term adds 0 where it does not apply.
+        Returns the step's reward before averaging, and terminal.
+        """
+        rules, tics = self.rules, self.frame_skip
+
+        ## Passive cost, overwritten by spillover for the tics it still covers.
+        spill = x.row(self.hit_spillover)
+        spill_tics = x.minimum(spill, tics)
+        reward = rules['spillover']*spill_tics + rules['passive']*(tics - spill_tics)
+        spill = spill - spill_tics
+
+        ## Enemies on screen; no attacking without them.
+        reward += rules['enemy_screen']*enemy_counts*tics
+        reward += rules['dry_fire']*tics*((actions == 5) & (enemy_counts == 0))
+        if rules['enemy_centered'] and crosshair_distance is not None:
+            reward += rules['enemy_centered']*((1 - crosshair_distance)*(enemy_counts > 0))*tics
+
+        ## Kills
+        kills = game_vars[KILLCOUNT] - last[KILLCOUNT]
+        reward += rules['scored_kill']*kills*(kills > 0)
+
+        ## Death overwrites everything before it.
+        reward = x.where(death, rules['died'], reward)
+
+        ## Delt a hit(Magnitude), scaled into the recent hits.
+        delta = game_vars[DAMAGECOUNT] - last[DAMAGECOUNT]
+        reward += x.hits(self.dmg_out, delta, rules['dmg_out_min'], rules['dmg_out_max'])
+        spill = x.where(delta > 0, self.hit_bonus, spill)
+
+        ## Felt a hit(Magnitude)
+        delta = game_vars[DAMAGE_TAKEN] - last[DAMAGE_TAKEN]
+        reward -= x.hits(self.dmg_in, delta, rules['dmg_in_min'], rules['dmg_in_max'])
+
+        timed_out = frame_counts*tics >= self.total_frame_limit-1
+
+        ## Stuck; no x/y delta.
+        stuck = (game_vars[POSITION_X] == last[POSITION_X]) & (game_vars[POSITION_Y] == last[POSITION_Y])
+        stuck_counter = x.row(self.stuck_counter) + stuck*tics
+        reward += rules['stuck']*tics*(stuck & (stuck_counter >= 40))
+        stuck_out = stuck & (stuck_counter >= 300)
+        reward = x.where(stuck_out, rules['stuck_timeout'], reward)
+
+        x.store(self, spill, stuck_counter, kills, timed_out, stuck_out)
+        return reward, death | timed_out | stuck_out
+
+    def push_reward(self, reward):
+        """Appends to the reward window and returns each env's window mean."""
+        ring = self.reward_ring
+        ring[:, :-1] = ring[:, 1:]
+        ring[:, -1] = reward
+        self.reward_count = np.minimum(self.reward_count + 1, ring.shape[1])
+        if (self.reward_count == ring.shape[1]).all(): #steady state; every window is full.
+            return ring.sum(axis=1)/ring.shape[1]
+        #rows are grouped by fill level so each mean sums exactly what np.mean(deque) summed.
+        mean = np.empty(len(reward))
+        for count in np.unique(self.reward_count):
+            rows = np.flatnonzero(self.reward_count == count)
+            mean[rows] = ring[rows, ring.shape[1]-count:].sum(axis=1)/count
+        return mean
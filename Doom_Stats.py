@@ -0,0 +1,107 @@
+"""
+Streaming statistics for the training counters.
+
+varz used to keep plain lists and deques and re-run np.mean/np.std over them on every
+update: the per-game qmax lists grew by one each step and were averaged each step
+(quadratic over a game), and the 25-game deques were re-averaged every step for the GUI.
+    RunningStats    unbounded stream: count, mean, var/std (Welford), min, max; O(1)
+                    push and read.
+    WindowStats     the last `size` values in a ring array; stands in for
+                    deque(maxlen=size). push is a slot write; mean/std are worked out
+                    from the window (in arrival order, as np.mean(deque) saw it) on the
+                    first read after a push and cached, so the per-step reads are free
+                    and the values are exactly the old ones.
+RunningStats' mean is a running sum, which only differs from np.mean's pairwise sum in
+the last bits (not at all for integer streams like qmax). Both return np.float64 like
+np.mean did: varz rounds them with round(), and np.float64 rounds half-way cases
+differently from float. An empty stream reports nan like np.mean([]), without the
+RuntimeWarning.
+"""
+import math
+import numpy as np
+
+class RunningStats():
+    """Summary of everything pushed since the last reset()."""
+    def __init__(self, values=()):
+        self.reset()
+        for value in values:
+            self.push(value)
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.m2 = 0.0 #sum of squared deviations from the mean (Welford).
+        self.minimum = math.nan
+        self.maximum = math.nan
+
+    def push(self, value):
+        value = float(value)
+        old_mean = self.total/self.count if self.count else 0.0
+        self.count += 1
+        self.total += value
+        self.m2 += (value - old_mean)*(value - self.total/self.count)
+        if self.count == 1:
+            self.minimum = self.maximum = value
+        elif value < self.minimum:
+            self.minimum = value
+        elif value > self.maximum:
+            self.maximum = value
+
+    def mean(self):
+        return np.float64(self.total/self.count if self.count else math.nan)
+
+    def var(self):
+        return np.float64(self.m2/self.count if self.count else math.nan)
+
+    def std(self):
+        return np.sqrt(self.var())
+
+    def __len__(self):
+        return self.count
+
+class WindowStats():
+    """Last `size` values; values seeds the window like deque(values, maxlen=size)."""
+    def __init__(self, size=25, values=()):
+        self.size = size
+        self.ring = np.zeros(size, dtype=np.float64)
+        self.reset()
+        for value in values:
+            self.push(value)
+
+    def reset(self):
+        self.count = 0 #live values, up to size.
+        self.head = 0 #next slot to write; the oldest value once the window is full.
+        self.summary = None #(mean, std) of the current window, once read.
+
+    def push(self, value):
+        self.ring[self.head] = value
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        self.summary = None
+
+    def values(self):
+        """The window oldest first, as a new array."""
+        if self.count < self.size:
+            return self.ring[:self.count].copy()
+        return np.concatenate((self.ring[self.head:], self.ring[:self.head]))
+
+    def last(self):
+        return self.ring[self.head - 1] if self.count else np.float64(math.nan)
+
+    def summarize(self):
+        if self.summary is None:
+            if self.count:
+                window = self.values()
+                self.summary = (np.mean(window), np.std(window))
+            else:
+                self.summary = (np.float64(math.nan), np.float64(math.nan))
+        return self.summary
+
+    def mean(self):
+        return self.summarize()[0]
+
+    def std(self):
+        return self.summarize()[1]
+
+    def __len__(self):
+        return self.count
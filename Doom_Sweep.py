@@ -0,0 +1,300 @@
+"""
+Hyperparameter sweeps.
+
+Tuning used to mean editing ModelTrain's params dict and watching one run. This expands
+a grid or a random search over ModelTrain params and DoomGame.r_rules into trials and
+runs each as a Doom_Headless run in its own process:
+    python Doom_Sweep.py sweep.json [--workers N]
+sweep.json:
+    {
+     "out_dir": "sweeps/lr_beta",   #trial_NNNN run folders and sweep.db go here.
+     "search": "grid",              #"grid": every combination of the lists in space.
+                                    #"random": "trials" draws from space (lists are choices).
+     "trials": 20, "seed": 0,       #random search only.
+     "space": {
+        "actor_learning_rate": {"log_uniform": [1e-6, 1e-4]},
+        "beta": [0.01, 0.1, 0.2],
+        "epochs": {"int": [2, 5]},
+        "r_rules.scored_kill": {"uniform": [10, 40]}  #r_rules.<rule> sets a reward rule.
+     },
+     "base": {"frame_budget": 500000, "num_envs": 2, "params": {...}},  #Doom_Headless config for every trial.
+     "workers": 4,                  #trials running at once.
+     "cpus_per_worker": 2,          #CPUs each trial (and its env/learner processes) is pinned to; 0 = share all.
+     "torch_threads": 2,            #T.set_num_threads per trial.
+     "early_stop": {"check_frames": 100000, "min_trials": 3, "percentile": 50}
+    }
+Early stopping is the median stopping rule: at the first game end after every check_frames
+frames a trial records its reward_avg_performance for that stage and stops if it is below
+the given percentile of what at least min_trials other trials had at the same stage.
+Results go to out_dir/sweep.db (sqlite), table trials: one row per trial with status
+(queued, running, finished, stopped, interrupted, failed), the summary counters and a
+column per swept key, e.g.
+    SELECT * FROM trials ORDER BY reward_avg_performance DESC
+Rerunning a sweep keeps the finished and stopped trials and resumes the rest from their
+snapshots; frame budgets and stages count the frames played before the resume. Start a
+changed sweep in a new out_dir.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import signal
+import sqlite3
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+
+import Doom_Headless
+
+DB_FILE = 'sweep.db'
+RESULT_COLUMNS = ('frames', 'seconds', 'game_count', 'reward_avg_performance',
+                  'reward_standard_deviation', 'time_avg_performance')
+DONE_STATUSES = ('finished', 'stopped')
+
+def expand_grid(space):
+    """Every combination of the value lists in space, as [{key: value}]."""
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[key] for key in keys))]
+
+def draw(spec, rng):
+    """One value for a random search entry: a list (choice) or {uniform|log_uniform|int: [low, high]}."""
+    if isinstance(spec, list):
+        return spec[rng.randrange(len(spec))]
+    kind, (low, high) = next(iter(spec.items()))
+    if kind == 'uniform':
+        return rng.uniform(low, high)
+    if kind == 'log_uniform':
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+    if kind == 'int':
+        return rng.randint(low, high) #both ends included.
+    raise ValueError(f"Unknown distribution: {kind}")
+
+def expand_random(space, trials, seed=0):
+    rng = random.Random(seed) #same seed, same trials; reruns line up with sweep.db.
+    return [{key: draw(spec, rng) for key, spec in space.items()} for _ in range(trials)]
+
+def trial_config(base, assignment, out_dir, torch_threads):
+    """The Doom_Headless config of one trial: base with the assignment's params and r_rules set."""
+    config = json.loads(json.dumps(base)) #deep copy.
+    params = config.setdefault('params', {})
+    for key, value in assignment.items():
+        if key.startswith('r_rules.'):
+            params['r_rules'] = dict(params.get('r_rules') or {}, **{key[len('r_rules.'):]: value})
+        elif key in Doom_Headless.PARAM_KEYS:
+            config[key] = value
+        else:
+            params[key] = value
+    config['out_dir'] = out_dir
+    config['torch_threads'] = torch_threads
+    return config
+
+def affinity_process():
+    """psutil's handle on this process where os has no sched_setaffinity (Windows); None if neither works."""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    process = psutil.Process()
+    return process if hasattr(process, 'cpu_affinity') else None #macOS has no CPU affinity.
+
+def get_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    process = affinity_process()
+    return None if process is None else sorted(process.cpu_affinity())
+
+def set_cpus(cpus):
+    """Pins this process (and the processes it starts afterwards) to cpus."""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    else:
+        affinity_process().cpu_affinity(sorted(cpus))
+
+def worker_cpus(workers, cpus_per_worker):
+    """CPU set per worker slot; None entries leave affinity alone."""
+    if not cpus_per_worker:
+        return [None]*workers
+    cpus = get_cpus()
+    if cpus is None:
+        print("cpus_per_worker ignored: CPU affinity needs os.sched_setaffinity or psutil here.")
+        return [None]*workers
+    if workers*cpus_per_worker > len(cpus):
+        print(f"Only {len(cpus)} CPUs for {workers} workers x {cpus_per_worker}; slots will overlap.")
+    return [{cpus[(slot*cpus_per_worker + n) % len(cpus)] for n in range(cpus_per_worker)}
+            for slot in range(workers)]
+
+class SweepDB():
+    """
+    sweep.db: trials (one row per trial, the results table) and stages (reward per trial
+    per early-stop check). Every process opens its own connection; sqlite serializes the
+    writes.
+    """
+    def __init__(self, path, keys=()):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.cur = self.conn.cursor()
+        key_columns = ''.join(f', {quote(key)}' for key in keys)
+        result_columns = ''.join(f', {column} REAL' for column in RESULT_COLUMNS)
+        self.cur.execute(f"CREATE TABLE IF NOT EXISTS trials(trial INTEGER PRIMARY KEY, status TEXT, "
+                         f"exit_reason TEXT, started TEXT, finished TEXT, out_dir TEXT{key_columns}{result_columns})")
+        self.cur.execute("CREATE TABLE IF NOT EXISTS stages(trial INTEGER, stage INTEGER, frames INTEGER, "
+                         "reward REAL, PRIMARY KEY (trial, stage))")
+        self.conn.commit()
+
+    def add_trial(self, trial, assignment, out_dir):
+        """Queues the trial unless sweep.db already has it."""
+        columns = ['trial', 'status', 'out_dir'] + [quote(key) for key in assignment]
+        values = [trial, 'queued', out_dir] + list(assignment.values())
+        self.cur.execute(f"INSERT OR IGNORE INTO trials({', '.join(columns)}) "
+                         f"VALUES({', '.join('?'*len(values))})", values)
+        self.conn.commit()
+
+    def status(self, trial):
+        return self.cur.execute("SELECT status FROM trials WHERE trial = ?", (trial,)).fetchone()[0]
+
+    def update(self, trial, **values):
+        assignments = ', '.join(f'{quote(key)} = ?' for key in values)
+        self.cur.execute(f"UPDATE trials SET {assignments} WHERE trial = ?", list(values.values()) + [trial])
+        self.conn.commit()
+
+    def add_stage(self, trial, stage, frames, reward):
+        self.cur.execute("INSERT OR REPLACE INTO stages VALUES(?, ?, ?, ?)", (trial, stage, frames, reward))
+        self.conn.commit()
+
+    def last_stage(self, trial):
+        """Newest stage the trial has recorded; 0 if none."""
+        row = self.cur.execute("SELECT MAX(stage) FROM stages WHERE trial = ?", (trial,)).fetchone()
+        return row[0] or 0
+
+    def stage_rewards(self, stage, exclude_trial):
+        rows = self.cur.execute("SELECT reward FROM stages WHERE stage = ? AND trial != ? AND reward IS NOT NULL",
+                                (stage, exclude_trial))
+        return [row[0] for row in rows]
+
+    def best(self, limit=5):
+        self.cur.execute("SELECT * FROM trials WHERE reward_avg_performance IS NOT NULL "
+                         "ORDER BY reward_avg_performance DESC LIMIT ?", (limit,))
+        columns = [column[0] for column in self.cur.description]
+        return [dict(zip(columns, row)) for row in self.cur.fetchall()]
+
+    def close(self):
+        self.conn.close()
+
+def quote(name):
+    """Column name as an sqlite identifier (swept keys can hold dots)."""
+    return '"' + name.replace('"', '""') + '"'
+
+class MedianStop():
+    """Doom_Headless check: records each stage's reward and says whether the trial is losing."""
+    def __init__(self, db, trial, min_trials=3, percentile=50):
+        self.db = db
+        self.trial = trial
+        self.min_trials = min_trials
+        self.percentile = percentile
+        self.stage = db.last_stage(trial) #a resumed trial goes on from its stored stages.
+
+    def __call__(self, trainer):
+        self.stage += 1
+        reward = None #reward_avg_performance means nothing before the first game (it starts at 1).
+        if trainer.varz['game_count'] > 1: #so does game_count.
+            reward = float(trainer.varz['reward_avg_performance'])
+        self.db.add_stage(self.trial, self.stage, trainer.run_frames(), reward)
+        others = self.db.stage_rewards(self.stage, self.trial)
+        if reward is None or len(others) < self.min_trials:
+            return False
+        cutoff = np.percentile(others, self.percentile)
+        if reward < cutoff:
+            print(f"Trial {self.trial} stopped at stage {self.stage}: {reward} < {round(cutoff, 2)}")
+            return True
+        return False
+
+def run_trial(db_path, trial, config, cpus, early_stop):
+    """Trial process body: pins itself to cpus, runs the headless config, writes its row."""
+    if cpus:
+        set_cpus(cpus) #env and learner processes inherit it.
+    db = SweepDB(db_path)
+    db.update(trial, status='running', started=time.strftime('%Y-%m-%d %H:%M:%S'))
+    check = None
+    if early_stop:
+        config['check_frames'] = early_stop['check_frames']
+        check = MedianStop(db, trial, early_stop.get('min_trials', 3), early_stop.get('percentile', 50))
+    summary = Doom_Headless.run(config, check)
+    status = {'budget': 'finished', 'stopped': 'stopped'}.get(summary['exit_reason'], 'interrupted')
+    results = {key: summary[key] for key in RESULT_COLUMNS if key in summary}
+    db.update(trial, status=status, exit_reason=summary['exit_reason'],
+              finished=time.strftime('%Y-%m-%d %H:%M:%S'), **results)
+    db.close()
+
+def run(sweep):
+    """Runs every trial of the sweep not yet done, `workers` at a time; returns the best rows."""
+    out_dir = os.path.abspath(sweep.get('out_dir', 'sweep'))
+    os.makedirs(out_dir, exist_ok=True)
+    space = sweep['space']
+    if sweep.get('search', 'grid') == 'grid':
+        assignments = expand_grid(space)
+    else:
+        assignments = expand_random(space, sweep['trials'], sweep.get('seed', 0))
+    workers = sweep.get('workers', 1)
+    torch_threads = sweep.get('torch_threads', 1)
+    slots = worker_cpus(workers, sweep.get('cpus_per_worker', 0))
+
+    db_path = os.path.join(out_dir, DB_FILE)
+    db = SweepDB(db_path, list(space))
+    queue = []
+    for trial, assignment in enumerate(assignments):
+        trial_dir = os.path.join(out_dir, f'trial_{trial:04d}')
+        db.add_trial(trial, assignment, trial_dir)
+        if db.status(trial) not in DONE_STATUSES:
+            queue.append((trial, trial_config(sweep.get('base', {}), assignment, trial_dir, torch_threads)))
+    print(f"Sweep: {len(assignments)} trials, {len(queue)} to run, {workers} at a time.")
+
+    running = {} #slot -> (trial, process)
+    signal.signal(signal.SIGTERM, Doom_Headless.stop_on_sigterm)
+    try:
+        while queue or running:
+            for slot in range(workers):
+                if slot not in running and queue:
+                    trial, config = queue.pop(0)
+                    process = multiprocessing.Process(target=run_trial, name=f'trial_{trial:04d}',
+                                                      args=(db_path, trial, config, slots[slot],
+                                                            sweep.get('early_stop')))
+                    process.start() #not daemonic: trials start env and learner processes of their own.
+                    running[slot] = (trial, process)
+            time.sleep(1)
+            for slot, (trial, process) in list(running.items()):
+                if not process.is_alive():
+                    process.join()
+                    if process.exitcode != 0:
+                        db.update(trial, status='failed')
+                        print(f"Trial {trial} failed (exit code {process.exitcode}).")
+                    del running[slot]
+    except KeyboardInterrupt: #stop the trials (they may have had the signal already) and wait for their rows.
+        for trial, process in running.values():
+            process.terminate()
+        for trial, process in running.values():
+            process.join()
+            if process.exitcode != 0: #killed before it could write its own row.
+                db.update(trial, status='interrupted')
+    best = db.best()
+    db.close()
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Grid or random search over ModelTrain params and r_rules.')
+    parser.add_argument('sweep', help='JSON sweep file (see Doom_Sweep docstring)')
+    parser.add_argument('--workers', type=int, help='trials at once; overrides the sweep file')
+    args = parser.parse_args(argv)
+
+    with open(args.sweep) as f:
+        sweep = json.load(f)
+    if args.workers:
+        sweep['workers'] = args.workers
+    for row in run(sweep):
+        print(row)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Trainer -> GUI telemetry.
+
+The trainer used to send every metric as its own conn.send (one pickle and one pipe
+write each, ~24 per step) followed by a -9999 end marker, and the GUI reassembled the
+list by index. A step is now one Telemetry record and one send:
+    trainer:    conn.send(Telemetry(action=..., reward=..., ...))
+    GUI timer:  telemetry = latest(conn)
+Telemetry is a NamedTuple, so the schema is fixed, both sides use the field names,
+and it pickles as a single tuple. latest() drains the pipe and returns only the
+newest record; anything older is stale by the time the GUI repaints. A profile
+summary (sent once per Doom_Profiler dump) riding on a dropped record is carried
+over to the one returned, and so are the GameSummary records of games that ended
+on dropped steps, so the per-game graphs still get every game.
+Without a GUI (Doom_Headless) the trainer sends to a TelemetryLog instead, which
+appends rows to a JSON-lines file.
+"""
+import json
+import time
+from typing import NamedTuple, Optional
+
+class GameSummary(NamedTuple):
+    """One finished game: its closing values, and the counts and averages that include it."""
+    game_count: int = 0 #this game's number.
+    total_reward: float = 0.0 #final reward.
+    subcycle: int = 0 #steps played.
+    race_time: float = 0.0 #seconds
+    qmax: float = 0.0 #closing actor qmax.
+    crit_val: int = 0 #closing critic value.
+    agent_qmax_avg: float = 0.0
+    critic_qmax_avg: float = 0.0
+    dmg_in: float = 0.0
+    dmg_out: float = 0.0
+    dps_in: float = 0.0
+    dps_out: float = 0.0
+    reward_avg: float = 0.0
+    dps_in_avg: float = 0.0
+    dps_out_avg: float = 0.0
+
+class Telemetry(NamedTuple):
+    """One training step as the GUI sees it; Telemetry() is the empty record."""
+    action: int = 0
+    reward: float = 0.0
+    action_space: tuple = (0,)*10 #policy output *10 as ints, per action.
+    total_reward: float = 0.0 #this game so far.
+    subcycle: int = 0 #steps this game.
+    policy_lag: int = 0
+    iteration: int = 0
+    total_time: int = 0 #seconds
+    qmax: float = 0.0
+    reward_polarity: tuple = (0, 0) #[positive count, negative count]
+    crit_val: int = 0
+    cycles_per_second: float = 0.0
+    agent_qmax_avg: float = 0.0
+    actor_learning_rate: float = 0.0
+    game_time: int = 0 #seconds
+    critic_qmax_avg: float = 0.0
+    race_time: float = 0.0 #seconds this game.
+    mini_batch_size: int = 0
+    dmg_in: float = 0.0
+    dmg_out: float = 0.0
+    dps_in: float = 0.0
+    dps_out: float = 0.0
+    dps_in_avg: float = 0.0
+    dps_out_avg: float = 0.0
+    game_count: int = 0
+    reward_avg: float = 0.0
+    profile: Optional[dict] = None #Doom_Profiler summary; None except right after a dump.
+    games: tuple = () #a GameSummary per game finished since the previous record.
+
+def latest(conn, timeout=0.1):
+    """Newest record waiting on conn (None if nothing arrives within timeout)."""
+    telemetry, profile, games = None, None, ()
+    if conn.poll(timeout):
+        while True:
+            telemetry = conn.recv()
+            profile = telemetry.profile or profile
+            games += telemetry.games
+            if not conn.poll():
+                break
+    if telemetry is not None and (profile is not telemetry.profile or games != telemetry.games):
+        telemetry = telemetry._replace(profile=profile, games=games)
+    return telemetry
+
+class TelemetryLog():
+    """
+    Stands in for the GUI end of the pipe: send() takes the per-step records and
+    appends a JSON row to path for every GameSummary they carry ("kind": "game", the
+    record's fields overwritten by the game's) and every `interval` seconds
+    ("kind": "progress"). Per-step fields that only make sense live (action, reward,
+    action_space, profile) are left out.
+    """
+    skip_fields = ('action', 'reward', 'action_space', 'profile', 'games')
+
+    def __init__(self, path, interval=10):
+        self.interval = interval
+        self.file = open(path, 'a', buffering=1) #line buffered; a killed run keeps its rows.
+        self.last_write = time.time()
+
+    def row(self, telemetry, kind):
+        row = {'kind': kind, 'time': round(time.time(), 2)}
+        row.update((key, value) for key, value in telemetry._asdict().items() if key not in self.skip_fields)
+        return row
+
+    def write(self, row):
+        self.file.write(json.dumps(row, default=lambda value: value.item()) + '\n')
+        self.last_write = time.time()
+
+    def send(self, telemetry):
+        for game in telemetry.games:
+            row = self.row(telemetry, 'game')
+            row.update(game._asdict())
+            self.write(row)
+        if not telemetry.games and time.time() - self.last_write >= self.interval:
+            self.write(self.row(telemetry, 'progress'))
+
+    def close(self):
+        self.file.close()
@@ -8,8 +8,16 @@ import pickle
 
 from decorators import function_timer
 from Doom_Agent import Agent
+from Doom_Profiler import StepProfiler, NULL_PROFILER
+from Doom_Telemetry import Telemetry, GameSummary
+from Doom_Stats import RunningStats, WindowStats
+from Doom_Checkpoint import TrainingSnapshot, rng_state, load_rng_state
 
 import Doom_Wrapper
+from Doom_Vector_Env import VectorDoomGame
+from Doom_Learner import LearnerProcess
+
+SNAPSHOT_PARTS = ('policy', 'params', 'varz', 'wrapper', 'rng')
 
 '''
 Notes:
@@ -37,7 +45,8 @@ Learning Rates:
 '''
 class ModelTrain():
 
-    def __init__(self):
+    def __init__(self, overrides=None):
+        """overrides: {param: value} applied over the defaults below (e.g. from a Doom_Headless config)."""
         print('Initializing Training Model', end="")
 
         #Parameters
@@ -52,19 +61,50 @@ class ModelTrain():
             'epochs': 3, #5; how many times do you want to learn from the data
             'number_of_iterations': 20000000,
             'mini_batch_size': 200, #5; Used for dataset learning.
+            'fixed_batch_bool': False, #True: minibatches of mini_batch_size; False: rollout split num_minibatches ways.
+            'num_minibatches': 5,
             'num_local_steps': 800, #20; Used for dataset learning. total learning steps at learn time.
+            'rollout_capacity': 3000, #max transitions held between learns; oldest are overwritten.
+            'frame_capacity': 3100, #per env; uint8 frames kept for rebuilding states; raised to a learn's worth if lower (frame_ring_capacity).
+            'model_layout': 'split', #'split': CNNActor + CNNCritic; 'shared': CNNActorCritic, one trunk two heads.
+            'num_envs': 1, #>1 runs that many DoomGame worker processes through train_vector.
+            'async_envs_bool': False, #vector mode; act on whichever envs are ready instead of lockstep.
+            'shared_memory_bool': True, #vector mode; workers write results into a shared_memory slab instead of pickling.
+            'async_learner_bool': False, #learn in a separate process while the game keeps running.
+            'inference_mode': 'eager', #'eager': training models; 'compiled': frozen TorchScript trace; 'quantized': INT8 acting copy.
+            'label_inputs_bool': False, #enemy count/coverage/crosshair distance (Doom_Labels) as extra model inputs.
+            'profile_bool': False, #per-phase step timings (Doom_Profiler); off costs nothing.
+            'profile_interval': 60, #seconds between profile dumps (pretrained_model/profile.json + GUI).
+            'checkpoint_async_bool': True, #save models on a background thread, keeping recent + best versions (Doom_Checkpoint).
+            'checkpoint_keep': 3, #versions kept in pretrained_model/checkpoints, besides the best.
+            'snapshot_bool': True, #keep the full training state in pretrained_model/snapshot (Doom_Checkpoint).
+            'resume_bool': True, #with snapshot_bool, pick up from the last snapshot at startup.
 
             ## Game Parameters
             'min_reward':-0.5, 'max_reward':0.5, #what the rewards are scaled to
             'reward_target': -1000, #sets a minimum reward to save. Can be overwritten by higher avg.
             'lives_limit':5, #how many lives per session.
             'learn_cycles_goal': 3000, #how many cycles before we learn; across multiple lives
-            'total_frames_limit': 3000, #Agent will time out in n frames per game.
+            'total_frames_limit': 3000, #Agent will time out in n frames(tics) per game.
+            'frame_skip': 1, #tics each action is held for; rewards are summed over them. 1 = decide every tic.
+            'render_profile': 'watch', #Doom_Wrapper.RENDER_PROFILES; 'watch', 'train-fast' or 'train-minimal'.
+            'record_dir': None, #folder to save every episode as a demo + sidecar (see Doom_Replay); None = off.
+            'start_pool_size': 0, #resets load one of n saved post-setup snapshots instead of new_episode; 0 = off.
+            'doom_map': 'MAP07', #map of basic.wad to play; MAP07 gets its door opened at every reset.
+            'r_rules': None, #{rule: value} over the Doom_Wrapper.DoomGame.r_rules defaults; None = defaults.
+            'frame_budget': 0, #stop after this many frames (tics) in this run; 0 = no limit.
+            'time_budget': 0, #stop after this many seconds in this run; 0 = no limit.
             'lap_time_limit': 120, #90; max time per lap before we reset.
             'failure_time_limit': 10, #15; how many seconds of consecutive negative rewards before reset?
             'reward_ratio_limit': 0.75, #0.75; limit of % wrong answers.
             }
 
+        if overrides:
+            unknown = sorted(set(overrides) - set(self.params))
+            if unknown: #most likely a typo; silently training with the default would be worse.
+                raise KeyError(f"Unknown params: {unknown}")
+            self.params.update(overrides)
+
         #Counters
         self.varz = { ## Initialize counters & ques.
             'learn_cycles_checkpoint':0,# cycle count last time we learned.
@@ -74,22 +114,22 @@ class ModelTrain():
             'reward_que':deque(maxlen=10), #final reward will be a moving avg.
             'game_time':1, #tally of play time in seconds. Menu/reset does not count.
 
-            'reward_performance':deque(maxlen=25),
+            'reward_performance':WindowStats(25),
             'reward_avg_performance': 1,
             'reward_standard_deviation': 0,
             'all_lives_reward':0, #reward across learning session
-            'time_performance':deque(maxlen=25), #Both finish and non-finish races
+            'time_performance':WindowStats(25), #Both finish and non-finish races
             'time_avg_performance': 1,
-            'time_finish_performance':deque(maxlen=25), #Only counts time of races fully completed (3 laps)
+            'time_finish_performance':WindowStats(25), #Only counts time of races fully completed (3 laps)
             'time_finish_avg_performance': 0,
-            'agent_qmax_list': [],
+            'agent_qmax_stats': RunningStats(), #this game's actor qmax.
             'agent_qmax_avg':0,
-            'critic_qmax_list': [],
+            'critic_qmax_stats': RunningStats(), #this game's critic value.
             'critic_qmax_avg':0,
 
-            'dps_out_que':deque(maxlen=25),
-            'dps_in_que':deque(maxlen=25),
-            'kill_count_que':deque(maxlen=25),
+            'dps_out_que':WindowStats(25),
+            'dps_in_que':WindowStats(25),
+            'kill_count_que':WindowStats(25),
 
             'reward_polarity': [0, 0],#positive count, negative count of rewards.
             'race_over_bool': False,
@@ -97,11 +137,13 @@ class ModelTrain():
             'parent_counter':1,
             #loss is permanent like win, fail is per 'session' and is reset
             'negative_reward_count': 0,
+            'policy_lag': 0, #learner updates behind the policy that collected the last learned rollout.
+            'budget_start_iteration': None, #iteration at the run's first start; resumes keep it.
             }
         self.varz['lives_remaining'] = self.params['lives_limit']
 
         self.home_dir = os.getcwd()
-        self.varz_path = r'pretrained_model\varz.pkl'
+        self.varz_path = os.path.join('pretrained_model', 'varz.pkl') #counters-only pickle of older versions.
 
         ## Initialize the class variables:
         self.total_reward = 0
@@ -119,14 +161,68 @@ class ModelTrain():
         self.file_name = ""
         self.home_dir = os.getcwd()
 
-        print('... launching Wrapper', end="")
-        self.game_wrapper = Doom_Wrapper.DoomGame(self.params['total_frames_limit'])
-        self.game = self.game_wrapper.game
-        self.action_set_permutations = self.game_wrapper.action_set_permutations
-        num_actions = len(self.action_set_permutations)
+        if self.params['num_envs'] > 1:
+            print(f"... launching {self.params['num_envs']} Wrappers", end="")
+            self.vector_env = VectorDoomGame(self.params['num_envs'],
+                                             self.params['total_frames_limit'],
+                                             self.params['render_profile'],
+                                             self.params['frame_skip'],
+                                             self.params['record_dir'],
+                                             self.params['shared_memory_bool'],
+                                             self.params['start_pool_size'],
+                                             doom_map=self.params['doom_map'],
+                                             r_rules=self.params['r_rules'],
+                                             label_inputs=self.params['label_inputs_bool'])
+            num_actions = self.vector_env.num_actions
+            self.wrapper_states = [None]*self.params['num_envs'] #DoomGame.training_state per env, as of its last episode.
+        else:
+            print('... launching Wrapper', end="")
+            self.game_wrapper = Doom_Wrapper.DoomGame(self.params['total_frames_limit'],
+                                                      self.params['render_profile'],
+                                                      self.params['frame_skip'],
+                                                      self.params['record_dir'],
+                                                      self.params['start_pool_size'],
+                                                      self.params['doom_map'],
+                                                      self.params['r_rules'],
+                                                      self.params['label_inputs_bool'])
+            self.game = self.game_wrapper.game
+            self.action_set_permutations = self.game_wrapper.action_set_permutations
+            num_actions = len(self.action_set_permutations)
 
         print('... launching Agent', end="")
         self.agent = Agent(self.params, num_actions) #give it the whole dict.
+        footprint = round(self.agent.memory.memory_footprint()/1e6)
+        print(f'... rollout buffer {footprint}MB', end="")
+
+        self.profiler = NULL_PROFILER
+        if self.params['profile_bool']:
+            self.profiler = StepProfiler(os.path.join('pretrained_model', 'profile.json'),
+                                         self.params['profile_interval'])
+
+        self.snapshot = None
+        if self.params['snapshot_bool']:
+            self.snapshot = TrainingSnapshot()
+            if self.params['resume_bool']:
+                self.logger('load')
+            else: #old parts would otherwise sit in the new run's manifest.
+                self.snapshot.clear()
+            self.snapshot.save(self.snapshot_parts(('params',)))
+
+        #frame budgets count from the run's first start, so a resumed run finishes the same budget;
+        #time budgets count from here, after any resume.
+        if self.varz['budget_start_iteration'] is None: #new run, or a snapshot from before the entry.
+            self.varz['budget_start_iteration'] = self.varz['iteration']
+        self.run_start_time = time.time()
+        #stage_check(trainer) runs at the first game end after every check_frames frames (Doom_Headless.run);
+        #True from it stops the run there. stop_bool ends the run at the next budget check.
+        self.stage_check, self.check_frames, self.stage = None, 0, 0
+        self.stop_bool = False
+        self.games_ended = [] #GameSummary per game ended since the last gui_send.
+
+        self.learner = None
+        if self.params['async_learner_bool']:
+            print('... launching Learner', end="")
+            self.learner = LearnerProcess(self.params, num_actions, self.agent)
         print('... Initialization Complete.')
 
     #@function_timer
@@ -150,24 +246,26 @@ class ModelTrain():
         self.subtime = datetime.now()
         self.game = self.game_wrapper.game
 
-        self.game.new_episode()#start a new session
-        if self.game_wrapper.map == "MAP07": #Manual setup for mission.
-            self.game.make_action(self.action_set_permutations[8]) # open door
-        state = self.game.get_state()
+        state = self.game_wrapper.episode_reset()#start a new session
         state_last = state
 
         ## Call to the screenshot & image-to-tensor methods.
         image_data = state.screen_buffer
-        image_data = self.game_wrapper.resize(image_data)
+        image_data = self.game_wrapper.preprocess(image_data) #uint8 126x126; reused buffer
         image_tensor = self.agent.image_to_tensor(image_data)
+        state_index = self.agent.state_index
+        label_bool = self.agent.num_extra > 0
+        extra = self.game_wrapper.observe(state) if label_bool else None
 
         ## Main cycle loop
         print('Entering Training Loop')
+        profiler = self.profiler
+        profiler.start()
 
-        while not self.game.is_episode_finished():
+        while not self.game.is_episode_finished() and not self.budget_reached():
 
             self.subcycle = max(self.varz['iteration'] - self.last_reset, 1)
-            action, prob, crit_val, action_space = self.agent.choose_action(image_tensor)
+            action, prob, crit_val, action_space = self.agent.choose_action(image_tensor, extra)
 
             ## Get qmax with decimal accuracy
             action_space *= 10 #fast decimal, allows int detachment with accuracy.
@@ -178,9 +276,11 @@ class ModelTrain():
 
             qmax = np.max(action_space)
             self.np_action = action
+            profiler.lap('choose_action')
 
             ## Execute action
-            self.game.make_action(self.action_set_permutations[self.np_action]) # Execute Action
+            self.game_wrapper.act(self.np_action) # Execute Action; held for frame_skip tics
+            profiler.lap('make_action')
 
             ## Get State
             state_ = self.game.get_state()
@@ -191,6 +291,7 @@ class ModelTrain():
                     death_bool = True
             except Exception as e:
                 print(str(type(state_)), e)
+            profiler.lap('get_state')
 
             self.image_data_ = state_.screen_buffer
             ## Get meta
@@ -200,36 +301,45 @@ class ModelTrain():
                                                               vars_set,
                                                               self.subcycle,
                                                               death_bool,
-                                                              label_set)
+                                                              label_set,
+                                                              state_.labels_buffer)
+            extra_ = self.game_wrapper.label_features.vector() if label_bool else None
             if reward > 0:
                 self.varz['reward_polarity'][0] += 1
             else:
                 self.varz['reward_polarity'][1] += 1
+            profiler.lap('reward_rules')
 
             #print(state_.number, terminal)
-            self.image_data_ = self.game_wrapper.resize(self.image_data_)
+            self.image_data_ = self.game_wrapper.preprocess(self.image_data_)
+            profiler.lap('resize')
             image_tensor_ = self.agent.image_to_tensor(self.image_data_)
+            state_index_ = self.agent.state_index
+            profiler.lap('image_to_tensor')
 
             #Theres always at least a random chance to remember
             if ((np.random.randint(4) == 0)
                     #or (self.np_action not in skipset)
                     or (abs(reward) > 1)
                     or terminal):
-                self.agent.remember(image_tensor, action,
+                self.agent.remember(state_index, action,
                                     prob, crit_val, reward,
-                                    terminal)
+                                    terminal, extra=extra)
+            profiler.lap('remember')
 
             state_last = state_
             image_tensor = image_tensor_
+            state_index = state_index_
+            extra = extra_
             self.total_reward += reward
 
             self.varz['iteration'] += 1
 
             ## Multiprocessing pipe to send metrics to GUI
-            self.varz['agent_qmax_list'].append(qmax)
-            self.varz['agent_qmax_avg'] = round(np.mean(self.varz['agent_qmax_list']), 1)
-            self.varz['critic_qmax_list'].append(crit_val)
-            self.varz['critic_qmax_avg'] = round(np.mean(self.varz['critic_qmax_list']), 1)
+            self.varz['agent_qmax_stats'].push(qmax)
+            self.varz['agent_qmax_avg'] = round(self.varz['agent_qmax_stats'].mean(), 1)
+            self.varz['critic_qmax_stats'].push(crit_val)
+            self.varz['critic_qmax_avg'] = round(self.varz['critic_qmax_stats'].mean(), 1)
 
             dmg_in = self.game_wrapper.vars_dict['DAMAGE_TAKEN']
             dmg_out = self.game_wrapper.vars_dict['DAMAGECOUNT']
@@ -237,59 +347,59 @@ class ModelTrain():
             dps_in = round(dmg_in/self.race_time_delta, 1)
             dps_out = round(dmg_out/self.race_time_delta, 1)
             if terminal:
-                self.varz['dps_in_que'].append(dps_in)
-                self.varz['dps_out_que'].append(dps_out)
-                self.varz['kill_count_que'].append(kill_count)
-                print(f"DPSI: {dps_in}/{np.mean(self.varz['dps_in_que'])}")
-                print(f"DPSO: {dps_out}/{np.mean(self.varz['dps_out_que'])}")
-                print(f"Kill Count: {kill_count}/{np.mean(self.varz['kill_count_que'])}")
-            dps_in_avg = np.mean(self.varz['dps_in_que'])
-            dps_out_avg = np.mean(self.varz['dps_in_que'])
-            kill_count_avg = np.mean(self.varz['kill_count_que'])
-
-            dmg_list = [dmg_in,
-                        dmg_out,
-                        dps_in,
-                        dps_out,
-                        dps_in_avg,
-                        dps_out_avg
-                        ]
+                self.varz['dps_in_que'].push(dps_in)
+                self.varz['dps_out_que'].push(dps_out)
+                self.varz['kill_count_que'].push(kill_count)
+                print(f"DPSI: {dps_in}/{self.varz['dps_in_que'].mean()}")
+                print(f"DPSO: {dps_out}/{self.varz['dps_out_que'].mean()}")
+                print(f"Kill Count: {kill_count}/{self.varz['kill_count_que'].mean()}")
+            dps_in_avg = self.varz['dps_in_que'].mean()
+            dps_out_avg = self.varz['dps_in_que'].mean()
+            kill_count_avg = self.varz['kill_count_que'].mean()
+
             action = np.argmax(action_space)
             if self.subcycle % 5 == 0: #time calcs are costly, so we limit them
                 self.total_time = int((datetime.now() - start).total_seconds())
                 #type(time_delta) = Float
                 self.race_time_delta = (datetime.now() - self.subtime).total_seconds()
+            profiler.lap('metrics')
+            profile = profiler.dump() if profiler.due() else None
 
             try:
-                metrics = [ #Game Metrics
-                    action, reward,                                     #0-1
-                    [action_space], self.total_reward, self.subcycle,   #2-4
-                    99999,                                              #5
-                    self.varz['iteration'], self.total_time, qmax,      #6-8
-                    self.varz['reward_polarity'],                       #9
-                    999999,                                             #10
-                    int(crit_val), self.cycles_per_second,              #11-12
-                    self.varz['agent_qmax_avg'],                        #13
-                    self.params['actor_learning_rate'],                 #14
-                    self.varz['game_time'],                             #15
-                    self.varz['critic_qmax_avg'],                       #16
-                    self.race_time_delta,                               #17
-                    self.params['mini_batch_size'], dmg_list,           #18-19
-                    self.varz['game_count'],                            #20
-                    self.varz['reward_avg_performance'],                #21
-                    ]
-
-                self.gui_send(send_connection, metrics)
+                telemetry = Telemetry(
+                    action=int(action), reward=reward,
+                    action_space=tuple(action_space.tolist()),
+                    total_reward=self.total_reward, subcycle=self.subcycle,
+                    policy_lag=self.varz['policy_lag'],
+                    iteration=self.varz['iteration'], total_time=self.total_time, qmax=qmax,
+                    reward_polarity=tuple(self.varz['reward_polarity']),
+                    crit_val=int(crit_val), cycles_per_second=self.cycles_per_second,
+                    agent_qmax_avg=self.varz['agent_qmax_avg'],
+                    actor_learning_rate=self.params['actor_learning_rate'],
+                    game_time=self.varz['game_time'],
+                    critic_qmax_avg=self.varz['critic_qmax_avg'],
+                    race_time=self.race_time_delta,
+                    mini_batch_size=self.params['mini_batch_size'],
+                    dmg_in=dmg_in, dmg_out=dmg_out, dps_in=dps_in, dps_out=dps_out,
+                    dps_in_avg=dps_in_avg, dps_out_avg=dps_out_avg,
+                    game_count=self.varz['game_count'],
+                    reward_avg=self.varz['reward_avg_performance'],
+                    profile=profile,
+                    )
+
+                self.gui_send(send_connection, telemetry)
             except Exception as e: 
                 print("Send Failure:", e) #print out if GUI not operating.
+            profiler.lap('gui_send')
+            profiler.end_step()
 
             p_bool = False #performance bool
             if terminal:#Game is saying we died
                 self.varz['lives_remaining'] -= 1
                 #terminal = False
                 game_over_bool = True
-                p_bool = ((self.varz['dps_in_que'][-1] < dps_in_avg)
-                          or (self.varz['kill_count_que'][-1] > kill_count_avg))
+                p_bool = ((self.varz['dps_in_que'].last() < dps_in_avg)
+                          or (self.varz['kill_count_que'].last() > kill_count_avg))
                 if not p_bool:
                     self.agent.memory.clear_memory()
 
@@ -309,8 +419,223 @@ class ModelTrain():
             ## Trigger reset; GAME OVER
             if game_over_bool:
                 self.training_reset() #learning happens here
+                self.game_ended(total_reward=self.varz['final_reward_score'], subcycle=self.subcycle,
+                                race_time=self.race_time_delta, qmax=qmax, crit_val=int(crit_val),
+                                dmg_in=dmg_in, dmg_out=dmg_out, dps_in=dps_in, dps_out=dps_out)
                 return #this will kick us back into the main function below and restart training.
 
+    def train_vector(self, start, send_connection):
+        """
+        Training loop over params['num_envs'] DoomGame worker processes.
+        Each step is one batched choose_actions call for every env that is ready.
+        Frame histories and trajectories are kept per env so GAE stays per env, and
+        learning happens every learn_cycles_goal cycles rather than per life.
+        """
+        envs = self.vector_env
+        num_envs = envs.num_envs
+        frames = envs.reset()
+
+        stacks, state_index = [None]*num_envs, [None]*num_envs
+        for env in range(num_envs):
+            stacks[env] = self.agent.image_to_tensor(frames[env], env)
+            state_index[env] = self.agent.state_index
+        #label features of each env's current state; the workers refresh envs.features.
+        extras = envs.features.copy() if self.agent.num_extra else None
+        last_action = np.zeros(num_envs, dtype=np.int64)
+        last_prob = np.zeros(num_envs, dtype=np.float32)
+        last_val = np.zeros(num_envs, dtype=np.float32)
+        last_space = np.zeros((num_envs, envs.num_actions), dtype=np.int32) #actor output x10, for the GUI
+        episode_reward = np.zeros(num_envs)
+        episode_cycles = np.zeros(num_envs, dtype=np.int64)
+        episode_start = [datetime.now() for _ in range(num_envs)]
+        env_ids = list(range(num_envs))
+        envs.reset_counter()
+
+        print(f'Entering Vector Training Loop ({num_envs} envs)')
+        #make_action, get_state, reward_rules and resize run in the workers; here they are step_wait.
+        profiler = self.profiler
+        profiler.start()
+        while not self.budget_reached():
+            actions, probs, vals, action_space = self.agent.choose_actions([stacks[env] for env in env_ids],
+                                                                           None if extras is None else extras[env_ids])
+            last_action[env_ids], last_prob[env_ids], last_val[env_ids] = actions, probs, vals
+            last_space[env_ids] = (action_space*10).detach().cpu().numpy().astype('int32')
+            profiler.lap('choose_action')
+            envs.step_async(actions, env_ids)
+
+            if self.params['async_envs_bool']:
+                env_ids, frames, rewards, dones, infos = envs.step_ready()
+            else:
+                frames, rewards, dones, infos = envs.step_wait()
+                env_ids = list(range(num_envs))
+            profiler.lap('step_wait')
+            gui_env = env_ids[0] #the GUI follows whichever env answered first.
+            gui_space = last_space[gui_env]
+
+            for i, env in enumerate(env_ids):
+                reward, done = rewards[i], dones[i]
+                #Theres always at least a random chance to remember
+                if (np.random.randint(4) == 0) or (abs(reward) > 1) or done:
+                    self.agent.remember(state_index[env], last_action[env], last_prob[env],
+                                        last_val[env], reward, done, env,
+                                        None if extras is None else extras[env])
+                stacks[env] = self.agent.image_to_tensor(frames[i], env)
+                state_index[env] = self.agent.state_index
+                if extras is not None:
+                    extras[env] = envs.features[env]
+
+                episode_reward[env] += reward
+                episode_cycles[env] += 1
+                if reward > 0:
+                    self.varz['reward_polarity'][0] += 1
+                else:
+                    self.varz['reward_polarity'][1] += 1
+
+                race_time = max((datetime.now() - episode_start[env]).total_seconds(), 1)
+                if done:
+                    self.wrapper_states[env] = infos[i]['wrapper_state']
+                    self.vector_episode_end(infos[i], race_time, int(episode_cycles[env]),
+                                            np.max(last_space[env]), last_val[env])
+                    episode_reward[env], episode_cycles[env] = 0, 0
+                    episode_start[env] = datetime.now()
+                if env == gui_env:
+                    gui_info = (reward, infos[i], race_time)
+            profiler.lap('remember/image_to_tensor')
+
+            self.varz['iteration'] += len(env_ids)
+            self.cycles_per_second = round(envs.frames_per_second(), 2)
+
+            qmax = np.max(gui_space)
+            crit_val = last_val[gui_env]
+            self.varz['agent_qmax_stats'].push(qmax)
+            self.varz['agent_qmax_avg'] = round(self.varz['agent_qmax_stats'].mean(), 1)
+            self.varz['critic_qmax_stats'].push(crit_val)
+            self.varz['critic_qmax_avg'] = round(self.varz['critic_qmax_stats'].mean(), 1)
+
+            ## Learn on a fixed cycle budget; the workers keep their episodes going.
+            profiler.lap('metrics')
+            learn_delta = self.varz['iteration'] - self.varz['learn_cycles_checkpoint']
+            if learn_delta >= self.params['learn_cycles_goal']:
+                print(f"Env FPS: {self.cycles_per_second}")
+                if self.learner:
+                    self.learner.submit(self.agent, self.varz['reward_avg_performance'])
+                else:
+                    print("Learning...", end="")
+                    self.agent.learn()
+                    self.agent.save_models(self.varz['reward_avg_performance'])
+                    profiler.lap('learn')
+                self.varz['learn_cycles_checkpoint'] = self.varz['iteration']
+                self.varz['agent_qmax_stats'].reset()
+                self.varz['critic_qmax_stats'].reset()
+                envs.reset_counter()
+                self.save_snapshot(policy_bool=not self.learner)
+            if self.learner and self.learner.sync(self.agent):
+                self.varz['policy_lag'] = self.learner.policy_lag.value
+                self.save_snapshot(policy_bool=True)
+
+            ## Multiprocessing pipe to send metrics to GUI
+            reward, info, race_time = gui_info
+            self.total_time = int((datetime.now() - start).total_seconds())
+            dmg_in = info['vars']['DAMAGE_TAKEN']
+            dmg_out = info['vars']['DAMAGECOUNT']
+            profile = profiler.dump() if profiler.due() else None
+            try:
+                telemetry = Telemetry(
+                    action=int(np.argmax(gui_space)), reward=reward,
+                    action_space=tuple(gui_space.tolist()),
+                    total_reward=episode_reward[gui_env],
+                    subcycle=int(episode_cycles[gui_env]),
+                    policy_lag=self.varz['policy_lag'],
+                    iteration=self.varz['iteration'], total_time=self.total_time, qmax=qmax,
+                    reward_polarity=tuple(self.varz['reward_polarity']),
+                    crit_val=int(crit_val), cycles_per_second=self.cycles_per_second,
+                    agent_qmax_avg=self.varz['agent_qmax_avg'],
+                    actor_learning_rate=self.params['actor_learning_rate'],
+                    game_time=self.varz['game_time'],
+                    critic_qmax_avg=self.varz['critic_qmax_avg'],
+                    race_time=race_time,
+                    mini_batch_size=self.params['mini_batch_size'],
+                    dmg_in=dmg_in, dmg_out=dmg_out,
+                    dps_in=round(dmg_in/race_time, 1), dps_out=round(dmg_out/race_time, 1),
+                    dps_in_avg=self.varz['dps_in_que'].mean(),
+                    dps_out_avg=self.varz['dps_out_que'].mean(),
+                    game_count=self.varz['game_count'],
+                    reward_avg=self.varz['reward_avg_performance'],
+                    profile=profile,
+                    )
+                self.gui_send(send_connection, telemetry)
+            except Exception as e:
+                print("Send Failure:", e) #print out if GUI not operating.
+            profiler.lap('gui_send')
+            profiler.end_step()
+
+    def vector_episode_end(self, info, race_time, cycles, qmax, crit_val):
+        """Per-episode bookkeeping for train_vector; the vector twin of training_reset's counters."""
+        dmg_in = info['vars']['DAMAGE_TAKEN']
+        dmg_out = info['vars']['DAMAGECOUNT']
+        dps_in, dps_out = round(dmg_in/race_time, 1), round(dmg_out/race_time, 1)
+        self.varz['dps_in_que'].push(dps_in)
+        self.varz['dps_out_que'].push(dps_out)
+        self.varz['kill_count_que'].push(info['vars']['KILLCOUNT'])
+
+        self.varz['game_time'] += int(race_time)
+        self.varz['game_count'] += 1
+        self.varz['reward_performance'].push(info['episode_reward'])
+        self.varz['reward_avg_performance'] = round(self.varz['reward_performance'].mean(), 2)
+        self.varz['reward_standard_deviation'] = round(self.varz['reward_performance'].std(), 2)
+        self.varz['time_performance'].push(race_time)
+        self.varz['time_avg_performance'] = round(self.varz['time_performance'].mean(), 1)
+        self.game_ended(total_reward=info['episode_reward'], subcycle=cycles, race_time=race_time,
+                        qmax=qmax, crit_val=int(crit_val), dmg_in=dmg_in, dmg_out=dmg_out,
+                        dps_in=dps_in, dps_out=dps_out)
+        self.save_snapshot()
+        self.check_stage()
+
+    def game_ended(self, **closing):
+        """Queues a GameSummary for the next gui_send; closing holds the game's last-step values."""
+        self.games_ended.append(GameSummary(
+            game_count=self.varz['game_count'] - 1, #game_count is already on the next game.
+            agent_qmax_avg=self.varz['agent_qmax_avg'],
+            critic_qmax_avg=self.varz['critic_qmax_avg'],
+            reward_avg=self.varz['reward_avg_performance'],
+            dps_in_avg=self.varz['dps_in_que'].mean(),
+            dps_out_avg=self.varz['dps_out_que'].mean(),
+            **closing))
+
+    def check_stage(self):
+        """Calls stage_check once the next check_frames frames are played; only at game ends, so no episode is cut."""
+        if self.stage_check and self.run_frames() >= (self.stage + 1)*self.check_frames:
+            self.stage += 1
+            self.stop_bool = bool(self.stage_check(self))
+
+    def run_frames(self):
+        """Frames (tics) played since the run first started; a resumed run counts its earlier frames too."""
+        return (self.varz['iteration'] - self.varz['budget_start_iteration'])*self.params['frame_skip']
+
+    def budget_reached(self):
+        """True once the run has played params['frame_budget'] frames or this process lasted params['time_budget'] seconds (or stop_bool)."""
+        if self.stop_bool:
+            return True
+        if self.params['frame_budget'] and self.run_frames() >= self.params['frame_budget']:
+            return True
+        if self.params['time_budget']:
+            return time.time() - self.run_start_time >= self.params['time_budget']
+        return False
+
+    def close(self):
+        """Stops the learner, writes the full snapshot, waits for the writers, then shuts down the games."""
+        if self.learner: #first, so the snapshot gets its last update.
+            self.learner.close()
+        if self.snapshot:
+            self.logger('save')
+            self.snapshot.close()
+        if self.agent.checkpoint_writer:
+            self.agent.checkpoint_writer.close()
+        if self.params['num_envs'] > 1:
+            self.vector_env.close()
+        else:
+            self.game_wrapper.close()
+
     # Testing Environment
     def test(self, start, send_connection):
         pass
@@ -325,26 +650,32 @@ class ModelTrain():
 
         self.varz['all_lives_reward'] += self.total_reward
 
-        if self.learn_bool:
+        if self.learn_bool and self.learner:
+            self.learner.submit(self.agent, self.varz['reward_avg_performance']) #the learner picks it up; we keep playing.
+            self.varz['learn_cycles_checkpoint'] = self.varz['iteration']
+        elif self.learn_bool:
             if self.varz['parent_counter'] != 6 or 1==1: #Bypass
                 print("Learning...", end="")
+                learn_start = time.perf_counter()
                 self.agent.learn() #we learn once the race is over.
+                self.profiler.record('learn', time.perf_counter() - learn_start)
                 self.varz['learn_cycles_checkpoint'] = self.varz['iteration']
 
         #self.agent.memory.clear_memory()
 
         self.varz['game_count'] += 1
-        self.varz['reward_performance'].append(self.total_reward)
-        self.varz['reward_avg_performance'] = round(np.mean(self.varz['reward_performance']), 2)
-        self.varz['reward_standard_deviation'] = round(np.std(self.varz['reward_performance']), 2)
-        self.varz['time_performance'].append(self.race_time_delta)
-        self.varz['time_avg_performance'] = round(np.mean(self.varz['time_performance']), 1)
+        self.varz['reward_performance'].push(self.total_reward)
+        self.varz['reward_avg_performance'] = round(self.varz['reward_performance'].mean(), 2)
+        self.varz['reward_standard_deviation'] = round(self.varz['reward_performance'].std(), 2)
+        self.varz['time_performance'].push(self.race_time_delta)
+        self.varz['time_avg_performance'] = round(self.varz['time_performance'].mean(), 1)
         if self.completion_bool: #we finished the race
-            self.varz['time_finish_performance'].append(self.race_time_delta)
-            val = round(np.mean(self.varz['time_finish_performance']), 1)
+            self.varz['time_finish_performance'].push(self.race_time_delta)
+            val = round(self.varz['time_finish_performance'].mean(), 1)
             self.varz['time_finish_avg_performance'] = val
 
-        self.varz['agent_qmax_list'], self.varz['critic_qmax_list'] = [], []
+        self.varz['agent_qmax_stats'].reset()
+        self.varz['critic_qmax_stats'].reset()
         self.varz['reward_polarity'] = [0, 0]
         self.varz['current_lap'], self.varz['current_lap_time'] = 1, 0
         self.varz['lap_time_dict'] = {1:0, 2:0, 3:0}
@@ -357,49 +688,123 @@ class ModelTrain():
 
         self.game_wrapper.wrapper_reset()
 
+        synced_bool = False
+        if self.learner: #pull any weights published since the last reset
+            synced_bool = self.learner.sync(self.agent)
+            if synced_bool:
+                self.varz['policy_lag'] = self.learner.policy_lag.value
+                print(f"Synced learner weights; policy lag {self.varz['policy_lag']}")
+
         if self.varz['parent_counter'] == 6 and 1 != 1: #Bypass
             self.varz['parent_counter'] = 1 #reset the counter
             self.agent.merge_models()
         #elif self.varz['parent_counter'] != 6 and self.learn_bool:
-        elif self.learn_bool:
-            self.agent.save_models()
+        elif self.learn_bool and not self.learner: #the learner saves its own models
+            self.agent.save_models(self.varz['reward_avg_performance'])
+        self.save_snapshot(policy_bool=synced_bool or (self.learn_bool and not self.learner))
+        self.check_stage()
 
     def logger(self, mode):
         """
         Handles file logging.
         mode: save/load
 
+        save writes every part of the training snapshot (Doom_Checkpoint.TrainingSnapshot);
+        load resumes from it, or from the older varz-only pickle if that is all there is.
         Loading is done through update, so new entries
         in varz are not erased when an older dict is loaded
         """
         os.chdir(self.home_dir)
 
         if mode == 'save':
-            ##Save Counters Pickle
-            with open(self.varz_path, 'wb') as outp:
-                pickle.dump(self.varz, outp, pickle.HIGHEST_PROTOCOL)
+            self.snapshot.save(self.snapshot_parts(SNAPSHOT_PARTS))
 
         elif mode == 'load':
-            print('Loading Counters Pickle', end="")
+            print('... loading Training Snapshot', end="")
+            load_start = time.perf_counter()
 
-            if os.path.exists(self.varz_path):
-                with open(self.varz_path, 'rb') as inp:
-                    varz_temp = pickle.load(inp)
-                    self.varz.update(varz_temp)
- 
-                    print('...done', end="")
+            if self.snapshot and self.snapshot.exists():
+                self.resume(self.snapshot.load())
+                print(f'...done({round(time.perf_counter() - load_start, 2)}s)', end="")
 
-            elif not os.path.exists(self.varz_path):
-                print(f"No Pickle Avalable at {self.varz_path}")
+            elif os.path.exists(self.varz_path):
+                with open(self.varz_path, 'rb') as inp:
+                    self.load_varz(pickle.load(inp))
+                print('...counters only', end="")
 
-            self.varz['hist_time'] = self.varz['total_time']
+            else:
+                print("...none yet", end="")
+
+            self.varz['hist_time'] = self.varz.get('total_time', 0)
+
+    def snapshot_parts(self, names):
+        """The named TrainingSnapshot parts of the current state."""
+        parts = {}
+        if 'policy' in names: #with the async learner, its weights and Adam states are the ones to keep.
+            parts['policy'] = (self.learner and self.learner.training_state()) or self.agent.training_state()
+        if 'params' in names:
+            parts['params'] = self.params
+        if 'varz' in names:
+            parts['varz'] = self.varz
+        if 'wrapper' in names:
+            if self.params['num_envs'] > 1: #the workers send theirs at every episode end.
+                parts['wrapper'] = list(self.wrapper_states)
+            else:
+                parts['wrapper'] = self.game_wrapper.training_state()
+        if 'rng' in names:
+            parts['rng'] = rng_state()
+        return parts
+
+    def save_snapshot(self, policy_bool=False):
+        """Counters and random streams, plus weights and optimizers when policy_bool (after a learn)."""
+        if self.snapshot:
+            names = SNAPSHOT_PARTS if policy_bool else ('varz', 'wrapper', 'rng')
+            self.snapshot.save(self.snapshot_parts(names))
+
+    def resume(self, parts):
+        """Puts the trainer back in the state TrainingSnapshot.load() returned."""
+        if 'params' in parts:
+            changed = [key for key in self.params if parts['params'].get(key, self.params[key]) != self.params[key]]
+            if changed: #the running params stay in charge.
+                print(f"... params changed since the snapshot: {changed}", end="")
+        if 'policy' in parts:
+            self.agent.load_training_state(parts['policy'])
+        if 'varz' in parts:
+            self.load_varz(parts['varz'])
+        if 'wrapper' in parts:
+            self.resume_wrappers(parts['wrapper'])
+        if 'rng' in parts:
+            load_rng_state(parts['rng'])
+
+    def resume_wrappers(self, states):
+        """Wrapper part of a single-env (one state) or vector (a list) snapshot, into this run's games."""
+        states = states if isinstance(states, list) else [states]
+        saved = [state for state in states if state is not None] #envs that had not finished an episode.
+        if not saved:
+            return
+        if len(states) != self.params['num_envs']: #num_envs changed; hand the saved states round.
+            print(f"... snapshot has {len(states)} wrapper states for {self.params['num_envs']} envs", end="")
+            states = [saved[env % len(saved)] for env in range(self.params['num_envs'])]
+        if self.params['num_envs'] > 1:
+            self.wrapper_states = list(states)
+            self.vector_env.load_training_states(self.wrapper_states)
+        else:
+            self.game_wrapper.load_training_state(saved[0])
+
+    def load_varz(self, varz_temp):
+        for key in ('agent_qmax_list', 'critic_qmax_list'): #replaced by the *_stats entries.
+            varz_temp.pop(key, None)
+        for key, value in varz_temp.items(): #pickles from before Doom_Stats hold deques.
+            if isinstance(self.varz.get(key), WindowStats) and not isinstance(value, WindowStats):
+                varz_temp[key] = WindowStats(self.varz[key].size, value)
+        self.varz.update(varz_temp)
 
     # A method for communicating with the GUI through Multiprocess Pipe
-    def gui_send(self, conn, metrics):
-        #conn.close()
-        metrics.append(-9999) # just some fodder to signal the end of the transmission.
-        for metric in metrics:
-            conn.send(metric)
+    def gui_send(self, conn, telemetry):
+        if self.games_ended: #games that ended since the last send ride on this record.
+            telemetry = telemetry._replace(games=tuple(self.games_ended))
+            self.games_ended.clear()
+        conn.send(telemetry) #one Doom_Telemetry record per step; the GUI keeps the newest.
 
 # Script initialization switchboard
 def main(mode, send_connection=False):
@@ -407,9 +812,11 @@ def main(mode, send_connection=False):
     if mode == 'train':
         start = datetime.now()
         choo_choo = ModelTrain()
-        choo_choo.train(start, send_connection)
-        while 1:
-            choo_choo.train(start, send_connection)
+        if choo_choo.params['num_envs'] > 1:
+            choo_choo.train_vector(start, send_connection) #runs until the process is stopped.
+        else:
+            while 1:
+                choo_choo.train(start, send_connection)
 
     elif mode == 'test':
         start = datetime.now()
@@ -0,0 +1,307 @@
+"""
+Runs several Doom_Wrapper.DoomGame instances in worker processes so one batched
+choose_actions call can drive all of them.
+
+Each worker owns one game and answers small commands over a pipe:
+    ('reset', None)   -> (frame, label features) of a new episode
+    ('step', action)  -> (frame, reward, done, info); finished episodes auto-reset
+    ('load_state', state) -> None, after DoomGame.load_training_state(state)
+    ('close', None)
+
+Workers ignore SIGINT and SIGTERM: ctrl+c or a SIGTERM to the process group reaches
+them too, and the parent shuts them down itself (close). A worker whose parent is gone
+closes its game on its own.
+
+Frames come back already resized and quantized to uint8, which is what the
+agent's FrameStore keeps anyway. The label feature vector (Doom_Labels) of each
+env's current state is kept in VectorDoomGame.features.
+
+With shared_memory_bool (the default) the results do not travel over the pipes at
+all: each worker writes its frame, reward, done flag, game variables and episode
+totals into its own row of one multiprocessing.shared_memory slab, and only sends a
+empty ack. Pickled pipes remain as the fallback (shared_memory_bool=False).
+When an episode ends, the worker's DoomGame.training_state (w_varz, reward counters)
+comes along as info['wrapper_state'], pickled into the ack in slab mode.
+
+VectorDoomGame can be stepped in lockstep (step / step_wait) or asynchronously
+(step_async + step_ready), where only the environments that have answered get
+new actions.
+"""
+import time
+import atexit
+import pickle
+import signal
+import multiprocessing
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+import numpy as np
+
+import Doom_Wrapper
+from Doom_Rewards import VARIABLE_NAMES
+from Doom_Labels import NUM_LABEL_FEATURES
+
+def slab_layout(num_envs, xy=126):
+    """Byte layout of the shared observation slab: one row per env in every field."""
+    fields = [('frames', (num_envs, xy, xy), np.uint8),
+              ('game_vars', (num_envs, len(VARIABLE_NAMES)), np.float64),
+              ('features', (num_envs, NUM_LABEL_FEATURES), np.float32),
+              ('rewards', (num_envs,), np.float64),
+              ('dones', (num_envs,), np.bool_),
+              ('episode_rewards', (num_envs,), np.float64),
+              ('episode_frames', (num_envs,), np.int64)]
+    layout, offset = {}, 0
+    for name, shape, dtype in fields:
+        offset = -(-offset//8)*8 #8 byte alignment
+        layout[name] = (offset, shape, dtype)
+        offset += int(np.prod(shape))*np.dtype(dtype).itemsize
+    return layout, offset
+
+def slab_views(buffer, layout):
+    """Numpy arrays over the slab; they have to be dropped before the SharedMemory is closed."""
+    return {name: np.ndarray(shape, dtype, buffer=buffer, offset=offset)
+            for name, (offset, shape, dtype) in layout.items()}
+
+def env_worker(conn, total_frame_limit, render_profile='watch', frame_skip=1, record_dir=None,
+               slab_info=None, start_pool_size=0, doom_map="MAP07", r_rules=None, label_inputs=False):
+    """Worker process body; owns one DoomGame. slab_info = (shm name, num_envs, env index)."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN) #the parent closes the workers; see the module docstring.
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    game_wrapper = Doom_Wrapper.DoomGame(total_frame_limit, render_profile, frame_skip, record_dir,
+                                         start_pool_size, doom_map, r_rules, label_inputs)
+    game = game_wrapper.game
+    conn.send(len(game_wrapper.action_set_permutations))
+
+    if slab_info is not None:
+        shm_name, num_envs, env = slab_info
+        shm = shared_memory.SharedMemory(name=shm_name)
+        slab = slab_views(shm.buf, slab_layout(num_envs, game_wrapper.xy)[0])
+
+    def to_frame(state):
+        return game_wrapper.preprocess(state.screen_buffer) #pickled on send, so the reuse is safe.
+
+    def publish(frame, features, reward=0, done=False, info=None):
+        """Step result to the parent: into this env's slab row + an ack, or pickled."""
+        if slab_info is None:
+            if info is None:
+                conn.send((frame, features))
+            else:
+                info['features'] = features
+                conn.send((frame, reward, done, info))
+            return
+        slab['frames'][env] = frame
+        slab['features'][env] = features
+        if info is not None:
+            slab['rewards'][env] = reward
+            slab['dones'][env] = done
+            slab['game_vars'][env] = [info['vars'][name] for name in VARIABLE_NAMES]
+            if done:
+                slab['episode_rewards'][env] = info['episode_reward']
+                slab['episode_frames'][env] = info['episode_frames']
+                conn.send_bytes(pickle.dumps(info['wrapper_state'], pickle.HIGHEST_PROTOCOL))
+                return
+        conn.send_bytes(b'')
+
+    def reset():
+        game_wrapper.wrapper_reset()
+        return game_wrapper.episode_reset()
+
+    state_last = None
+    frame_count = 0
+    episode_reward = 0
+
+    while True:
+        try:
+            cmd, data = conn.recv()
+        except EOFError: #parent died without closing us.
+            cmd, data = 'close', None
+
+        if cmd == 'step':
+            game_wrapper.act(data)
+            frame_count += 1
+
+            state_ = game.get_state()
+            death_bool = state_ is None #episode ended under us.
+            if death_bool:
+                state_ = state_last
+            reward, terminal = game_wrapper.reward_rules(data, state_.game_variables,
+                                                         frame_count, death_bool,
+                                                         state_.labels, state_.labels_buffer)
+            features = game_wrapper.label_features.vector()
+            episode_reward += reward
+            done = terminal or game.is_episode_finished()
+            info = {'vars': dict(game_wrapper.vars_dict)}
+
+            if done:
+                info['episode_reward'] = episode_reward
+                info['episode_frames'] = frame_count
+                state_ = reset()
+                features = game_wrapper.observe(state_)
+                info['wrapper_state'] = game_wrapper.training_state() #for the parent's snapshots.
+                frame_count, episode_reward = 0, 0
+            state_last = state_
+            publish(to_frame(state_), features, reward, done, info)
+
+        elif cmd == 'reset':
+            state_last = reset()
+            frame_count, episode_reward = 0, 0
+            publish(to_frame(state_last), game_wrapper.observe(state_last))
+
+        elif cmd == 'load_state':
+            game_wrapper.load_training_state(data)
+            conn.send(None)
+
+        elif cmd == 'close':
+            game_wrapper.close()
+            if slab_info is not None:
+                del slab
+                shm.close()
+            conn.close()
+            break
+
+class VectorDoomGame():
+    """N DoomGame workers behind one batched interface."""
+    def __init__(self, num_envs, total_frame_limit, render_profile='watch', frame_skip=1,
+                 record_dir=None, shared_memory_bool=True, start_pool_size=0, xy=126, doom_map="MAP07",
+                 r_rules=None, label_inputs=False):
+        self.num_envs = num_envs
+        self.remotes = []
+        self.processes = []
+        self.shm, self.slab = None, None
+        self.closed = False
+        if shared_memory_bool:
+            layout, size = slab_layout(num_envs, xy)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.slab = slab_views(self.shm.buf, layout)
+
+        for env in range(num_envs):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            slab_info = (self.shm.name, num_envs, env) if shared_memory_bool else None
+            process = multiprocessing.Process(target=env_worker,
+                                              args=(child_conn, total_frame_limit,
+                                                    render_profile, frame_skip, record_dir,
+                                                    slab_info, start_pool_size, doom_map, r_rules,
+                                                    label_inputs),
+                                              daemon=True)
+            process.start()
+            child_conn.close()
+            self.remotes.append(parent_conn)
+            self.processes.append(process)
+
+        #every worker reports its action count once the game is up.
+        self.num_actions = [remote.recv() for remote in self.remotes][0]
+        self.features = np.zeros((num_envs, NUM_LABEL_FEATURES), dtype=np.float32)
+        self.waiting = set() #envs with a step in flight.
+        self.frame_count = 0
+        self.start_time = time.time()
+        atexit.register(self.close) #before multiprocessing's own exit handler, which would wait on them.
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        results = [self._recv(env) for env in range(self.num_envs)]
+        if self.slab is not None:
+            self.features[:] = self.slab['features']
+            return self.slab['frames'].copy()
+        frames, features = zip(*results)
+        self.features[:] = features
+        return np.stack(frames)
+
+    def _recv(self, env):
+        """One env's answer: the pickled result, or just the ack when it is in the slab."""
+        if self.slab is not None:
+            return self.remotes[env].recv_bytes()
+        return self.remotes[env].recv()
+
+    def step_async(self, actions, env_ids=None):
+        """Sends actions without waiting; env_ids defaults to every environment."""
+        if env_ids is None:
+            env_ids = range(self.num_envs)
+        for env, action in zip(env_ids, actions):
+            self.remotes[env].send(('step', int(action)))
+            self.waiting.add(env)
+
+    def step_wait(self):
+        """Lockstep: blocks until every environment in flight has answered, in env order."""
+        env_ids = sorted(self.waiting)
+        results = [self._recv(env) for env in env_ids]
+        self.waiting.clear()
+        return self._collate(env_ids, results)
+
+    def step_ready(self, timeout=None):
+        """Async: returns env_ids plus the results of whichever environments have answered."""
+        ready = wait([self.remotes[env] for env in self.waiting], timeout)
+        env_ids = sorted(self.remotes.index(conn) for conn in ready)
+        results = [self._recv(env) for env in env_ids]
+        self.waiting.difference_update(env_ids)
+        return (env_ids,) + self._collate(env_ids, results)
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def _collate(self, env_ids, results):
+        self.frame_count += len(results)
+        if not results:
+            return np.zeros((0,)), np.zeros(0), np.zeros(0, dtype=bool), []
+        if self.slab is None:
+            frames, rewards, dones, infos = zip(*results)
+            self.features[env_ids] = [info['features'] for info in infos]
+            return np.stack(frames), np.array(rewards), np.array(dones), list(infos)
+
+        #fancy indexing copies, so workers can overwrite their rows right away.
+        slab = self.slab
+        self.features[env_ids] = slab['features'][env_ids]
+        dones = slab['dones'][env_ids]
+        infos = []
+        for env, done, ack in zip(env_ids, dones, results):
+            info = {'vars': dict(zip(VARIABLE_NAMES, slab['game_vars'][env].tolist())),
+                    'features': self.features[env].copy()}
+            if done:
+                info['episode_reward'] = float(slab['episode_rewards'][env])
+                info['episode_frames'] = int(slab['episode_frames'][env])
+                info['wrapper_state'] = pickle.loads(ack)
+            infos.append(info)
+        return slab['frames'][env_ids], slab['rewards'][env_ids], dones, infos
+
+    def load_training_states(self, states):
+        """DoomGame.load_training_state in every worker with a state (None leaves that env alone)."""
+        assert not self.waiting, "load_training_states with steps in flight"
+        envs = [env for env, state in enumerate(states) if state is not None]
+        for env in envs:
+            self.remotes[env].send(('load_state', states[env]))
+        for env in envs:
+            self.remotes[env].recv()
+
+    def frames_per_second(self):
+        """Aggregate environment frames per second since start (or the last reset_counter)."""
+        return self.frame_count/max(time.time() - self.start_time, 1e-9)
+
+    def reset_counter(self):
+        self.frame_count = 0
+        self.start_time = time.time()
+
+    def close(self, timeout=10):
+        """Closes every worker; dead ones are skipped and ones still up after timeout are killed."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            for env, remote in enumerate(self.remotes):
+                try:
+                    if env in self.waiting and remote.poll(timeout):
+                        self._recv(env)
+                    remote.send(('close', None))
+                except (EOFError, BrokenPipeError, OSError): #worker already gone.
+                    pass
+            for process in self.processes:
+                process.join(timeout)
+                if process.is_alive():
+                    process.kill() #workers ignore SIGTERM.
+                    process.join()
+            for remote in self.remotes:
+                remote.close()
+        finally:
+            if self.shm is not None:
+                self.slab = None #views first, or the buffer cannot be released.
+                self.shm.close()
+                self.shm.unlink()
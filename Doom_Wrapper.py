@@ -10,30 +10,75 @@
 #####################################################################
 
 import os
+import time
+import shutil
+import tempfile
+import weakref
 import itertools as it
 from random import choice #returns a random element from a list.
-from time import sleep
-from collections import deque
+from time import sleep, perf_counter
 
 from decorators import function_timer
 import cv2
 import numpy as np
 import vizdoom as vzd
 
+from Doom_Rewards import RewardEngine, VARIABLE_NAMES
+from Doom_Preprocess import FramePreprocessor
+from Doom_Labels import LabelFeatures
+
 
 #Somehow the delta button example actualy loads level 1
 
+#Named render setups; everything that decides what the engine draws is set together.
+#Resolution/format are vizdoom enum names. Labels stay on in every profile (rewards need them).
+RENDER_PROFILES = {
+    'watch': { #the original setup; visible window, everything drawn.
+        'resolution': 'RES_320X240', 'screen_format': 'BGR24', 'window_visible': True,
+        'hud': True, 'minimal_hud': False, 'crosshair': False, 'weapon': True,
+        'decals': True, 'particles': True, 'effects_sprites': True, 'messages': True,
+        'corpses': True, 'screen_flashes': True,
+        },
+    'train-fast': { #headless, smaller native frame, cosmetic effects off.
+        'resolution': 'RES_160X120', 'screen_format': 'GRAY8', 'window_visible': False,
+        'hud': False, 'minimal_hud': False, 'crosshair': False, 'weapon': True,
+        'decals': False, 'particles': False, 'effects_sprites': False, 'messages': False,
+        'corpses': True, 'screen_flashes': True,
+        },
+    'train-minimal': { #headless, only the level and the monsters.
+        'resolution': 'RES_160X120', 'screen_format': 'GRAY8', 'window_visible': False,
+        'hud': False, 'minimal_hud': False, 'crosshair': False, 'weapon': False,
+        'decals': False, 'particles': False, 'effects_sprites': False, 'messages': False,
+        'corpses': False, 'screen_flashes': False,
+        },
+    }
+
 class DoomGame():
     """A Wrapper for vizdoom"""
-    def __init__(self, total_frame_limit):
-        self.window_show_bool = True #Does not affect framerate.
+    def __init__(self, total_frame_limit, render_profile='watch', frame_skip=1, record_dir=None,
+                 start_pool_size=0, doom_map="MAP07", r_rules=None, label_inputs=False):
+        self.render_profile = render_profile #key into RENDER_PROFILES
+        #each action is held for frame_skip tics; per-tic rewards are summed over them.
+        self.frame_skip = frame_skip
+        #when set, every episode is saved there as a vizdoom demo + sidecar; see Doom_Replay.
+        self.record_dir = record_dir
+        self.recording = None #sidecar of the episode being recorded.
+        self.episode_counter = 0
+        #resets load one of this many saved post-setup states instead of replaying the setup; 0 = off.
+        self.start_pool_size = start_pool_size
+        self.start_wander = 35 #max random tics played before each pool snapshot after the first.
+        self.start_snapshots = [] #save files; filled by the first start_pool_size resets.
+        self.snapshot_dir = None #temp folder, made with the first snapshot.
+        self.window_show_bool = RENDER_PROFILES[render_profile]['window_visible']
         self.xy = 126  #downsize to 126x126px
+        #fused resize/gray/equalize/normalize; yields the uint8 frames the agent stores.
+        self.preprocess = FramePreprocessor(self.xy, 'uint8')
         self.scenario_bool = False
-        self.map = "MAP07" #2,7,15,21,23
+        self.map = doom_map #2,7,15,21,23
         self.scenario_path = "defend_the_center.cfg"
         self.turn_delta = 2.5 #how many degrees per turn
         self.difficulty = 1 #1-5; default 3
-        #will reset if we havent finished by n frames.
+        #will reset if we havent finished by n frames(tics, whatever the frame_skip).
         self.total_frame_limit = total_frame_limit
         self.hit_bonus = 5 #reward spillover
 
@@ -51,21 +96,32 @@ class DoomGame():
             'stuck': -2,
             'stuck_timeout': -18,#overwrites
             'dry_fire':-1, #attacked without enemy on screen.
+            'enemy_centered': 0, #x(1 - crosshair distance) while an enemy is on screen; 0 = off.
         }
+        #{rule: value} from the caller (ModelTrain param 'r_rules', Doom_Sweep); kept over snapshots too.
+        self.r_rules_overrides = dict(r_rules or {})
+        unknown = sorted(set(self.r_rules_overrides) - set(self.r_rules))
+        if unknown:
+            raise KeyError(f"Unknown r_rules: {unknown}")
+        self.r_rules.update(self.r_rules_overrides)
 
         self.scored_kill = False
         self.w_varz = { #Wrapper Counters
-            'reward_que': deque(maxlen=10),
-            'dmg_out_que': deque([1], maxlen=25),
-            'dmg_in_que': deque([1], maxlen=25),
-            'hit_spillover':0,
-            'stuck_counter':0, #how many frames with no x/y delta
+            #reward_que, dmg in/out ques, hit_spillover and stuck_counter live in the RewardEngine.
             'enemy_names':["Fatso", "Zombieman",
                            "MarineChainsawVzd", "Demon"],
             'sum_dmg_out':0,
             'sum_dmg_in':0,
         }
-        self.vars_dict_last = ""
+        self.enemy_names = frozenset(self.w_varz['enemy_names'])
+        #enemy count/coverage/crosshair distance from the labels buffer; see Doom_Labels.
+        self.label_features = LabelFeatures(self.enemy_names)
+        #the buffer pass only runs when something uses it: the models' label inputs
+        #(ModelTrain 'label_inputs_bool') or a nonzero 'enemy_centered' rule.
+        self.label_inputs = label_inputs
+        #r_rules compiled for this one game; call reward_engine.compile(self.r_rules) after edits.
+        self.reward_engine = RewardEngine(self.r_rules, 1, self.hit_bonus,
+                                          self.total_frame_limit, self.frame_skip)
         self.game_init() #run the initialization function.
 
     def game_init(self):
@@ -126,8 +182,6 @@ class DoomGame():
                           'DAMAGECOUNT':0, 'DAMAGE_TAKEN':0,
                           'POSITION_X':0, 'POSITION_Y':0}
 
-        self.vars_dict_last = self.vars_dict.copy() #for tracking deltas
-
         # load_config could be used to load configuration instead of doing it here with code.
 
         # Sets path to additional resources wad file which is basically your scenario wad.
@@ -144,25 +198,27 @@ class DoomGame():
             #https://github.com/Farama-Foundation/ViZDoom/tree/master/scenarios
             scenario = os.path.join(vzd.scenarios_path, self.scenario_path)
             self.game.load_config(scenario)
-
-        #Default is 800x600;320X240;256X192;200X150
-        self.game.set_screen_resolution(vzd.ScreenResolution.RES_320X240)
-
-        ## Set Render Conditions
-        self.game.set_screen_format(vzd.ScreenFormat.BGR24) #RGB24; cv2 is BGR
+        self.label_features.reset() #object name ids are per map.
+        self.start_snapshots = [] #so are the start snapshots.
+
+        ## Set Render Conditions (see RENDER_PROFILES)
+        profile = RENDER_PROFILES[self.render_profile]
+        #Default is 800x600;320X240;256X192;200X150;160X120
+        self.game.set_screen_resolution(getattr(vzd.ScreenResolution, profile['resolution']))
+        self.game.set_screen_format(getattr(vzd.ScreenFormat, profile['screen_format'])) #BGR24 or GRAY8; cv2 is BGR
         self.game.set_labels_buffer_enabled(True) # Enables labeling of the in game objects.
 
         # Sets other rendering options (all of these options except crosshair are enabled (set to True) by default)
-        self.game.set_render_hud(True)
-        self.game.set_render_minimal_hud(False)  # If hud is enabled
-        self.game.set_render_crosshair(False)
-        self.game.set_render_weapon(True)
-        self.game.set_render_decals(True)  # Bullet holes and blood on the walls
-        self.game.set_render_particles(True)
-        self.game.set_render_effects_sprites(True)  # Smoke and blood
-        self.game.set_render_messages(True)  # In-game messages
-        self.game.set_render_corpses(True)
-        self.game.set_render_screen_flashes(True)  # Effect upon taking damage or picking up items
+        self.game.set_render_hud(profile['hud'])
+        self.game.set_render_minimal_hud(profile['minimal_hud'])  # If hud is enabled
+        self.game.set_render_crosshair(profile['crosshair'])
+        self.game.set_render_weapon(profile['weapon'])
+        self.game.set_render_decals(profile['decals'])  # Bullet holes and blood on the walls
+        self.game.set_render_particles(profile['particles'])
+        self.game.set_render_effects_sprites(profile['effects_sprites'])  # Smoke and blood
+        self.game.set_render_messages(profile['messages'])  # In-game messages
+        self.game.set_render_corpses(profile['corpses'])
+        self.game.set_render_screen_flashes(profile['screen_flashes'])  # Effect upon taking damage or picking up items
 
         """ Automap Stuff
         self.game.set_automap_buffer_enabled(True)
@@ -264,116 +320,172 @@ class DoomGame():
 
         self.game.close()
 
-    def reward_rules(self, action, vars_list, frame_count, death_bool, labels):
+    def fps_benchmark(self, frames=2000):
+        """
+        game_loop style random play for a fixed number of frames, no printing.
+        Returns (engine fps, fps including preprocessing) for the current render profile.
+        """
+        actions = self.action_set_permutations
+        engine_time, resize_time = 0, 0
+        self.episode_reset()
+        for _ in range(frames):
+            t0 = perf_counter()
+            self.game.make_action(choice(actions))
+            if self.game.is_episode_finished():
+                self.episode_reset()
+            state = self.game.get_state()
+            t1 = perf_counter()
+            self.preprocess(state.screen_buffer)
+            engine_time += t1 - t0
+            resize_time += perf_counter() - t1
+        return frames/engine_time, frames/(engine_time + resize_time)
+
+    def act(self, action):
+        """
+        Plays one decision: the action is held for frame_skip tics in a single
+        make_action call, so the engine only renders the last of them.
+        """
+        return self.game.make_action(self.action_set_permutations[action], self.frame_skip)
+
+    def episode_reset(self):
+        """
+        Starts a new episode, runs the per-map setup and returns the first state.
+        With a start pool, once it is full a reset just loads one of the snapshots;
+        new_episode, the 10 start tics and the setup actions are all skipped.
+        Recording always takes the full path, a demo has to begin at new_episode.
+        """
+        self.finish_recording()
+        pool_full = self.start_pool_size and len(self.start_snapshots) >= self.start_pool_size
+        if self.record_dir is None and pool_full:
+            return self.load_start_snapshot()
+        if self.record_dir is None:
+            self.game.new_episode()
+        else:
+            self.start_recording()
+        if self.map == "MAP07": #Manual setup for mission.
+            self.game.make_action(self.action_set_permutations[8]) # open door
+        if self.record_dir is None and self.start_pool_size:
+            self.save_start_snapshot()
+            if self.game.is_episode_finished(): #died wandering; start over.
+                return self.episode_reset()
+        return self.game.get_state()
+
+    def save_start_snapshot(self):
+        """
+        Adds the current (just set up) game to the start pool. Every snapshot after the
+        first wanders a random number of tics first, so the pool covers different
+        positions and headings; the agent plays on from there.
+        """
+        if self.start_snapshots:
+            for _ in range(np.random.randint(1, self.start_wander + 1)):
+                self.game.make_action(choice(self.action_set_permutations))
+            if self.game.is_episode_finished():
+                return
+        if self.snapshot_dir is None:
+            self.snapshot_dir = tempfile.mkdtemp(prefix='doom_starts_')
+            #removed on close(), or at exit if the game is never closed.
+            self.snapshot_cleanup = weakref.finalize(self, shutil.rmtree, self.snapshot_dir, True)
+        path = os.path.join(self.snapshot_dir, f"start_{len(self.start_snapshots)}.sav")
+        self.game.save(path)
+        self.start_snapshots.append(path)
+
+    def load_start_snapshot(self):
+        """
+        Restores a random pool snapshot. After a death (the common reset) it is loaded
+        straight over the finished episode, like loading a save from the death screen;
+        new_episode is only played first if the engine still reports it finished.
+        """
+        path = choice(self.start_snapshots)
+        self.game.load(path)
+        if self.game.is_episode_finished():
+            self.game.new_episode()
+            self.game.load(path)
+        return self.game.get_state()
+
+    def start_recording(self):
+        """New seeded episode with vizdoom writing the demo (.lmp); actions/rewards go to the sidecar."""
+        os.makedirs(self.record_dir, exist_ok=True)
+        self.episode_counter += 1
+        name = f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{self.episode_counter:05d}"
+        seed = int(np.random.randint(2**31 - 1))
+        self.game.set_seed(seed)
+        self.recording = {'demo_path': os.path.join(self.record_dir, name + '.lmp'),
+                          'seed': seed, 'map': self.map, 'frame_skip': self.frame_skip,
+                          'render_profile': self.render_profile,
+                          'total_frame_limit': self.total_frame_limit,
+                          'actions': [], 'rewards': [], 'terminals': []}
+        self.game.new_episode(self.recording['demo_path'])
+
+    def finish_recording(self):
+        """Writes the sidecar of the current recording, if there is one."""
+        if self.recording is None:
+            return
+        recording, self.recording = self.recording, None
+        np.savez_compressed(recording['demo_path'][:-len('.lmp')] + '.npz',
+                            actions=np.array(recording['actions'], dtype=np.int16),
+                            rewards=np.array(recording['rewards'], dtype=np.float32),
+                            terminals=np.array(recording['terminals'], dtype=bool),
+                            seed=recording['seed'], map=recording['map'],
+                            frame_skip=recording['frame_skip'],
+                            render_profile=recording['render_profile'],
+                            total_frame_limit=recording['total_frame_limit'])
+
+    def close(self):
+        self.finish_recording()
+        self.game.close()
+        if self.snapshot_dir is not None:
+            self.snapshot_cleanup()
+
+    def reward_rules(self, action, vars_list, frame_count, death_bool, labels, labels_buffer=None):
         """Reward Function is calculated here as all the neccessary variables are
-        calculated locally. Different values are contained in self.r_rules"""
-
-        #First convert vars_list to a labeled dict w/ rounded xy coords.
-        dict_labels = ['KILLCOUNT', 'DEATHCOUNT', 'HITCOUNT',
-                       'HITS_TAKEN', 'DAMAGECOUNT', 'DAMAGE_TAKEN',
-                       'POSITION_X', 'POSITION_Y']
-        for i, var in enumerate(vars_list):
-            if i in (6, 7):
-                self.vars_dict[dict_labels[i]] = round(var)
-            else:
-                self.vars_dict[dict_labels[i]] = var
-
-        terminal = False
-        reward = self.r_rules['passive'] #cost of existing/no enemy on screen
-
-        ## See if we're in a spillover state.
-        if self.w_varz['hit_spillover'] > 0:
-            reward = self.r_rules['spillover']
-            self.w_varz['hit_spillover'] -= 1
-
-        ## Check for enemies on screen
-        ## No attacking if there are no enemies
-        enemy_bool = False
-        screen_bonus = 0
-        for label in labels:
-            #print(label.object_name)
-            if str(label.object_name) in self.w_varz['enemy_names']:
-                screen_bonus += self.r_rules['enemy_screen']
-                enemy_bool = True
-                #break
-        reward += screen_bonus
-        if action == 5 and not enemy_bool:
-            #attacked without enemy on screen
-            reward += self.r_rules['dry_fire']
-
-        ## Check for Kill
-        if self.vars_dict['KILLCOUNT'] > self.vars_dict_last['KILLCOUNT']:
+        calculated locally. Different values are contained in self.r_rules
+        The scoring itself is Doom_Rewards.RewardEngine.step_one, for this one game;
+        frame_count counts decisions, the engine scales per-tic terms by frame_skip.
+        With the labels buffer the label features (self.label_features.features) are
+        complete for the frame; without it only the enemy count is. The buffer is
+        skipped unless label inputs or the enemy_centered rule need it."""
+        engine = self.reward_engine
+        if not (self.label_inputs or self.r_rules['enemy_centered']):
+            labels_buffer = None
+        features = self.label_features(labels, labels_buffer)
+        reward, terminal = engine.step_one(action, vars_list, features['enemy_count'],
+                                           death_bool, frame_count, features['crosshair_distance'])
+
+        #labeled dict w/ rounded xy coords, for the training loop and the GUI.
+        for name, var in zip(VARIABLE_NAMES, engine.vars_last[0]):
+            self.vars_dict[name] = var
+
+        if engine.kills[0] > 0:
             self.scored_kill = True
             print(f"KILL!: {self.vars_dict['KILLCOUNT']}")
-            reward += self.r_rules['scored_kill']
-
-        ## Check if we died
         if death_bool: #we died
             print("Reset: DIED")
-            reward = self.r_rules['died']
-            terminal = True
-
-        ## Delt a hit(Magnitude)
-        v1 = self.vars_dict['DAMAGECOUNT']
-        v2 = self.vars_dict_last['DAMAGECOUNT']
-        if v1 > v2:
-            #Reward is scaled to magnitude set by max(dmg_out_que)
-            dmg_out_delta = v1 - v2
-            self.w_varz['dmg_out_que'].append(dmg_out_delta)
-
-            #like c map function:(input val, [in_min,in_max],[out_min,out_max])
-            r_dice = np.interp(dmg_out_delta, 
-                               [min(self.w_varz['dmg_out_que']),
-                                max(self.w_varz['dmg_out_que'])],
-                               [self.r_rules['dmg_out_min'],
-                                self.r_rules['dmg_out_max']])
-            reward += r_dice
-            self.w_varz['hit_spillover'] = self.hit_bonus
-            #print(f"HIT DELT!: {dmg_out_delta} yielded +{round(reward, 2)}")
-
-        ## Felt a hit(Magnitude)
-        v1 = self.vars_dict['DAMAGE_TAKEN']
-        v2 = self.vars_dict_last['DAMAGE_TAKEN']
-        if v1 > v2:
-            #Reward is scaled to magnitude set by max(dmg_in_que)
-            dmg_in_delta = v1 - v2
-            self.w_varz['dmg_in_que'].append(dmg_in_delta)
-            #like c map function:(input val, [in_min,in_max],[out_min,out_max])
-            r_dice = np.interp(dmg_in_delta,
-                               [min(self.w_varz['dmg_in_que']),
-                                max(self.w_varz['dmg_in_que'])],
-                               [self.r_rules['dmg_in_min'],
-                                self.r_rules['dmg_in_max']])
-            reward -= r_dice
-            #print(f"*HIT FELT!: {dmg_in_delta} yielded -{round(r_dice, 2)}")
-
-        if frame_count >= self.total_frame_limit-1:
+        if engine.timed_out[0]:
             print("Reset: Timed Out")
-            terminal = True
+        if engine.stuck_out[0]:
+            print(f"STUCK OUT: {engine.stuck_counter[0]}")
 
-        ## check to see if we're moving.
-        b1 = (self.vars_dict['POSITION_X']==self.vars_dict_last['POSITION_X'])
-        b2 = (self.vars_dict['POSITION_Y']==self.vars_dict_last['POSITION_Y'])
-        if (b1 and b2):
-            self.w_varz['stuck_counter'] += 1
-            if self.w_varz['stuck_counter'] >= 40:
-                reward += self.r_rules['stuck']
-            if self.w_varz['stuck_counter'] >= 300:
-                print(f"STUCK OUT: {self.w_varz['stuck_counter']}")
-                reward = self.r_rules['stuck_timeout']
-                terminal = True
+        if self.recording is not None:
+            self.recording['actions'].append(action)
+            self.recording['rewards'].append(reward)
+            self.recording['terminals'].append(terminal)
 
-        self.vars_dict_last = self.vars_dict.copy()
+        return reward, terminal
 
-        self.w_varz['reward_que'].append(reward)
-        avg_reward = round(np.mean(self.w_varz['reward_que']),2)
+    def count_enemies(self, labels):
+        """Enemy labels on screen; names are checked against a set, not the list."""
+        return sum(str(label.object_name) in self.enemy_names for label in labels)
 
-        return avg_reward, terminal
+    def observe(self, state):
+        """Label feature vector of a state, for the models' extra inputs."""
+        return self.label_features.vector(self.label_features(state.labels, state.labels_buffer))
 
     def resize(self, img, wrong_way_bool=False):
+        """The original float64 preprocessing; self.preprocess gives the same frame as uint8."""
         img = np.array(img)
         img = cv2.resize(img, (self.xy, self.xy))
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) #we're already BG
+        if img.ndim == 3: #GRAY8 profiles arrive single channel already.
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) #we're already BG
         #equalize the image for greater contrast.
         img = cv2.equalizeHist(img)
 
@@ -397,10 +509,23 @@ class DoomGame():
 
         return img
 
+    def training_state(self):
+        """w_varz, r_rules and the reward engine counters, for training snapshots."""
+        return {'w_varz': self.w_varz, 'r_rules': self.r_rules,
+                'reward_engine': self.reward_engine.state_dict()}
+
+    def load_training_state(self, state):
+        self.w_varz.update(state['w_varz'])
+        self.enemy_names = frozenset(self.w_varz['enemy_names'])
+        self.label_features = LabelFeatures(self.enemy_names)
+        self.r_rules.update(state['r_rules'])
+        self.r_rules.update(self.r_rules_overrides) #like the running params, configured rules stay in charge.
+        self.reward_engine.compile(self.r_rules)
+        self.reward_engine.load_state_dict(state['reward_engine'])
+
     def wrapper_reset(self):
-        self.w_varz['stuck_counter'] = 0
         self.scored_kill = False #reset the variable
-        self.w_varz['reward_que'] = deque(maxlen=10)
+        self.reward_engine.reset() #stuck counter and reward average
 
 if __name__ == "__main__":
 
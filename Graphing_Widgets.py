@@ -1247,6 +1247,13 @@ class QuickImageWidget(qtw.QWidget):
         os.chdir(self.home_dir)#home first
         os.chdir("Dataset")
         os.chdir(directory)
+
+        #packed dataset (Doom_Dataset); frames are memory-mapped, nothing is decoded up front.
+        if os.path.exists('index.npz'):
+            from Doom_Dataset import PackedDataset
+            self.frame_buffer = PackedDataset(os.getcwd()).frames
+            return
+
         self.file_list = os.listdir()
         self.file_list = natural_sorter(self.file_list)
 
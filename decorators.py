@@ -0,0 +1,15 @@
+"""
+Small timing helpers. For per-phase timing of the training step see Doom_Profiler.
+"""
+import functools
+from time import perf_counter
+
+def function_timer(func):
+    """Prints how long every call of func took."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        t0 = perf_counter()
+        result = func(*args, **kwargs)
+        print(f"{func.__name__}: {round(perf_counter() - t0, 4)}s")
+        return result
+    return wrapper